@@ -1,7 +1,6 @@
 """
 Django views for the API endpoints.
 """
-import json
 import asyncio
 import re
 from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
@@ -30,13 +29,13 @@ app_dir = Path(__file__).resolve().parent.parent / 'app'
 sys.path.insert(0, str(app_dir))
 
 from ai_service_v2 import (
-    detect_user_intent, generate_todo_list, generate_project_description,
-    extract_project_requirements, generate_code_with_streaming, estimate_tokens
+    analyze_prompt_stream, unpack_analysis, stream_page_files, estimate_tokens
 )
 from design_references import (
     get_design_reference, detect_design_type_from_prompt
 )
 from ai_providers import get_provider
+from json_stream import json_dumps_text
 from ai_service import get_remaining_tokens
 
 
@@ -389,55 +388,68 @@ async def stream_project_creation(prompt: str, project_name: str, provider_name:
         try:
             provider = get_provider(provider_name)
         except Exception as provider_error:
-            yield f"data: {json.dumps({'type': 'error', 'message': f'Failed to initialize {provider_name} provider: {str(provider_error)}'})}\n\n"
+            yield f"data: {json_dumps_text({'type': 'error', 'message': f'Failed to initialize {provider_name} provider: {str(provider_error)}'})}\n\n"
             return
         
-        # Step 0: Detect user intent
-        yield f"data: {json.dumps({'type': 'thinking', 'message': 'Understanding your request...'})}\n\n"
+        # Steps 0-2: Detect intent and plan the project in one streamed token call -
+        # the description and each todo item are sent as soon as they are parsed
+        yield f"data: {json_dumps_text({'type': 'thinking', 'message': 'Understanding your request...'})}\n\n"
         
-        intent_result = detect_user_intent(prompt, provider)
+        analysis = None
+        todo_list = []
+        async for event, value in analyze_prompt_stream(prompt, provider):
+            if event == "description":
+                # Step 1: Project description
+                yield f"data: {json_dumps_text({'type': 'thinking', 'message': 'Generating project description...'})}\n\n"
+                yield f"data: {json_dumps_text({'type': 'description', 'description': value})}\n\n"
+                
+                # Step 2: Todo list
+                yield f"data: {json_dumps_text({'type': 'thinking', 'message': 'Creating detailed plan...'})}\n\n"
+            elif event == "todo":
+                todo_item = {
+                    "id": value.get("id", len(todo_list) + 1),
+                    "task": value.get("task", ""),
+                    "completed": False
+                }
+                todo_list.append(todo_item)
+                
+                task_text = todo_item["task"]
+                for i in range(len(task_text) + 1):
+                    partial_task = task_text[:i]
+                    yield f"data: {json_dumps_text({'type': 'todo_typing', 'todo_id': todo_item['id'], 'partial_task': partial_task})}\n\n"
+                    await asyncio.sleep(0.03)
+                
+                yield f"data: {json_dumps_text({'type': 'todo_item', 'todo': todo_item})}\n\n"
+            else:
+                analysis = value
+        
+        intent_result, description, _, project_requirements = unpack_analysis(analysis)
         usage = intent_result.get("usage", {})
         total_tokens_used += usage.get("total_tokens", estimate_tokens(prompt))
         
         if intent_result.get("intent") != "create_webpage":
-            yield f"data: {json.dumps({'type': 'conversation', 'message': intent_result.get('response', 'How can I help you?'), 'intent': intent_result.get('intent')})}\n\n"
+            yield f"data: {json_dumps_text({'type': 'conversation', 'message': intent_result.get('response', 'How can I help you?'), 'intent': intent_result.get('intent')})}\n\n"
             return
         
-        # Step 1: Generate project description
-        yield f"data: {json.dumps({'type': 'thinking', 'message': 'Generating project description...'})}\n\n"
-        
-        description = generate_project_description(prompt, provider)
-        total_tokens_used += estimate_tokens(prompt + description)
-        
-        yield f"data: {json.dumps({'type': 'description', 'description': description})}\n\n"
-        
-        # Step 2: Generate todo list
-        yield f"data: {json.dumps({'type': 'thinking', 'message': 'Creating detailed plan...'})}\n\n"
-        
-        todo_list_data = generate_todo_list(prompt, provider)
-        total_tokens_used += estimate_tokens(prompt + str(todo_list_data))
+        # Add design reference if detected
+        design_type = detect_design_type_from_prompt(prompt)
+        if design_type:
+            design_ref = get_design_reference(design_type)
+            if design_ref:
+                project_requirements["design_reference"] = design_type
+                project_requirements["design_description"] = design_ref.get("description", "")
+                project_requirements["design_colors"] = design_ref.get("color_scheme", [])
         
-        todo_list = []
-        for idx, item in enumerate(todo_list_data, 1):
-            todo_item = {
-                "id": item.get("id", idx),
-                "task": item.get("task", ""),
-                "completed": False
-            }
-            todo_list.append(todo_item)
-            
-            task_text = todo_item["task"]
-            for i in range(len(task_text) + 1):
-                partial_task = task_text[:i]
-                yield f"data: {json.dumps({'type': 'todo_typing', 'todo_id': todo_item['id'], 'partial_task': partial_task})}\n\n"
-                await asyncio.sleep(0.03)
-            
-            yield f"data: {json.dumps({'type': 'todo_item', 'todo': todo_item})}\n\n"
+        # Start generating HTML now - it streams into a buffer while the plan is
+        # finished and the project is set up below
+        # (CSS and JS follow on their own once the start of the HTML exists)
+        page_streams = stream_page_files(prompt, project_requirements, provider)
+        html_lines = page_streams["html"]
         
-        yield f"data: {json.dumps({'type': 'todo_complete'})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'todo_complete'})}\n\n"
         
         # Step 3: Create project in database
-        yield f"data: {json.dumps({'type': 'thinking', 'message': 'Setting up project structure...'})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'thinking', 'message': 'Setting up project structure...'})}\n\n"
         
         # Use sync_to_async to wrap Django ORM call
         def create_project_sync():
@@ -453,41 +465,31 @@ async def stream_project_creation(prompt: str, project_name: str, provider_name:
         
         await asyncio.sleep(0.3)
         
-        yield f"data: {json.dumps({'type': 'project_created', 'project_id': project_id})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'project_created', 'project_id': project_id})}\n\n"
         
         create_project_directory(project_id)
         await asyncio.sleep(0.2)
         
         if todo_list:
             todo_list[0]["completed"] = True
-            yield f"data: {json.dumps({'type': 'task_complete', 'task_id': todo_list[0]['id'], 'completed_count': 1, 'total_tasks': len(todo_list)})}\n\n"
+            yield f"data: {json_dumps_text({'type': 'task_complete', 'task_id': todo_list[0]['id'], 'completed_count': 1, 'total_tasks': len(todo_list)})}\n\n"
         
-        # Step 4: Extract project requirements
-        yield f"data: {json.dumps({'type': 'thinking', 'message': 'Analyzing design requirements deeply...'})}\n\n"
+        # Step 4: Project requirements
+        yield f"data: {json_dumps_text({'type': 'thinking', 'message': 'Analyzing design requirements deeply...'})}\n\n"
         await asyncio.sleep(5)
         
-        project_requirements = extract_project_requirements(prompt, provider)
-        total_tokens_used += estimate_tokens(prompt)
-        
-        design_type = detect_design_type_from_prompt(prompt)
-        if design_type:
-            design_ref = get_design_reference(design_type)
-            if design_ref:
-                project_requirements["design_reference"] = design_type
-                project_requirements["design_description"] = design_ref.get("description", "")
-                project_requirements["design_colors"] = design_ref.get("color_scheme", [])
-        
         # Step 5: Generate HTML code
-        yield f"data: {json.dumps({'type': 'task_start', 'task_id': 2, 'task': 'Creating HTML structure'})}\n\n"
-        yield f"data: {json.dumps({'type': 'thinking', 'message': 'Deeply analyzing requirements and generating beautiful HTML structure...'})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'task_start', 'task_id': 2, 'task': 'Creating HTML structure'})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'thinking', 'message': 'Deeply analyzing requirements and generating beautiful HTML structure...'})}\n\n"
         await asyncio.sleep(8)
         
-        yield f"data: {json.dumps({'type': 'code_start', 'file': 'index.html'})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'code_start', 'file': 'index.html'})}\n\n"
         await asyncio.sleep(0.3)
-        html_code = ""
-        async for line in generate_code_with_streaming(prompt, project_requirements, "", provider, "html"):
-            html_code += line
-            yield f"data: {json.dumps({'type': 'code_line', 'file': 'index.html', 'line': line})}\n\n"
+        html_parts = []
+        async for chunk in html_lines:
+            html_parts.append(chunk)
+            yield f"data: {json_dumps_text({'type': 'code_line', 'file': 'index.html', 'line': chunk})}\n\n"
+        html_code = "".join(html_parts)
         
         html_tokens = estimate_tokens(prompt + html_code)
         total_tokens_used += html_tokens
@@ -495,32 +497,36 @@ async def stream_project_creation(prompt: str, project_name: str, provider_name:
             token_info = get_remaining_tokens()
             token_limit = token_info.get("limit", 30000)
             remaining_tokens = token_limit - total_tokens_used if token_limit else None
-            yield f"data: {json.dumps({'type': 'tokens_update', 'remaining_tokens': remaining_tokens, 'token_limit': token_limit})}\n\n"
+            yield f"data: {json_dumps_text({'type': 'tokens_update', 'remaining_tokens': remaining_tokens, 'token_limit': token_limit})}\n\n"
         except:
             pass
         
         save_file(project_id, "index.html", html_code)
-        yield f"data: {json.dumps({'type': 'code_complete', 'file': 'index.html', 'content': html_code, 'file_size': len(html_code)})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'code_complete', 'file': 'index.html', 'content': html_code, 'file_size': len(html_code)})}\n\n"
+        
+        css_lines = page_streams["css"]
+        js_lines = page_streams["js"]
         
         wait_time = min(2 + (len(html_code) / 1000), 5)
         await asyncio.sleep(wait_time)
         
         if len(todo_list) > 1:
             todo_list[1]["completed"] = True
-            yield f"data: {json.dumps({'type': 'task_complete', 'task_id': todo_list[1]['id'], 'completed_count': 2, 'total_tasks': len(todo_list)})}\n\n"
+            yield f"data: {json_dumps_text({'type': 'task_complete', 'task_id': todo_list[1]['id'], 'completed_count': 2, 'total_tasks': len(todo_list)})}\n\n"
         await asyncio.sleep(2)
         
         # Step 6: Generate CSS code
-        yield f"data: {json.dumps({'type': 'task_start', 'task_id': 3, 'task': 'Designing CSS styling'})}\n\n"
-        yield f"data: {json.dumps({'type': 'thinking', 'message': 'Creating beautiful, responsive CSS with animations and modern design...'})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'task_start', 'task_id': 3, 'task': 'Designing CSS styling'})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'thinking', 'message': 'Creating beautiful, responsive CSS with animations and modern design...'})}\n\n"
         await asyncio.sleep(8)
         
-        yield f"data: {json.dumps({'type': 'code_start', 'file': 'style.css'})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'code_start', 'file': 'style.css'})}\n\n"
         await asyncio.sleep(0.3)
-        css_code = ""
-        async for line in generate_code_with_streaming(prompt, project_requirements, html_code, provider, "css"):
-            css_code += line
-            yield f"data: {json.dumps({'type': 'code_line', 'file': 'style.css', 'line': line})}\n\n"
+        css_parts = []
+        async for chunk in css_lines:
+            css_parts.append(chunk)
+            yield f"data: {json_dumps_text({'type': 'code_line', 'file': 'style.css', 'line': chunk})}\n\n"
+        css_code = "".join(css_parts)
         
         css_tokens = estimate_tokens(prompt + css_code)
         total_tokens_used += css_tokens
@@ -528,32 +534,33 @@ async def stream_project_creation(prompt: str, project_name: str, provider_name:
             token_info = get_remaining_tokens()
             token_limit = token_info.get("limit", 30000)
             remaining_tokens = token_limit - total_tokens_used if token_limit else None
-            yield f"data: {json.dumps({'type': 'tokens_update', 'remaining_tokens': remaining_tokens, 'token_limit': token_limit})}\n\n"
+            yield f"data: {json_dumps_text({'type': 'tokens_update', 'remaining_tokens': remaining_tokens, 'token_limit': token_limit})}\n\n"
         except:
             pass
         
         save_file(project_id, "style.css", css_code)
-        yield f"data: {json.dumps({'type': 'code_complete', 'file': 'style.css', 'content': css_code, 'file_size': len(css_code)})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'code_complete', 'file': 'style.css', 'content': css_code, 'file_size': len(css_code)})}\n\n"
         
         wait_time = min(2 + (len(css_code) / 1000), 5)
         await asyncio.sleep(wait_time)
         
         if len(todo_list) > 2:
             todo_list[2]["completed"] = True
-            yield f"data: {json.dumps({'type': 'task_complete', 'task_id': todo_list[2]['id'], 'completed_count': 3, 'total_tasks': len(todo_list)})}\n\n"
+            yield f"data: {json_dumps_text({'type': 'task_complete', 'task_id': todo_list[2]['id'], 'completed_count': 3, 'total_tasks': len(todo_list)})}\n\n"
         await asyncio.sleep(2)
         
         # Step 7: Generate JavaScript code
-        yield f"data: {json.dumps({'type': 'task_start', 'task_id': 4, 'task': 'Adding JavaScript functionality'})}\n\n"
-        yield f"data: {json.dumps({'type': 'thinking', 'message': 'Implementing interactive JavaScript features...'})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'task_start', 'task_id': 4, 'task': 'Adding JavaScript functionality'})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'thinking', 'message': 'Implementing interactive JavaScript features...'})}\n\n"
         await asyncio.sleep(8)
         
-        yield f"data: {json.dumps({'type': 'code_start', 'file': 'script.js'})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'code_start', 'file': 'script.js'})}\n\n"
         await asyncio.sleep(0.3)
-        js_code = ""
-        async for line in generate_code_with_streaming(prompt, project_requirements, html_code, provider, "js"):
-            js_code += line
-            yield f"data: {json.dumps({'type': 'code_line', 'file': 'script.js', 'line': line})}\n\n"
+        js_parts = []
+        async for chunk in js_lines:
+            js_parts.append(chunk)
+            yield f"data: {json_dumps_text({'type': 'code_line', 'file': 'script.js', 'line': chunk})}\n\n"
+        js_code = "".join(js_parts)
         
         js_tokens = estimate_tokens(prompt + js_code)
         total_tokens_used += js_tokens
@@ -561,25 +568,25 @@ async def stream_project_creation(prompt: str, project_name: str, provider_name:
             token_info = get_remaining_tokens()
             token_limit = token_info.get("limit", 30000)
             remaining_tokens = token_limit - total_tokens_used if token_limit else None
-            yield f"data: {json.dumps({'type': 'tokens_update', 'remaining_tokens': remaining_tokens, 'token_limit': token_limit})}\n\n"
+            yield f"data: {json_dumps_text({'type': 'tokens_update', 'remaining_tokens': remaining_tokens, 'token_limit': token_limit})}\n\n"
         except:
             pass
         
         save_file(project_id, "script.js", js_code)
-        yield f"data: {json.dumps({'type': 'code_complete', 'file': 'script.js', 'content': js_code, 'file_size': len(js_code)})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'code_complete', 'file': 'script.js', 'content': js_code, 'file_size': len(js_code)})}\n\n"
         
         wait_time = min(2 + (len(js_code) / 1000), 5)
         await asyncio.sleep(wait_time)
         
         if len(todo_list) > 3:
             todo_list[3]["completed"] = True
-            yield f"data: {json.dumps({'type': 'task_complete', 'task_id': todo_list[3]['id'], 'completed_count': 4, 'total_tasks': len(todo_list)})}\n\n"
+            yield f"data: {json_dumps_text({'type': 'task_complete', 'task_id': todo_list[3]['id'], 'completed_count': 4, 'total_tasks': len(todo_list)})}\n\n"
         
         for idx in range(4, len(todo_list)):
             todo_list[idx]["completed"] = True
-            yield f"data: {json.dumps({'type': 'task_complete', 'task_id': todo_list[idx]['id'], 'completed_count': idx + 1, 'total_tasks': len(todo_list)})}\n\n"
+            yield f"data: {json_dumps_text({'type': 'task_complete', 'task_id': todo_list[idx]['id'], 'completed_count': idx + 1, 'total_tasks': len(todo_list)})}\n\n"
         
-        yield f"data: {json.dumps({'type': 'code_generated', 'message': 'All code files generated and saved successfully'})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'code_generated', 'message': 'All code files generated and saved successfully'})}\n\n"
         
         try:
             token_info = get_remaining_tokens()
@@ -589,13 +596,13 @@ async def stream_project_creation(prompt: str, project_name: str, provider_name:
             token_limit = 30000
             remaining_tokens = token_limit - total_tokens_used
         
-        yield f"data: {json.dumps({'type': 'complete', 'project_id': project_id, 'todo_list': todo_list, 'description': description, 'tokens_used': total_tokens_used, 'token_limit': token_limit, 'remaining_tokens': remaining_tokens})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'complete', 'project_id': project_id, 'todo_list': todo_list, 'description': description, 'tokens_used': total_tokens_used, 'token_limit': token_limit, 'remaining_tokens': remaining_tokens})}\n\n"
         
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
         print(f"Error in stream: {error_details}")
-        yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'error', 'message': str(e)})}\n\n"
 
 
 @csrf_exempt
@@ -649,16 +656,23 @@ def create_project_with_ai_stream(request):
                     import traceback
                     traceback.print_exc()
                     # Send error to client
-                    yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+                    yield f"data: {json_dumps_text({'type': 'error', 'message': str(e)})}\n\n"
                     break
         except Exception as e:
             print(f"Error setting up async generator: {e}")
             import traceback
             traceback.print_exc()
-            yield f"data: {json.dumps({'type': 'error', 'message': f'Failed to start stream: {str(e)}'})}\n\n"
+            yield f"data: {json_dumps_text({'type': 'error', 'message': f'Failed to start stream: {str(e)}'})}\n\n"
         finally:
             if loop:
                 try:
+                    # Stop background code generation left running by an error or a client disconnect
+                    pending = asyncio.all_tasks(loop)
+                    for task in pending:
+                        task.cancel()
+                    if pending:
+                        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+                    loop.run_until_complete(loop.shutdown_asyncgens())
                     loop.close()
                 except:
                     pass
@@ -1,7 +1,12 @@
-import json
+import asyncio
 import os
-from typing import Dict, List, Optional, Any
+import random
+import threading
+import time
+import weakref
+from typing import Dict, List, Optional, Any, AsyncIterator, Iterator
 from dotenv import load_dotenv
+from app.json_stream import json_dumps, json_loads
 
 load_dotenv()
 
@@ -9,16 +14,388 @@ load_dotenv()
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+# How long Ollama keeps the model (and its cached prompt prefix) loaded between requests
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Max concurrent in-flight LLM requests per event loop
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))
+
+# Retries for transient failures (rate limits, timeouts, 5xx), with exponential backoff + jitter
+AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", "3"))
+AI_RETRY_BASE_DELAY = float(os.getenv("AI_RETRY_BASE_DELAY", "1"))
+AI_RETRY_MAX_DELAY = float(os.getenv("AI_RETRY_MAX_DELAY", "30"))
+
+# Fixed sampling seed for reproducible output (unset = provider default)
+AI_SEED = int(os.getenv("AI_SEED")) if os.getenv("AI_SEED") else None
+
+# Account rate limits (requests / tokens per minute, 0 = unlimited), enforced
+# client-side so concurrent requests queue instead of tripping 429s
+GROQ_RPM = int(os.getenv("GROQ_RPM", "0"))
+GROQ_TPM = int(os.getenv("GROQ_TPM", "0"))
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "0"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "0"))
+
+# SDK / HTTP client exceptions worth retrying, matched by class name so the
+# optional groq, openai and requests packages need not be importable here
+_TRANSIENT_ERROR_NAMES = frozenset({
+    "APIConnectionError", "APITimeoutError", "RateLimitError", "InternalServerError",
+    "ConnectionError", "Timeout", "TimeoutError"
+})
+
+
+def is_json_format(response_format: Optional[Dict]) -> bool:
+    """True for JSON mode and JSON-schema (structured output) response formats."""
+    return bool(response_format) and response_format.get("type") in ("json_object", "json_schema")
+
+
+class TransientProviderError(Exception):
+    """A provider call failed in a way that is likely to succeed on retry."""
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """True for rate-limit, timeout, connection and server errors."""
+    if isinstance(error, TransientProviderError):
+        return True
+    status_code = getattr(error, "status_code", None)
+    if isinstance(status_code, int) and (status_code == 429 or status_code >= 500):
+        return True
+    return any(cls.__name__ in _TRANSIENT_ERROR_NAMES for cls in type(error).__mro__)
+
+
+def retry_delay(attempt: int) -> float:
+    """Seconds to wait before retry number attempt + 1."""
+    return min(AI_RETRY_MAX_DELAY, AI_RETRY_BASE_DELAY * 2 ** attempt + random.uniform(0, AI_RETRY_BASE_DELAY))
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds from the Retry-After header of a rate-limited SDK/HTTP error, if any."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    value = headers.get("retry-after") if headers is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class RateLimiter:
+    """Token buckets for requests and tokens per minute, shared by every caller of one model.
+    
+    reserve() books capacity immediately and returns how long the caller must wait
+    before sending, so the lock is never held while sleeping and the same limiter
+    serves worker threads and any number of event loops. A rate of 0 disables that
+    bucket; block() pauses everyone after a 429 with Retry-After.
+    """
+    
+    def __init__(self, requests_per_minute: int = 0, tokens_per_minute: int = 0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+    
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+    
+    def reserve(self, tokens: int) -> float:
+        """Book one request using about tokens tokens; return seconds to wait before sending it."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, self._blocked_until - now)
+            if self.requests_per_minute:
+                self._requests -= 1
+                wait = max(wait, -self._requests * 60 / self.requests_per_minute)
+            if self.tokens_per_minute:
+                # A request larger than the whole bucket waits for a full bucket, not forever
+                self._tokens -= min(tokens, self.tokens_per_minute)
+                wait = max(wait, -self._tokens * 60 / self.tokens_per_minute)
+            return wait
+    
+    def acquire(self, tokens: int) -> None:
+        time.sleep(self.reserve(tokens))
+    
+    async def acquire_async(self, tokens: int) -> None:
+        await asyncio.sleep(self.reserve(tokens))
+    
+    def settle(self, reserved: int, used: int) -> None:
+        """Correct a reservation with the tokens the request actually used."""
+        if not self.tokens_per_minute:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.tokens_per_minute, self._tokens + min(reserved, self.tokens_per_minute) - used)
+    
+    def block(self, seconds: float) -> None:
+        """Hold every request for seconds (a provider-supplied Retry-After)."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+# One semaphore per event loop (Django runs each stream in its own loop)
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    """Get the concurrency-limiting semaphore for the running event loop."""
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+        _semaphores[loop] = semaphore
+    return semaphore
+
+
+# Provider instances (and the HTTP connection pools they own) are shared across requests
+_providers: Dict[str, "AIProvider"] = {}
+_providers_lock = threading.RLock()
+_http_session = None
+_httpx_client = None
+_rate_limiters: Dict[tuple, RateLimiter] = {}
+
+
+def get_http_session():
+    """Get the shared keep-alive requests.Session used by REST-based providers."""
+    global _http_session
+    if _http_session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        with _providers_lock:
+            if _http_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(AI_MAX_CONCURRENCY, 10))
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _http_session = session
+    return _http_session
+
+
+def get_httpx_client():
+    """Get the shared keep-alive httpx.Client passed to the Groq and OpenAI SDKs.
+    
+    One pool for both, sized for AI_MAX_CONCURRENCY worker threads, so concurrent
+    calls reuse warm TLS connections. HTTP/2 is used when the h2 package is installed.
+    """
+    global _httpx_client
+    if _httpx_client is None:
+        import httpx
+        with _providers_lock:
+            if _httpx_client is None:
+                try:
+                    import h2  # noqa: F401
+                    http2 = True
+                except ImportError:
+                    http2 = False
+                _httpx_client = httpx.Client(
+                    http2=http2,
+                    follow_redirects=True,
+                    limits=httpx.Limits(
+                        max_connections=max(AI_MAX_CONCURRENCY * 2, 20),
+                        max_keepalive_connections=max(AI_MAX_CONCURRENCY * 2, 20)
+                    )
+                )
+    return _httpx_client
+
 
 class AIProvider:
     """Base class for AI providers"""
     
+    requests_per_minute = 0
+    tokens_per_minute = 0
+    # Whether the API enforces {"type": "json_schema"} formats; others fall back to JSON mode
+    supports_json_schema = False
+    # Whether JSON mode can be combined with streaming; if not, streamed requests are
+    # sent without response_format and rely on the prompt asking for JSON
+    supports_json_streaming = True
+    
+    def rate_limiter(self, model: str = None) -> RateLimiter:
+        """Get the limiter shared by every request to this provider and model."""
+        key = (type(self).__name__, model or getattr(self, "default_model", None))
+        limiter = _rate_limiters.get(key)
+        if limiter is None:
+            with _providers_lock:
+                limiter = _rate_limiters.setdefault(key, RateLimiter(self.requests_per_minute, self.tokens_per_minute))
+        return limiter
+    
+    def _request_tokens(self, messages: List[Dict], max_tokens: int) -> int:
+        """Tokens to reserve for a request: the prompt plus the most it may generate."""
+        return self.estimate_tokens("".join(message.get("content") or "" for message in messages)) + max_tokens
+    
+    def _with_parsed_json(self, response: Dict[str, Any], response_format: Optional[Dict]) -> Dict[str, Any]:
+        """In JSON mode, decode the content once here as response["parsed"] (None if it is not strict JSON)."""
+        if is_json_format(response_format):
+            try:
+                response["parsed"] = json_loads(response["content"])
+            except ValueError:
+                response["parsed"] = None
+        return response
+    
+    def _api_response_format(self, response_format: Optional[Dict]) -> Optional[Dict]:
+        if response_format and response_format.get("type") == "json_schema" and not self.supports_json_schema:
+            return {"type": "json_object"}
+        return response_format
+    
+    def _note_rate_limit(self, limiter: RateLimiter, error: BaseException) -> None:
+        seconds = retry_after(error)
+        if seconds:
+            limiter.block(min(seconds, AI_RETRY_MAX_DELAY))
+    
     def chat_completion(self, messages: List[Dict], model: str, temperature: float = 0.7, max_tokens: int = 4000, response_format: Optional[Dict] = None) -> Dict[str, Any]:
         raise NotImplementedError
     
+    def chat_completion_with_retry(self, messages: List[Dict], model: str = None, temperature: float = 0.7, max_tokens: int = 4000, response_format: Optional[Dict] = None) -> Dict[str, Any]:
+        """chat_completion, rate limited and retried with backoff on transient errors only."""
+        limiter = self.rate_limiter(model)
+        reserved = self._request_tokens(messages, max_tokens)
+        for attempt in range(AI_MAX_RETRIES + 1):
+            limiter.acquire(reserved)
+            try:
+                response = self.chat_completion(
+                    messages=messages,
+                    model=model,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    response_format=response_format
+                )
+            except Exception as e:
+                limiter.settle(reserved, 0)
+                if attempt >= AI_MAX_RETRIES or not is_transient_error(e):
+                    raise
+                self._note_rate_limit(limiter, e)
+            else:
+                limiter.settle(reserved, response.get("usage", {}).get("total_tokens") or reserved)
+                return self._with_parsed_json(response, response_format)
+            time.sleep(retry_delay(attempt))
+    
+    async def achat_completion(self, messages: List[Dict], model: str = None, temperature: float = 0.7, max_tokens: int = 4000, response_format: Optional[Dict] = None) -> Dict[str, Any]:
+        """Async chat completion - runs the blocking client call in a worker thread so
+        independent requests overlap on the event loop. Requests wait for the rate
+        limiter before taking a semaphore slot, and transient errors are retried with
+        backoff; the semaphore is released while waiting."""
+        limiter = self.rate_limiter(model)
+        reserved = self._request_tokens(messages, max_tokens)
+        for attempt in range(AI_MAX_RETRIES + 1):
+            await limiter.acquire_async(reserved)
+            try:
+                async with _get_semaphore():
+                    response = await asyncio.to_thread(
+                        self.chat_completion,
+                        messages=messages,
+                        model=model,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        response_format=response_format
+                    )
+            except Exception as e:
+                limiter.settle(reserved, 0)
+                if attempt >= AI_MAX_RETRIES or not is_transient_error(e):
+                    raise
+                self._note_rate_limit(limiter, e)
+            else:
+                limiter.settle(reserved, response.get("usage", {}).get("total_tokens") or reserved)
+                return self._with_parsed_json(response, response_format)
+            await asyncio.sleep(retry_delay(attempt))
+    
+    def stream_chat_completion(self, messages: List[Dict], model: str = None, temperature: float = 0.7, max_tokens: int = 4000, response_format: Optional[Dict] = None) -> Iterator[str]:
+        """Yield the completion as text deltas. Providers without native streaming
+        yield the whole response at once."""
+        yield self.chat_completion(
+            messages=messages,
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            response_format=response_format
+        )["content"]
+    
+    async def astream_chat_completion(self, messages: List[Dict], model: str = None, temperature: float = 0.7, max_tokens: int = 4000, response_format: Optional[Dict] = None) -> AsyncIterator[str]:
+        """Async streaming chat completion - the blocking stream is read in a worker
+        thread and each delta is handed to the event loop as soon as it arrives.
+        Transient errors are retried with backoff until the first delta is yielded."""
+        if not self.supports_json_streaming:
+            response_format = None
+        limiter = self.rate_limiter(model)
+        reserved = self._request_tokens(messages, max_tokens)
+        prompt_tokens = reserved - max_tokens
+        attempt = 0
+        while True:
+            await limiter.acquire_async(reserved)
+            streamed = []
+            stream = self._astream_once(messages, model, temperature, max_tokens, response_format)
+            try:
+                async for delta in stream:
+                    streamed.append(delta)
+                    yield delta
+                return
+            except Exception as e:
+                if streamed or attempt >= AI_MAX_RETRIES or not is_transient_error(e):
+                    raise
+                self._note_rate_limit(limiter, e)
+            finally:
+                await stream.aclose()
+                limiter.settle(reserved, prompt_tokens + self.estimate_tokens("".join(streamed)) if streamed else 0)
+            await asyncio.sleep(retry_delay(attempt))
+            attempt += 1
+    
+    async def _astream_once(self, messages: List[Dict], model: str, temperature: float, max_tokens: int, response_format: Optional[Dict]) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+        
+        def put(item):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                # Event loop already closed - consumer is gone
+                stop.set()
+        
+        def produce():
+            stream = self.stream_chat_completion(
+                messages=messages,
+                model=model,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                response_format=response_format
+            )
+            try:
+                for delta in stream:
+                    if stop.is_set():
+                        break
+                    if delta:
+                        put(delta)
+            except Exception as e:
+                put(e)
+            finally:
+                stream.close()
+                put(done)
+        
+        async with _get_semaphore():
+            worker = asyncio.ensure_future(asyncio.to_thread(produce))
+            try:
+                while True:
+                    item = await queue.get()
+                    if item is done:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+            finally:
+                stop.set()
+                await worker
+    
     def estimate_tokens(self, text: str) -> int:
-        """Estimate token count (rough approximation: 1 token ≈ 4 characters)"""
-        return len(text) // 4
+        """Estimate token count (rough approximation: 1 token ≈ 3 characters)"""
+        return len(text) // 3
+    
+    def warm(self) -> None:
+        """Open a pooled connection to the API ahead of the first real request."""
+        client = getattr(self, "client", None)
+        if client is not None:
+            client.models.list()
 
 
 class GroqProvider(AIProvider):
@@ -28,8 +405,13 @@ class GroqProvider(AIProvider):
         from groq import Groq
         if not GROQ_API_KEY:
             raise ValueError("GROQ_API_KEY environment variable is not set")
-        self.client = Groq(api_key=GROQ_API_KEY)
+        # Retries are handled by AIProvider so backoff is not applied twice
+        self.client = Groq(api_key=GROQ_API_KEY, max_retries=0, http_client=get_httpx_client())
         self.default_model = "llama-3.3-70b-versatile"
+        # Groq rejects JSON mode on streaming requests with a 400
+        self.supports_json_streaming = False
+        self.requests_per_minute = GROQ_RPM
+        self.tokens_per_minute = GROQ_TPM
     
     def chat_completion(self, messages: List[Dict], model: str = None, temperature: float = 0.7, max_tokens: int = 4000, response_format: Optional[Dict] = None) -> Dict[str, Any]:
         model = model or self.default_model
@@ -40,7 +422,9 @@ class GroqProvider(AIProvider):
             "max_tokens": max_tokens
         }
         if response_format:
-            params["response_format"] = response_format
+            params["response_format"] = self._api_response_format(response_format)
+        if AI_SEED is not None:
+            params["seed"] = AI_SEED
         
         response = self.client.chat.completions.create(**params)
         return {
@@ -51,6 +435,28 @@ class GroqProvider(AIProvider):
                 "total_tokens": response.usage.total_tokens if hasattr(response.usage, 'total_tokens') else 0
             }
         }
+    
+    def stream_chat_completion(self, messages: List[Dict], model: str = None, temperature: float = 0.7, max_tokens: int = 4000, response_format: Optional[Dict] = None) -> Iterator[str]:
+        params = {
+            "model": model or self.default_model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True
+        }
+        if response_format:
+            params["response_format"] = self._api_response_format(response_format)
+        if AI_SEED is not None:
+            params["seed"] = AI_SEED
+        
+        stream = self.client.chat.completions.create(**params)
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            if hasattr(stream, "close"):
+                stream.close()
 
 
 class OpenAIProvider(AIProvider):
@@ -64,8 +470,11 @@ class OpenAIProvider(AIProvider):
         
         if not OPENAI_API_KEY:
             raise ValueError("OPENAI_API_KEY environment variable is not set")
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
+        self.client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0, http_client=get_httpx_client())
         self.default_model = "gpt-4o-mini"
+        self.supports_json_schema = True
+        self.requests_per_minute = OPENAI_RPM
+        self.tokens_per_minute = OPENAI_TPM
     
     def chat_completion(self, messages: List[Dict], model: str = None, temperature: float = 0.7, max_tokens: int = 4000, response_format: Optional[Dict] = None) -> Dict[str, Any]:
         model = model or self.default_model
@@ -76,7 +485,9 @@ class OpenAIProvider(AIProvider):
             "max_tokens": max_tokens
         }
         if response_format:
-            params["response_format"] = response_format
+            params["response_format"] = self._api_response_format(response_format)
+        if AI_SEED is not None:
+            params["seed"] = AI_SEED
         
         response = self.client.chat.completions.create(**params)
         return {
@@ -87,6 +498,32 @@ class OpenAIProvider(AIProvider):
                 "total_tokens": response.usage.total_tokens
             }
         }
+    
+    def stream_chat_completion(self, messages: List[Dict], model: str = None, temperature: float = 0.7, max_tokens: int = 4000, response_format: Optional[Dict] = None) -> Iterator[str]:
+        params = {
+            "model": model or self.default_model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True
+        }
+        if response_format:
+            params["response_format"] = self._api_response_format(response_format)
+        if AI_SEED is not None:
+            params["seed"] = AI_SEED
+        
+        stream = self.client.chat.completions.create(**params)
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            if hasattr(stream, "close"):
+                stream.close()
+
+
+# Request bodies are pre-encoded (orjson when available) instead of passed as json=
+_JSON_HEADERS: Dict[str, str] = {"Content-Type": "application/json"}
 
 
 class OllamaProvider(AIProvider):
@@ -95,11 +532,12 @@ class OllamaProvider(AIProvider):
     def __init__(self):
         import requests
         self.requests = requests
+        self.session = get_http_session()
         self.base_url = OLLAMA_BASE_URL.rstrip('/')
         self.default_model = "llama3"  # Changed from llama3.2 to llama3
         # Test connection - make it optional, don't fail if server is slow
         try:
-            response = requests.get(f"{self.base_url}/api/tags", timeout=5)
+            response = self.session.get(f"{self.base_url}/api/tags", timeout=5)
             if response.status_code != 200:
                 print(f"Warning: Ollama server returned status {response.status_code}, but continuing...")
         except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
@@ -126,25 +564,27 @@ class OllamaProvider(AIProvider):
                 "temperature": temperature,
                 "num_predict": max_tokens
             },
-            "stream": False
+            "stream": False,
+            "keep_alive": OLLAMA_KEEP_ALIVE
         }
+        if AI_SEED is not None:
+            payload["options"]["seed"] = AI_SEED
         
         # If response_format is JSON, add format parameter
-        if response_format and response_format.get("type") == "json_object":
-            payload["format"] = "json"
+        if is_json_format(response_format):
+            payload["format"] = _ollama_format(response_format)
         
         try:
-            response = self.requests.post(
+            response = self.session.post(
                 f"{self.base_url}/api/chat",
-                json=payload,
+                data=json_dumps(payload),
+                headers=_JSON_HEADERS,
                 timeout=300  # Increased timeout for longer generations
             )
             
-            if response.status_code != 200:
-                error_text = response.text[:500] if response.text else "Unknown error"
-                raise Exception(f"Ollama API error (status {response.status_code}): {error_text}")
+            _raise_for_ollama_status(response)
             
-            data = response.json()
+            data = json_loads(response.content)
             content = data.get("message", {}).get("content", "")
             
             if not content:
@@ -158,18 +598,79 @@ class OllamaProvider(AIProvider):
                     "total_tokens": data.get("prompt_eval_count", 0) + data.get("eval_count", 0)
                 }
             }
-        except requests.exceptions.Timeout:
-            raise Exception(f"Ollama request timed out after 300 seconds. The model might be too slow or the request too large.")
-        except requests.exceptions.ConnectionError:
-            raise Exception(f"Cannot connect to Ollama server at {self.base_url}. Make sure Ollama is running.")
+        except self.requests.exceptions.Timeout:
+            raise TransientProviderError(f"Ollama request timed out after 300 seconds. The model might be too slow or the request too large.")
+        except self.requests.exceptions.ConnectionError:
+            raise TransientProviderError(f"Cannot connect to Ollama server at {self.base_url}. Make sure Ollama is running.")
+        except TransientProviderError:
+            raise
         except Exception as e:
             raise Exception(f"Ollama error: {str(e)}")
+    
+    def stream_chat_completion(self, messages: List[Dict], model: str = None, temperature: float = 0.7, max_tokens: int = 4000, response_format: Optional[Dict] = None) -> Iterator[str]:
+        payload = {
+            "model": model or self.default_model,
+            "messages": [{"role": msg["role"], "content": msg["content"]} for msg in messages],
+            "options": {
+                "temperature": temperature,
+                "num_predict": max_tokens
+            },
+            "stream": True,
+            "keep_alive": OLLAMA_KEEP_ALIVE
+        }
+        if AI_SEED is not None:
+            payload["options"]["seed"] = AI_SEED
+        if is_json_format(response_format):
+            payload["format"] = _ollama_format(response_format)
+        
+        try:
+            response = self.session.post(
+                f"{self.base_url}/api/chat",
+                data=json_dumps(payload),
+                headers=_JSON_HEADERS,
+                timeout=300,
+                stream=True
+            )
+        except self.requests.exceptions.Timeout:
+            raise TransientProviderError(f"Ollama request timed out after 300 seconds. The model might be too slow or the request too large.")
+        except self.requests.exceptions.ConnectionError:
+            raise TransientProviderError(f"Cannot connect to Ollama server at {self.base_url}. Make sure Ollama is running.")
+        
+        try:
+            _raise_for_ollama_status(response)
+            
+            # Ollama streams one JSON object per line
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                data = json_loads(line)
+                content = data.get("message", {}).get("content", "")
+                if content:
+                    yield content
+                if data.get("done"):
+                    break
+        finally:
+            response.close()
 
 
-def get_provider(provider_name: str = "groq") -> AIProvider:
-    """Get AI provider instance. Default is groq (direct)."""
-    provider_name = provider_name.lower()
-    
+def _ollama_format(response_format: Dict) -> Any:
+    # Ollama takes a JSON schema directly as the format to constrain output to
+    if response_format.get("type") == "json_schema":
+        return response_format["json_schema"]["schema"]
+    return "json"
+
+
+def _raise_for_ollama_status(response) -> None:
+    if response.status_code == 200:
+        return
+    error_text = response.text[:500] if response.text else "Unknown error"
+    message = f"Ollama API error (status {response.status_code}): {error_text}"
+    if response.status_code == 429 or response.status_code >= 500:
+        raise TransientProviderError(message)
+    raise Exception(message)
+
+
+def _create_provider(provider_name: str) -> AIProvider:
     if provider_name == "groq":
         return GroqProvider()
     elif provider_name == "openai":
@@ -179,3 +680,63 @@ def get_provider(provider_name: str = "groq") -> AIProvider:
     else:
         raise ValueError(f"Unknown provider: {provider_name}. Supported: groq, openai, ollama")
 
+
+def get_provider(provider_name: str = "groq") -> AIProvider:
+    """Get AI provider instance. Default is groq (direct).
+    
+    Instances are created once and reused so their HTTP connections stay alive
+    between requests instead of paying a new TCP/TLS handshake per call.
+    """
+    provider_name = provider_name.lower()
+    
+    provider = _providers.get(provider_name)
+    if provider is None:
+        with _providers_lock:
+            provider = _providers.get(provider_name)
+            if provider is None:
+                provider = _create_provider(provider_name)
+                _providers[provider_name] = provider
+    return provider
+
+
+# Connect to configured providers at startup so the first request skips the TLS handshake
+AI_WARM_CONNECTIONS = os.getenv("AI_WARM_CONNECTIONS", "true").lower() == "true"
+
+
+def warm_providers() -> None:
+    """Create the configured providers and open their pooled connections (blocking - run off the event loop)."""
+    if not AI_WARM_CONNECTIONS:
+        return
+    configured = [
+        name for name, enabled in (
+            ("groq", GROQ_API_KEY),
+            ("openai", OPENAI_API_KEY),
+            ("ollama", os.getenv("OLLAMA_BASE_URL"))
+        ) if enabled
+    ]
+    for name in configured:
+        try:
+            get_provider(name).warm()
+        except Exception as e:
+            print(f"Warning: could not warm up {name} provider: {str(e)}")
+
+
+def close_providers() -> None:
+    """Close pooled HTTP connections held by cached providers (call on shutdown)."""
+    global _http_session, _httpx_client
+    with _providers_lock:
+        for provider in _providers.values():
+            client = getattr(provider, "client", None)
+            if client is not None and hasattr(client, "close"):
+                try:
+                    client.close()
+                except Exception as e:
+                    print(f"Warning: failed to close AI client: {str(e)}")
+        _providers.clear()
+        if _http_session is not None:
+            _http_session.close()
+            _http_session = None
+        if _httpx_client is not None:
+            _httpx_client.close()
+            _httpx_client = None
+
@@ -1,17 +1,23 @@
+import functools
 import json
 import os
 from typing import Dict, List, Optional
-from groq import Groq
 from dotenv import load_dotenv
+from app.json_stream import parse_partial_json
 
 load_dotenv()
 
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
-if not GROQ_API_KEY:
-    raise ValueError("GROQ_API_KEY environment variable is not set")
 
-client = Groq(api_key=GROQ_API_KEY)
+@functools.lru_cache(maxsize=1)
+def _get_client():
+    """Create the Groq client on first use, so importing this module (e.g. for
+    get_remaining_tokens) loads neither the SDK nor requires the API key."""
+    from groq import Groq
+    if not GROQ_API_KEY:
+        raise ValueError("GROQ_API_KEY environment variable is not set")
+    return Groq(api_key=GROQ_API_KEY)
 
 
 def get_remaining_tokens() -> Dict[str, int]:
@@ -29,6 +35,18 @@ def get_remaining_tokens() -> Dict[str, int]:
     }
 
 
+def _strip_json_fence(content: str) -> str:
+    """Return the body of the first markdown code fence (```json or bare ```), or content unchanged."""
+    _, fence, after = content.partition("```")
+    if not fence:
+        return content
+    body, _, _ = after.partition("```")
+    body = body.strip()
+    if body.startswith("json"):
+        body = body[4:].strip()
+    return body
+
+
 def detect_user_intent(prompt: str) -> Dict[str, any]:
     """
     Detect user intent from the prompt.
@@ -59,7 +77,7 @@ The design should be based on the user's request and the design reference provid
 """
 
     try:
-        response = client.chat.completions.create(
+        response = _get_client().chat.completions.create(
             model="llama-3.3-70b-versatile",
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -73,16 +91,9 @@ The design should be based on the user's request and the design reference provid
         content = response.choices[0].message.content.strip()
         
         # Remove markdown if present
-        if "```json" in content:
-            content = content.split("```json")[1].split("```")[0].strip()
-        elif "```" in content:
-            parts = content.split("```")
-            if len(parts) > 1:
-                content = parts[1].strip()
-                if content.startswith("json"):
-                    content = content[4:].strip()
+        content = _strip_json_fence(content)
         
-        data = json.loads(content)
+        data = parse_partial_json(content)
         return data
     
     except Exception as e:
@@ -123,7 +134,7 @@ Include 5-8 tasks covering:
 Do not include any markdown formatting or explanations. Only return the raw JSON object."""
 
     try:
-        response = client.chat.completions.create(
+        response = _get_client().chat.completions.create(
             model="llama-3.3-70b-versatile",
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -137,7 +148,7 @@ Do not include any markdown formatting or explanations. Only return the raw JSON
         content = response.choices[0].message.content.strip()
         
         # Parse JSON
-        data = json.loads(content)
+        data = parse_partial_json(content)
         
         # Handle both array and object with array
         if isinstance(data, dict) and "todos" in data:
@@ -174,7 +185,7 @@ def generate_project_description(prompt: str) -> str:
 Provide a clear, concise description (2-3 sentences) of what the webpage will include and its key features."""
 
     try:
-        response = client.chat.completions.create(
+        response = _get_client().chat.completions.create(
             model="llama-3.3-70b-versatile",
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -202,7 +213,7 @@ def extract_project_requirements(prompt: str) -> Dict[str, any]:
 Return JSON: {"project_type": "...", "theme": "...", "colors": ["..."], "js_functions": ["..."]}"""
 
     try:
-        response = client.chat.completions.create(
+        response = _get_client().chat.completions.create(
             model="llama-3.3-70b-versatile",
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -214,10 +225,9 @@ Return JSON: {"project_type": "...", "theme": "...", "colors": ["..."], "js_func
         )
         
         content = response.choices[0].message.content.strip()
-        if "```json" in content:
-            content = content.split("```json")[1].split("```")[0].strip()
+        content = _strip_json_fence(content)
         
-        return json.loads(content)
+        return parse_partial_json(content)
     except:
         return {"project_type": "webpage", "theme": "modern", "colors": [], "js_functions": []}
 
@@ -357,7 +367,7 @@ Generate complete, working, RESPONSIVE code with PERFECT alignment and BEAUTIFUL
         if todo_list:
             context += f"\n\nTasks to complete: {', '.join([t.get('task', '') for t in todo_list])}"
         
-        response = client.chat.completions.create(
+        response = _get_client().chat.completions.create(
             model="llama-3.3-70b-versatile",
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -371,34 +381,13 @@ Generate complete, working, RESPONSIVE code with PERFECT alignment and BEAUTIFUL
         content = response.choices[0].message.content.strip()
         
         # Remove markdown code blocks if present
-        if "```json" in content:
-            content = content.split("```json")[1].split("```")[0].strip()
-        elif "```" in content:
-            # Try to extract JSON from code blocks
-            parts = content.split("```")
-            if len(parts) > 1:
-                content = parts[1].strip()
-                if content.startswith("json"):
-                    content = content[4:].strip()
+        content = _strip_json_fence(content)
         
         # Clean up content
         content = content.strip()
         
-        # Parse JSON
-        try:
-            code_data = json.loads(content)
-        except json.JSONDecodeError as json_err:
-            # Try to fix common JSON issues
-            print(f"JSON parse error, attempting to fix: {json_err}")
-            print(f"Content preview: {content[:500]}")
-            # Try to extract JSON object manually
-            start_idx = content.find("{")
-            end_idx = content.rfind("}")
-            if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
-                content = content[start_idx:end_idx+1]
-                code_data = json.loads(content)
-            else:
-                raise
+        # Parse JSON - text around the object, trailing commas and a truncated tail are repaired
+        code_data = parse_partial_json(content)
         
         # Validate structure
         if not all(key in code_data for key in ["html", "css", "js"]):
@@ -448,5 +437,5 @@ Generate complete, working, RESPONSIVE code with PERFECT alignment and BEAUTIFUL
 
 
 def estimate_tokens(text: str) -> int:
-    """Estimate token count (rough approximation: 1 token ≈ 4 characters)."""
-    return len(text) // 4
+    """Estimate token count (rough approximation: 1 token ≈ 3 characters)."""
+    return len(text) // 3
@@ -1,973 +1,1340 @@
-import json
-from typing import Dict, List, Optional, AsyncGenerator
+import asyncio
+import copy
+import functools
+import hashlib
+import os
+import re
+import string
+import sys
+from collections import deque
+from typing import Any, AsyncGenerator, AsyncIterator, Deque, Dict, Final, List, Optional, Tuple
 from app.ai_providers import get_provider, AIProvider
+from app.json_stream import IncrementalJsonParser, json_dumps_sorted, parse_partial_json
+from app.semantic_cache import SemanticCache, normalize_prompt
 
+# Prompt analysis results are reused for identical prompts (after case/whitespace
+# normalization). Bag-of-words similarity cannot tell "light theme" from "dark theme"
+# or "with" from "without", so near-duplicate matching (AI_CACHE_SIMILARITY < 1.0) is opt-in.
+_analysis_cache = SemanticCache(
+    threshold=float(os.getenv("AI_CACHE_SIMILARITY", "1.0")),
+    max_entries=int(os.getenv("AI_CACHE_MAX_ENTRIES", "512")),
+    ttl=float(os.getenv("AI_CACHE_TTL", "3600"))
+)
 
-def estimate_tokens(text: str) -> int:
-    """Estimate token count (rough approximation: 1 token ≈ 4 characters)"""
-    return len(text) // 4
+# Generated files are reused for the same normalized prompt, requirements, provider
+# and model (see _code_cache_key); matching is exact
+AI_CODE_CACHE_ENABLED = os.getenv("AI_CODE_CACHE", "true").lower() == "true"
+_code_cache = SemanticCache(
+    threshold=1.0,
+    max_entries=int(os.getenv("AI_CODE_CACHE_MAX_ENTRIES", "256")),
+    ttl=float(os.getenv("AI_CODE_CACHE_TTL", "86400"))
+)
 
 
-def detect_user_intent(prompt: str, provider: AIProvider) -> Dict[str, any]:
-    """Detect user intent from the prompt."""
-    system_prompt = """You are an intent detection assistant. Analyze user messages and determine their intent.
+# Exact token counts use tiktoken when it is installed; long texts are sampled
+TOKENIZER_MODEL = os.getenv("TOKENIZER_MODEL", "gpt-4o")
+_EXACT_TOKENS_MAX_CHARS = 2048
+_TOKEN_SAMPLE_WINDOWS = 8
+_TOKEN_SAMPLE_CHARS = 512
+
+
+@functools.lru_cache(maxsize=4)
+def _get_encoder(model: str):
+    """Load (once per model) the tiktoken encoder, or None when tiktoken is unavailable."""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"Warning: could not load tokenizer for {model}: {str(e)}")
+        return None
+
+
+def estimate_tokens(text: str, model: str = TOKENIZER_MODEL) -> int:
+    """Estimate token count.
+    
+    Short texts are tokenized exactly. Long texts (generated files) are estimated
+    from a few evenly spaced sample windows, so the cost stays O(sample) instead of
+    O(n). Falls back to 1 token ≈ 3 characters when tiktoken is not installed.
+    """
+    encoder = _get_encoder(model)
+    if encoder is None:
+        return len(text) // 3
+    if len(text) <= _EXACT_TOKENS_MAX_CHARS:
+        return _count_tokens(text, model)
+    
+    stride = (len(text) - _TOKEN_SAMPLE_CHARS) // (_TOKEN_SAMPLE_WINDOWS - 1)
+    sample_tokens = 0
+    for i in range(_TOKEN_SAMPLE_WINDOWS):
+        start = i * stride
+        sample_tokens += len(encoder.encode_ordinary(text[start:start + _TOKEN_SAMPLE_CHARS]))
+    chars_per_token = (_TOKEN_SAMPLE_WINDOWS * _TOKEN_SAMPLE_CHARS) / max(sample_tokens, 1)
+    return int(len(text) / chars_per_token)
+
+
+@functools.lru_cache(maxsize=1024)
+def _count_tokens(text: str, model: str) -> int:
+    # Cached for the short texts counted repeatedly (prompts, system text); long,
+    # one-off texts such as generated files are sampled instead and never pinned here
+    return len(_get_encoder(model).encode_ordinary(text))
+
+
+# Characters allowed in a fence language tag (```html, ```c++, ```objective-c)
+_FENCE_TAG_CHARS = frozenset(string.ascii_letters + string.digits + "_+-")
+
+
+def _strip_code_fence(content: str) -> str:
+    """Return the body of the first markdown code fence in content, or content itself.
+    
+    Uses forward str.find scans and slicing only; the no-fence case is a single scan.
+    """
+    start = content.find("```")
+    if start < 0:
+        return content.strip()
+    body = start + 3
+    
+    # Skip an optional language tag line such as ```html
+    newline = content.find("\n", body)
+    if newline >= 0 and _FENCE_TAG_CHARS.issuperset(content[body:newline].strip()):
+        body = newline + 1
+    
+    end = content.find("```", body)
+    return (content[body:end] if end >= 0 else content[body:]).strip()
+
+
+def _strip_json_fence(content: str) -> str:
+    """Remove a markdown fence wrapping a JSON payload, leaving fences inside its strings alone.
+    
+    Text around an unfenced payload is left for parse_partial_json, which skips
+    anything before the first bracket and after the closing one.
+    """
+    content = content.strip()
+    if content.startswith("```"):
+        newline = content.find("\n")
+        content = content[newline + 1:] if newline >= 0 else content[3:]
+        if content.endswith("```"):
+            content = content[:-3]
+    return content.strip()
+
+
+ANALYZE_SYSTEM_PROMPT: Final[str] = """You are the planning assistant for a webpage builder. Analyze the user's message and return ONLY a valid JSON object with ALL of these fields:
+{
+  "intent": "create_webpage" | "conversation" | "ideas",
+  "confidence": 0.0-1.0,
+  "response": "Your response to the user (only if intent is conversation or ideas)",
+  "description": "Brief, engaging project description (2-3 sentences) highlighting the key features and design approach",
+  "todos": [{"id": 1, "task": "Set up project structure"}, {"id": 2, "task": "Create HTML structure"}, ...],
+  "project_type": "todo list" | "coffee shop" | "portfolio" | "landing page" | ...,
+  "theme": "dark" | "light" | "modern" | "vintage" | ...,
+  "colors": ["specific colors mentioned by the user"],
+  "js_functions": ["JavaScript functions the page needs"]
+}
 
 Possible intents:
 1. "create_webpage" - User wants to create/build a webpage/website
 2. "conversation" - User is just chatting, greeting, or asking questions
 3. "ideas" - User wants project ideas or suggestions
 
-Return ONLY a valid JSON object:
-{
-  "intent": "create_webpage" | "conversation" | "ideas",
-  "confidence": 0.0-1.0,
-  "response": "Your response to the user (only if intent is conversation or ideas)"
+"todos" must have 5-7 tasks covering: project setup, HTML structure, CSS styling, JavaScript functionality, and final touches."""
+
+
+def _default_todo_list() -> List[Dict]:
+    return [
+        {"id": 1, "task": "Set up project structure"},
+        {"id": 2, "task": "Create HTML structure"},
+        {"id": 3, "task": "Design CSS styling"},
+        {"id": 4, "task": "Add JavaScript functionality"},
+        {"id": 5, "task": "Finalize and test"}
+    ]
+
+
+def _default_analysis(prompt: str) -> Dict[str, Any]:
+    return {
+        "intent": "create_webpage",
+        "confidence": 0.8,
+        "response": "",
+        "description": f"A beautiful, modern webpage based on: {prompt}",
+        "todos": _default_todo_list(),
+        "project_type": "webpage",
+        "theme": "modern",
+        "colors": [],
+        "js_functions": [],
+        "usage": {"total_tokens": estimate_tokens(prompt)}
+    }
+
+
+# Shared, never mutated request pieces - built once instead of on every call
+_JSON_RESPONSE_FORMAT: Final[Dict[str, str]] = {"type": "json_object"}
+# Shape of the analysis, enforced by providers with structured output (JSON mode elsewhere)
+_ANALYSIS_RESPONSE_FORMAT: Final[Dict[str, Any]] = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "prompt_analysis",
+        "schema": {
+            "type": "object",
+            "properties": {
+                "intent": {"type": "string", "enum": ["create_webpage", "conversation", "ideas"]},
+                "confidence": {"type": "number"},
+                "response": {"type": ["string", "null"]},
+                "description": {"type": "string"},
+                "todos": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {"id": {"type": "integer"}, "task": {"type": "string"}},
+                        "required": ["id", "task"]
+                    }
+                },
+                "project_type": {"type": "string"},
+                "theme": {"type": "string"},
+                "colors": {"type": "array", "items": {"type": "string"}},
+                "js_functions": {"type": "array", "items": {"type": "string"}}
+            },
+            "required": ["intent", "description", "todos"]
+        }
+    }
 }
+_ANALYZE_SYSTEM_MESSAGE: Final[Dict[str, str]] = {"role": "system", "content": ANALYZE_SYSTEM_PROMPT}
 
-"""
 
-    try:
-        response = provider.chat_completion(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=500,
-            response_format={"type": "json_object"}
-        )
-        
-        content = response["content"]
-        usage = response.get("usage", {})
-        
-        # Remove markdown if present
-        if "```json" in content:
-            content = content.split("```json")[1].split("```")[0].strip()
-        elif "```" in content:
-            parts = content.split("```")
-            if len(parts) > 1:
-                content = parts[1].strip()
-                if content.startswith("json"):
-                    content = content[4:].strip()
-        
-        result = json.loads(content)
-        result["usage"] = usage
+def _msgs(system: Any, user: str) -> List[Dict[str, str]]:
+    """Build a system + user message list; system may be a prebuilt message dict."""
+    if not isinstance(system, dict):
+        system = {"role": "system", "content": system}
+    return [system, {"role": "user", "content": user}]
+
+
+def _analysis_request(prompt: str) -> Dict[str, Any]:
+    """Build chat_completion arguments for the combined prompt analysis."""
+    return {
+        "messages": _msgs(_ANALYZE_SYSTEM_MESSAGE, prompt),
+        "temperature": 0.7,
+        "max_tokens": 1500,
+        "response_format": _ANALYSIS_RESPONSE_FORMAT
+    }
+
+
+def _is_todo(value: Any) -> bool:
+    return isinstance(value, dict) and bool(value.get("task"))
+
+
+def _analysis_from_data(data: Any, prompt: str, usage: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Merge parsed analysis JSON into the defaults, ignoring missing or malformed fields."""
+    result = _default_analysis(prompt)
+    if not isinstance(data, dict):
         return result
-    except Exception as e:
-        return {"intent": "create_webpage", "confidence": 0.8, "response": "", "usage": {"total_tokens": estimate_tokens(prompt)}}
+    
+    for key in ("intent", "confidence", "response", "description", "project_type", "theme"):
+        if data.get(key) is not None:
+            result[key] = data[key]
+    # The same few labels recur across requests - share one string object per value
+    for key in ("intent", "project_type", "theme"):
+        if isinstance(result[key], str):
+            result[key] = sys.intern(result[key])
+    for key in ("colors", "js_functions"):
+        if isinstance(data.get(key), list):
+            result[key] = [str(item) for item in data[key]]
+    
+    todos = data.get("todos")
+    if isinstance(todos, dict) and "tasks" in todos:
+        todos = todos["tasks"]
+    if isinstance(todos, list):
+        todos = [todo for todo in todos if _is_todo(todo)]
+        if todos:
+            result["todos"] = todos
+    
+    result["usage"] = usage or result["usage"]
+    return result
 
 
-def generate_project_description(prompt: str, provider: AIProvider) -> str:
-    """Generate project description - separate token call."""
-    system_prompt = """You are a creative web developer. Generate a brief, engaging project description based on the user's request.
-Keep it concise (2-3 sentences) and highlight the key features and design approach."""
+def _response_json(response: Dict[str, Any]) -> Any:
+    """Payload of a JSON-mode response: the provider's strict parse, else the fenced/repaired content."""
+    parsed = response.get("parsed")
+    if parsed is not None:
+        return parsed
+    return parse_partial_json(_strip_json_fence(response["content"]))
 
-    try:
-        response = provider.chat_completion(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Create a project description for: {prompt}"}
-            ],
-            temperature=0.8,
-            max_tokens=300
-        )
-        return response["content"].strip()
-    except Exception as e:
-        return f"A beautiful, modern webpage based on: {prompt}"
 
+def _parse_analysis(response: Dict[str, Any], prompt: str) -> Dict[str, Any]:
+    """Parse the combined analysis response, filling missing fields with defaults."""
+    data = _response_json(response)
+    return _analysis_from_data(data, prompt, response.get("usage"))
 
-def generate_todo_list(prompt: str, provider: AIProvider) -> List[Dict]:
-    """Generate todo list - separate token call."""
-    system_prompt = """You are a project planning assistant. Create a detailed todo list for building a webpage based on the user's request.
-Return ONLY a valid JSON array of objects, each with "id" (number) and "task" (string) fields.
-Example: [{"id": 1, "task": "Set up project structure"}, {"id": 2, "task": "Create HTML structure"}, ...]
-Include 5-7 tasks covering: project setup, HTML structure, CSS styling, JavaScript functionality, and final touches."""
 
+def _provider_key(provider: AIProvider) -> str:
+    """Identify the provider and model, so cached results are never shared between them."""
+    return f"{type(provider).__name__}:{getattr(provider, 'default_model', '')}"
+
+
+def _cached_analysis(prompt: str, provider: AIProvider) -> Optional[Dict[str, Any]]:
+    """Return a copy of this provider's cached analysis for this (or a near-identical) prompt."""
+    cached = _analysis_cache.get(prompt, _provider_key(provider))
+    if cached is None:
+        return None
+    result = copy.deepcopy(cached)
+    result["usage"] = {"total_tokens": 0, "cached": True}
+    return result
+
+
+def analyze_prompt(prompt: str, provider: AIProvider) -> Dict[str, Any]:
+    """Detect intent and plan the project in a single token call.
+    
+    Returns a flat dict with intent, confidence, response, description, todos,
+    project_type, theme, colors, js_functions and usage.
+    """
+    cached = _cached_analysis(prompt, provider)
+    if cached is not None:
+        return cached
+    response = provider.chat_completion_with_retry(**_analysis_request(prompt))
     try:
-        response = provider.chat_completion(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=800,
-            response_format={"type": "json_object"}
-        )
-        
-        content = response["content"]
-        if "```json" in content:
-            content = content.split("```json")[1].split("```")[0].strip()
-        
-        data = json.loads(content)
-        if isinstance(data, dict) and "tasks" in data:
-            return data["tasks"]
-        elif isinstance(data, list):
-            return data
-        else:
-            # Fallback
-            return [
-                {"id": 1, "task": "Set up project structure"},
-                {"id": 2, "task": "Create HTML structure"},
-                {"id": 3, "task": "Design CSS styling"},
-                {"id": 4, "task": "Add JavaScript functionality"},
-                {"id": 5, "task": "Finalize and test"}
-            ]
-    except Exception as e:
-        return [
-            {"id": 1, "task": "Set up project structure"},
-            {"id": 2, "task": "Create HTML structure"},
-            {"id": 3, "task": "Design CSS styling"},
-            {"id": 4, "task": "Add JavaScript functionality"},
-            {"id": 5, "task": "Finalize and test"}
-        ]
+        result = _parse_analysis(response, prompt)
+    except (ValueError, KeyError):
+        return _default_analysis(prompt)
+    _analysis_cache.set(prompt, copy.deepcopy(result), _provider_key(provider))
+    return result
 
 
-def extract_project_requirements(prompt: str, provider: AIProvider) -> Dict[str, any]:
-    """Extract theme, colors, and project type - separate token call."""
-    system_prompt = """Analyze the user's request and extract:
-1. Project type (todo list, coffee shop, portfolio, landing page, etc.)
-2. Theme preferences (dark, light, modern, vintage, etc.)
-3. Color preferences (specific colors mentioned)
-4. Required JavaScript functions needed
+# Analyses in flight, so concurrent callers for the same prompt share one LLM call
+_inflight_analyses: Dict[Tuple[asyncio.AbstractEventLoop, str, str], "asyncio.Future[Dict[str, Any]]"] = {}
+
+
+async def analyze_prompt_async(prompt: str, provider: AIProvider) -> Dict[str, Any]:
+    """Async variant of analyze_prompt.
+    
+    Concurrent calls for the same prompt (e.g. the *_async field helpers gathered
+    together) wait on a single request instead of each sending their own.
+    """
+    cached = _cached_analysis(prompt, provider)
+    if cached is not None:
+        return cached
+    key = (asyncio.get_running_loop(), _provider_key(provider), normalize_prompt(prompt))
+    task = _inflight_analyses.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_analyze_uncached(prompt, provider))
+        _inflight_analyses[key] = task
+        task.add_done_callback(lambda _: _inflight_analyses.pop(key, None))
+    return copy.deepcopy(await asyncio.shield(task))
 
-Return JSON: {"project_type": "...", "theme": "...", "colors": ["..."], "js_functions": ["..."]}"""
 
+async def _analyze_uncached(prompt: str, provider: AIProvider) -> Dict[str, Any]:
+    response = await provider.achat_completion(**_analysis_request(prompt))
     try:
-        response = provider.chat_completion(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=300,
-            response_format={"type": "json_object"}
-        )
-        
-        content = response["content"]
-        if "```json" in content:
-            content = content.split("```json")[1].split("```")[0].strip()
-        
-        return json.loads(content)
-    except:
-        return {"project_type": "webpage", "theme": "modern", "colors": [], "js_functions": []}
+        result = _parse_analysis(response, prompt)
+    except (ValueError, KeyError):
+        return _default_analysis(prompt)
+    _analysis_cache.set(prompt, copy.deepcopy(result), _provider_key(provider))
+    return result
 
 
-async def generate_code_with_streaming(prompt: str, project_requirements: Dict, html_code: str, provider: AIProvider, code_type: str) -> AsyncGenerator[str, None]:
-    """Generate code with streaming - yields line by line for typing effect."""
-    import asyncio
+async def analyze_prompt_stream(prompt: str, provider: AIProvider) -> AsyncGenerator[Tuple[str, Any], None]:
+    """Streaming variant of analyze_prompt_async.
     
-    if code_type == "html":
-        system_prompt = """You are an expert web developer. Generate PREMIUM, PROFESSIONAL HTML code like Bolt.new with CARD-BASED LAYOUTS and MODERN STRUCTURE.
-        
-You are a webpage designer and developer, You will provide a better UI with responsive, modern, and clean design.
-The design should be based on the user's request and the design reference provided. 
-
-CRITICAL REQUIREMENTS FOR PREMIUM UI (LIKE BOLT.NEW):
-1. HTML must be properly formatted with correct indentation (2 spaces per level)
-2. Use semantic HTML5 elements (header, nav, main, section, footer, article, aside)
-3. Include proper viewport meta tag: <meta name="viewport" content="width=device-width, initial-scale=1.0">
-4. Include Google Fonts: <link href="https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;500;600;700;800&family=Inter:wght@300;400;500;600;700&family=Playfair+Display:wght@400;600;700&display=swap" rel="stylesheet">
-5. Include Font Awesome: <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css">
-6. If user requests Tailwind CSS: Include Tailwind CDN: <script src="https://cdn.tailwindcss.com"></script> in <head> and use Tailwind utility classes throughout HTML
-7. STRUCTURE MUST BE SPLIT INTO CLEAR SECTIONS:
-   - HEADER/NAVBAR (CRITICAL - MUST BE FULLY FUNCTIONAL):
-     * <header><nav class="navbar"> with logo and navigation links</nav></header>
-     * Navigation MUST work on all devices (desktop, tablet, mobile)
-     * Include hamburger menu for mobile: <button class="menu-toggle"><i class="fas fa-bars"></i></button>
-     * Navigation structure: <ul class="nav-menu"><li><a href="#section">Link</a></li></ul>
-     * Include JavaScript for mobile menu toggle functionality
-   - BODY/MAIN CONTENT: <main> with hero section, features, and other content sections</main>
-   - FOOTER: <footer> with links, copyright, and additional information
-   - Each section should be clearly separated and well-structured
-7. MODERN LAYOUT PATTERNS:
-   - HEADER (CRITICAL - MUST BE FUNCTIONAL): <header><nav class="navbar"> with logo, hamburger menu button (.menu-toggle), and navigation links in <ul class="nav-menu"></ul></nav></header>
-   - BODY: <main> with hero section, features section with cards in grid
-   - FOOTER: <footer> with links, social media, copyright
-   - ALWAYS include REAL IMAGES: Use public image URLs from free image services
-   - Image URLs must be RELATED to the content (e.g., coffee images for coffee shop, tech images for tech page)
-   - Use proper image URLs from these free image sources:
-     * Unsplash: https://images.unsplash.com/photo-... or https://unsplash.com/photos/...
-     * Pexels: https://images.pexels.com/photos/... or https://www.pexels.com/photo/...
-     * Pixabay: https://pixabay.com/photos/... or direct image URLs
-     * LibreShot: https://libreshot.com/... or direct image URLs
-     * Wikimedia Commons: https://commons.wikimedia.org/wiki/File:... or direct image URLs
-     * Flickr Creative Commons: https://live.staticflickr.com/... or https://www.flickr.com/photos/...
-   - CRITICAL - IMAGE SIZING: All images MUST have proper sizing attributes to prevent overflow:
-     * Add style="width: 100%; max-width: 100%; height: auto; object-fit: cover;" to all <img> tags
-     * Or use width="100%" and height="auto" attributes
-     * This prevents images from overflowing the page and causing horizontal/vertical scrolling
-   - NEVER use empty images, broken links, or placeholder.com
-   - Include at least 2-3 images: hero image, feature images, or section images
-   - Example URLs: https://images.unsplash.com/photo-1509042239860-f550ce710b93 (coffee), https://images.pexels.com/photos/2253275/pexels-photo-2253275.jpeg (coffee)
-8. DESIGN MUST BE PREMIUM QUALITY:
-   - Include multiple card elements for features, testimonials, products
-   - Use Font Awesome icons: <i class="fas fa-..."></i>
-   - Proper heading hierarchy (h1 for hero, h2 for sections, h3 for cards)
-   - Add badges, buttons with proper classes
-   - Include stats cards or testimonials if relevant
-9. CRITICAL: Do NOT include <link> tags for external CSS files
-10. CRITICAL: Do NOT include <script src=""> tags for external JS files
-11. All CSS and JS will be injected automatically - just provide the HTML structure
-
-Return ONLY the HTML code as a string. Do not include markdown code blocks, backticks, or explanations."""
-        
-        project_type = project_requirements.get("project_type", "webpage")
-        theme = project_requirements.get("theme", "modern")
-        colors = project_requirements.get("colors", [])
-        
-        # Check if user wants Tailwind CSS
-        use_tailwind = "tailwind" in prompt.lower() or "tailwind css" in prompt.lower()
-        
-        color_scheme = ""
-        if colors:
-            color_scheme = f"\nUser requested colors: {', '.join(colors)}. Use these colors."
-        elif theme:
-            if theme.lower() == "dark":
-                color_scheme = "\nUse a dark theme with colors like #1a1a1a, #2d2d2d, #ffffff, #4a9eff"
-            elif theme.lower() == "light":
-                color_scheme = "\nUse a light theme with colors like #ffffff, #f5f5f5, #333333, #007bff"
-            elif "coffee" in prompt.lower():
-                color_scheme = "\nUse warm coffee shop colors: #8B4513, #D2691E, #F5F5DC, #FFFFFF, #CD853F"
-        
-        tailwind_note = ""
-        if use_tailwind:
-            tailwind_note = "\n\nCRITICAL: User requested Tailwind CSS. Include <script src=\"https://cdn.tailwindcss.com\"></script> in <head> and use Tailwind utility classes (flex, grid, p-4, m-2, bg-blue-500, text-white, rounded-lg, etc.) throughout the HTML instead of custom CSS classes."
-        
-        # Add design reference if provided
-        design_reference_note = ""
-        if "design_reference" in project_requirements and project_requirements.get("design_reference"):
-            design_ref = project_requirements.get("design_reference")
-            design_reference_note = f"\n\nDESIGN REFERENCE: Follow the design style of {design_ref}. Use similar layout patterns, color schemes, and visual elements."
-        
-        if "design_examples" in project_requirements and project_requirements.get("design_examples"):
-            examples = project_requirements.get("design_examples", [])
-            design_reference_note += f"\n\nDESIGN EXAMPLES TO FOLLOW:\n" + "\n".join([f"- {ex}" for ex in examples])
+    The analysis JSON is parsed incrementally as tokens arrive, so the caller can
+    show the description and each todo item as soon as it is complete instead of
+    waiting for the whole response. Yields ("description", str) and ("todo", dict)
+    events - only once the intent is known to be create_webpage - and always ends
+    with ("analysis", dict), the same result analyze_prompt_async would return.
+    """
+    analysis = _cached_analysis(prompt, provider)
+    streamed_description = False
+    streamed_todos = 0
+    
+    if analysis is None:
+        parser = IncrementalJsonParser()
+        fields: Dict[str, Any] = {}
+        todos: List[Dict] = []
+        content = []
+        async for delta in provider.astream_chat_completion(**_analysis_request(prompt)):
+            content.append(delta)
+            if parser is None:
+                continue
+            try:
+                events = parser.feed(delta)
+            except ValueError:
+                # Malformed JSON - stop streaming fields and repair the full text at the end
+                parser = None
+                continue
+            for path, value in events:
+                if not path:
+                    continue
+                if len(path) == 1:
+                    fields[path[0]] = value
+                elif path[0] == "todos" and _is_todo(value) and (
+                        len(path) == 2 or (len(path) == 3 and path[1] == "tasks")):
+                    todos.append(value)
+                else:
+                    continue
+                
+                # Hold events back until we know the user actually wants a page
+                if fields.get("intent") != "create_webpage":
+                    continue
+                if not streamed_description and fields.get("description"):
+                    streamed_description = True
+                    yield "description", fields["description"]
+                while streamed_description and streamed_todos < len(todos):
+                    streamed_todos += 1
+                    yield "todo", todos[streamed_todos - 1]
         
-        context = f"""Create a PREMIUM, PROFESSIONAL HTML structure for: {prompt} - Design it like Bolt.new.
+        text = "".join(content)
+        # The static system prompt is counted separately so its (memoized) count is reused
+        usage = {"total_tokens": estimate_tokens(ANALYZE_SYSTEM_PROMPT) + estimate_tokens(prompt + text)}
+        try:
+            if parser is not None and parser.done:
+                data = parser.result
+            else:
+                data = parse_partial_json(_strip_json_fence(text))
+            analysis = _analysis_from_data(data, prompt, usage)
+            _analysis_cache.set(prompt, copy.deepcopy(analysis), _provider_key(provider))
+        except ValueError:
+            # Keep whatever was already shown to the user consistent with the result
+            if streamed_todos:
+                fields["todos"] = todos
+            analysis = _analysis_from_data(fields, prompt, usage)
+    
+    if analysis["intent"] == "create_webpage":
+        if not streamed_description:
+            yield "description", analysis["description"]
+        for todo in analysis["todos"][streamed_todos:]:
+            yield "todo", todo
+    yield "analysis", analysis
+
+
+def unpack_analysis(analysis: Dict[str, Any]) -> Tuple[Dict[str, Any], str, List[Dict], Dict[str, Any]]:
+    """Split an analysis into (intent_result, description, todo_list, project_requirements)."""
+    intent_result = {
+        "intent": analysis["intent"],
+        "confidence": analysis["confidence"],
+        "response": analysis["response"],
+        "usage": analysis["usage"]
+    }
+    project_requirements = {
+        "project_type": analysis["project_type"],
+        "theme": analysis["theme"],
+        "colors": list(analysis["colors"]),
+        "js_functions": list(analysis["js_functions"])
+    }
+    return intent_result, analysis["description"], analysis["todos"], project_requirements
+
+
+async def prepare_project(prompt: str, provider: AIProvider) -> Tuple[Dict[str, Any], str, List[Dict], Dict[str, Any]]:
+    """Intent, description, todo list and requirements for a prompt, from one analysis call."""
+    return unpack_analysis(await analyze_prompt_async(prompt, provider))
+
+
+def detect_user_intent(prompt: str, provider: AIProvider) -> Dict[str, any]:
+    """Detect user intent from the prompt."""
+    return unpack_analysis(analyze_prompt(prompt, provider))[0]
+
+
+async def detect_user_intent_async(prompt: str, provider: AIProvider) -> Dict[str, any]:
+    """Async variant of detect_user_intent."""
+    return unpack_analysis(await analyze_prompt_async(prompt, provider))[0]
+
+
+def generate_project_description(prompt: str, provider: AIProvider) -> str:
+    """Generate project description - use analyze_prompt when other fields are needed too."""
+    return unpack_analysis(analyze_prompt(prompt, provider))[1]
+
+
+async def generate_project_description_async(prompt: str, provider: AIProvider) -> str:
+    """Async variant of generate_project_description."""
+    return unpack_analysis(await analyze_prompt_async(prompt, provider))[1]
+
+
+def generate_todo_list(prompt: str, provider: AIProvider) -> List[Dict]:
+    """Generate todo list - use analyze_prompt when other fields are needed too."""
+    return unpack_analysis(analyze_prompt(prompt, provider))[2]
+
+
+async def generate_todo_list_async(prompt: str, provider: AIProvider) -> List[Dict]:
+    """Async variant of generate_todo_list."""
+    return unpack_analysis(await analyze_prompt_async(prompt, provider))[2]
+
+
+async def generate_todo_list_stream(prompt: str, provider: AIProvider) -> AsyncGenerator[Dict, None]:
+    """Streaming variant of generate_todo_list - yields each todo as soon as it has been parsed."""
+    async for event, value in analyze_prompt_stream(prompt, provider):
+        if event == "todo":
+            yield value
+        elif event == "analysis" and value["intent"] != "create_webpage":
+            # Todos are only streamed for page requests; other intents still get their plan
+            for todo in value["todos"]:
+                yield todo
+
+
+def extract_project_requirements(prompt: str, provider: AIProvider) -> Dict[str, any]:
+    """Extract theme, colors, and project type - use analyze_prompt when other fields are needed too."""
+    return unpack_analysis(analyze_prompt(prompt, provider))[3]
+
+
+async def extract_project_requirements_async(prompt: str, provider: AIProvider) -> Dict[str, any]:
+    """Async variant of extract_project_requirements."""
+    return unpack_analysis(await analyze_prompt_async(prompt, provider))[3]
+
+
+# System prompts and static context requirements for code generation - built once at import.
+# System prompts stay byte-identical across calls (per-request text only goes in the
+# user message) so provider-side prompt prefix caches can reuse them.
+
+# Page structure shared by all three files. It opens every system prompt so the
+# HTML, CSS and JS calls share one cacheable prefix.
+_SHARED_PAGE_SPEC: Final[str] = """You are an expert web designer and developer building a premium, professional, responsive website with card-based layouts and a modern structure. The page is split into index.html, style.css and script.js, which are linked automatically.
+
+Shared page structure:
+- <header><nav class="navbar"> with a logo, a mobile <button class="menu-toggle"><i class="fas fa-bars"></i></button> and <ul class="nav-menu"> of anchor links to page sections.
+- <main> with a two-column hero (text and buttons left, image right) and content sections using .container, .card, .feature-card and .testimonial-card.
+- <footer> with links, social icons and copyright.
+- On small screens the menu opens by toggling the "active" class on .nav-menu."""
+
+
+def _code_system_prompt(task: str, requirements: str, language: str) -> str:
+    return f"{_SHARED_PAGE_SPEC}\n\n{task}\n\nRequirements:\n{requirements}\n\nReturn ONLY the {language} code. No markdown code blocks, backticks, or explanations."
+
+
+_HTML_FILE_REQUIREMENTS: Final[str] = """1. Properly indented HTML (2 spaces per level) using semantic HTML5 (header, nav, main, section, article, footer) and the shared structure above.
+2. In <head>: <meta name="viewport" content="width=device-width, initial-scale=1.0">, Google Fonts (Poppins, Inter, Playfair Display) and Font Awesome 6.4.0 from cdnjs.
+3. At least 2-3 real images from Unsplash or Pexels that match the content (never placeholders or empty src), each with style="width: 100%; max-width: 100%; height: auto; object-fit: cover;".
+4. Clear heading hierarchy (h1 hero, h2 sections, h3 cards), Font Awesome icons, several CTA buttons, and badges, stats or testimonials where relevant.
+5. Do not link local stylesheet or script files."""
+
+_HTML_SYSTEM_PROMPT: Final[str] = _code_system_prompt(
+    "Write index.html based on the user's request and any design reference provided.",
+    _HTML_FILE_REQUIREMENTS,
+    "HTML"
+)
+
+_HTML_CONTEXT_REQUIREMENTS: Final[str] = """Make it look like a premium, modern website: clear header/main/footer sections, a functional mobile menu, card-based content and real, relevant images."""
+
+_CSS_FILE_REQUIREMENTS: Final[str] = """1. Properly indented CSS using variables in :root for colors and spacing.
+2. Mobile-first with breakpoints at 768px and 1024px; stack columns and reduce font sizes on small screens.
+3. Layout: .container { max-width: 1200px; margin: 0 auto; padding: 0 2rem; }; two-column hero grid (1fr 1fr, gap 4rem, align-items center); card grids with repeat(auto-fit, minmax(280px, 1fr)) and 2rem gaps.
+4. Cards: 12-16px radius, 1.5-2rem padding, layered rgba shadows, hover translateY(-4px) with a deeper shadow.
+5. Navigation: .navbar flex with space-between; .nav-menu flex with 2rem gap. Under 768px .menu-toggle is shown and .nav-menu becomes an absolutely positioned column that is hidden until .nav-menu.active; above 768px .menu-toggle is hidden.
+6. Typography: Poppins body (1.125rem, line-height 1.7), Playfair Display headings; hero headline 3.5rem/700-800, section headings 2.5rem.
+7. Buttons: gradient primary and outlined secondary, 10px radius, 1rem 2rem padding, scale(1.05) on hover.
+8. Gradients, transitions (all 0.3s ease), fadeIn/slideInUp keyframes and 4-6rem section padding.
+9. Images never overflow: img { max-width: 100%; height: auto; object-fit: cover; } and body { overflow-x: hidden; }."""
+
+_CSS_SYSTEM_PROMPT: Final[str] = _code_system_prompt(
+    "Write style.css for the HTML given by the user, with precise alignment and modern design.",
+    _CSS_FILE_REQUIREMENTS,
+    "CSS"
+)
+
+_CSS_CONTEXT_REQUIREMENTS: Final[str] = """Style every class used in the HTML below so it looks like a premium, professional website with card-based layouts, precise alignment and a working responsive navbar."""
+
+_JS_FILE_REQUIREMENTS: Final[str] = """1. Properly indented ES6+ (const/let, arrow functions, template literals), modular and efficient, with comments for complex logic.
+2. Handle errors and guard against missing elements.
+3. Smooth interactions and animations; use event delegation where appropriate.
+4. Always implement the navbar: clicking .menu-toggle toggles "active" on .nav-menu, and clicking a .nav-menu link closes it."""
+
+_JS_SYSTEM_PROMPT: Final[str] = _code_system_prompt(
+    "Write script.js: clean, modern, production-ready JavaScript for the HTML given by the user.",
+    _JS_FILE_REQUIREMENTS,
+    "JavaScript"
+)
+
+# Prebuilt system messages - the same objects are sent on every request, like _ANALYZE_SYSTEM_MESSAGE
+_CODE_SYSTEM_MESSAGES: Final[Dict[str, Dict[str, str]]] = {
+    "html": {"role": "system", "content": _HTML_SYSTEM_PROMPT},
+    "css": {"role": "system", "content": _CSS_SYSTEM_PROMPT},
+    "js": {"role": "system", "content": _JS_SYSTEM_PROMPT}
+}
+
+_TAILWIND_NOTE: Final[str] = "\n\nUser requested Tailwind CSS. Include <script src=\"https://cdn.tailwindcss.com\"></script> in <head> and use Tailwind utility classes throughout the HTML instead of custom CSS classes."
+
+_JS_CONTEXT_REQUIREMENTS: Final[str] = """Include the mobile menu toggle and add interactive features that fit the project type."""
+
+# Page types that only need the navbar behaviour when the analysis asked for no
+# JavaScript functions - they get this script instead of an LLM call
+_STATIC_PAGE_TYPES: Final[frozenset] = frozenset({"landing page", "portfolio", "blog", "about page"})
+_STATIC_PAGE_JS: Final[str] = """// Mobile navigation and smooth scrolling
+document.addEventListener('DOMContentLoaded', () => {
+  const menuToggle = document.querySelector('.menu-toggle');
+  const navMenu = document.querySelector('.nav-menu');
+
+  if (menuToggle && navMenu) {
+    menuToggle.addEventListener('click', () => {
+      navMenu.classList.toggle('active');
+    });
+
+    navMenu.addEventListener('click', (event) => {
+      if (event.target.closest('a')) {
+        navMenu.classList.remove('active');
+      }
+    });
+  }
+
+  document.querySelectorAll('a[href^="#"]').forEach((link) => {
+    link.addEventListener('click', (event) => {
+      const id = link.getAttribute('href');
+      const target = id.length > 1 ? document.querySelector(id) : null;
+      if (target) {
+        event.preventDefault();
+        target.scrollIntoView({ behavior: 'smooth' });
+      }
+    });
+  });
+});
+"""
+
+
+# Minimal stylesheet for the shared page structure, used when the model returns no usable CSS
+_FALLBACK_CSS: Final[str] = """* { margin: 0; padding: 0; box-sizing: border-box; }
+body { font-family: 'Poppins', 'Inter', sans-serif; line-height: 1.7; color: #333; overflow-x: hidden; }
+img { max-width: 100%; height: auto; object-fit: cover; }
+.container { max-width: 1200px; margin: 0 auto; padding: 0 2rem; }
+.navbar { display: flex; justify-content: space-between; align-items: center; padding: 1rem 2rem; }
+.nav-menu { display: flex; gap: 2rem; list-style: none; }
+.nav-menu a { color: inherit; text-decoration: none; }
+.menu-toggle { display: none; background: none; border: none; font-size: 1.5rem; cursor: pointer; }
+section { padding: 4rem 0; }
+.card, .feature-card, .testimonial-card { padding: 2rem; border-radius: 12px; box-shadow: 0 4px 16px rgba(0, 0, 0, 0.08); }
+footer { padding: 2rem; text-align: center; }
+@media (max-width: 768px) {
+  .menu-toggle { display: block; }
+  .nav-menu { display: none; position: absolute; top: 100%; left: 0; right: 0; flex-direction: column; padding: 1rem 2rem; background: #fff; }
+  .nav-menu.active { display: flex; }
+}
+"""
+
+# What a usable file must at least contain - shorter or markerless output (an empty
+# reply, an apology) is a failed generation. Both tests hold for any longer prefix too.
+_MIN_CODE_CHARS: Final[int] = 32
+_CODE_MARKERS: Final[Dict[str, "re.Pattern[str]"]] = {
+    "html": re.compile(r"<[a-zA-Z!]"),                 # a tag or doctype
+    "css": re.compile(r"\{\s*(?:--)?[a-zA-Z][\w-]*\s*:"),  # a rule with a declaration
+    "js": re.compile(                                  # a declaration, arrow function or DOM/console call
+        r"\bfunction\b\s*[\w$]*\s*\(|\b(?:const|let|var)\s+[\w$]+\s*=|=>|\b(?:document|window|console)\.[a-zA-Z]"
+    )
+}
+
+
+def _usable_code(code_type: str, code: str) -> bool:
+    return len(code) >= _MIN_CODE_CHARS and _CODE_MARKERS[code_type].search(code) is not None
+
+
+def _fallback_code(code_type: str) -> str:
+    """Stand-in for an empty or malformed CSS/JS response; HTML has none and raises."""
+    fallback = {"css": _FALLBACK_CSS, "js": _STATIC_PAGE_JS}.get(code_type)
+    if fallback is None:
+        raise Exception(f"Error generating {_CODE_LABELS[code_type]}: the model returned no usable code")
+    print(f"Warning: no usable {_CODE_LABELS[code_type]} in the response, using the fallback")
+    return fallback
+
+
+# Markup the canned script does not drive: forms and fields, data- hooks, inline
+# handlers and buttons other than the navbar's menu toggle
+_INTERACTIVE_HTML_RE = re.compile(
+    r"<(?:form|input|select|textarea|dialog)\b|\sdata-[\w-]+\s*=|\son[a-z]+\s*=|<button\b(?![^>]*menu-toggle)",
+    re.IGNORECASE
+)
+
+
+def _static_page_type(project_requirements: Dict) -> bool:
+    """Whether the analysis describes a page that may only need the canned script."""
+    if project_requirements.get("js_functions"):
+        return False
+    return str(project_requirements.get("project_type", "")).lower() in _STATIC_PAGE_TYPES
+
+
+def _static_page_js(project_requirements: Dict, html_code: str) -> Optional[str]:
+    """Return the canned script when the page needs no custom JavaScript, else None."""
+    if not _static_page_type(project_requirements) or _INTERACTIVE_HTML_RE.search(html_code):
+        return None
+    return _STATIC_PAGE_JS
+
+
+_BUNDLE_SYSTEM_PROMPT: Final[str] = f"""{_SHARED_PAGE_SPEC}
+
+Write index.html, style.css and script.js in one response, based on the user's request and any design reference provided.
+
+HTML requirements:
+{_HTML_FILE_REQUIREMENTS}
+
+CSS requirements:
+{_CSS_FILE_REQUIREMENTS}
+
+JavaScript requirements:
+{_JS_FILE_REQUIREMENTS}
+
+Return ONLY a valid JSON object {{"html": "...", "css": "...", "js": "..."}} whose values are the complete file contents."""
+
+_BUNDLE_MAX_TOKENS: Final[int] = 16000
+
+_Template = Tuple[Tuple[str, Optional[str]], ...]
+
+
+def _compile_template(template: str) -> _Template:
+    """Split a str.format template once into (literal, field name) pairs."""
+    return tuple((literal, field) for literal, field, _, _ in string.Formatter().parse(template))
+
+
+def _fill_template(template: _Template, values: Dict[str, Any]) -> str:
+    """Join a compiled template's literals and values - no format string parsing per call."""
+    parts = []
+    for literal, field in template:
+        parts.append(literal)
+        if field is not None:
+            parts.append(str(values[field]))
+    return "".join(parts)
+
+
+# User-message templates, compiled at import and filled per request. The static
+# requirements lead so the cacheable prompt prefix extends past the system prompt;
+# per-request text (prompt, palette, HTML excerpt) forms the tail.
+_HTML_CONTEXT_TMPL: Final[_Template] = _compile_template(_HTML_CONTEXT_REQUIREMENTS + """
+
+Create a PREMIUM, PROFESSIONAL HTML structure for: {prompt} - Design it like Bolt.new.
 
 PROJECT TYPE: {project_type}
 THEME: {theme}
 {color_scheme}
 {tailwind_note}
-{design_reference_note}
-
-CRITICAL UI REQUIREMENTS (LIKE BOLT.NEW):
-- SPLIT INTO CLEAR SECTIONS:
-  * HEADER/NAVBAR (CRITICAL - MUST BE FULLY FUNCTIONAL):
-    - <header><nav class="navbar"> with logo and navigation links</nav></header>
-    - Navigation MUST work on all devices (desktop, tablet, mobile)
-    - Include hamburger menu button for mobile: <button class="menu-toggle"><i class="fas fa-bars"></i></button>
-    - Navigation structure: <ul class="nav-menu"><li><a href="#home">Home</a></li><li><a href="#about">About</a></li></ul>
-    - All navigation links must be clickable and functional
-    - Mobile menu must toggle open/close with JavaScript
-  * BODY/MAIN: <main> with hero section, features, content sections</main>
-  * FOOTER: <footer> with links, social media, copyright</footer>
-- CARD-BASED LAYOUTS: Create cards for features, testimonials, products (use .card, .feature-card classes)
-- TWO-COLUMN HERO: Left column for text (headline, description, buttons), right column for REAL IMAGE
-- PROPER ALIGNMENT: Use .container class, flexbox, and grid for perfect alignment
-- ALWAYS INCLUDE REAL IMAGES:
-  * Use public image URLs from free image services (all free for commercial use, no attribution required)
-  * Images must be RELATED to the content (coffee images for coffee shop, tech images for tech page, etc.)
-  * Use URLs from these free image sources:
-    - Unsplash: https://images.unsplash.com/photo-... or https://unsplash.com/photos/...
-    - Pexels: https://images.pexels.com/photos/... or https://www.pexels.com/photo/...
-    - Pixabay: https://pixabay.com/photos/... or direct image URLs
-    - LibreShot: https://libreshot.com/... or direct image URLs
-    - Wikimedia Commons: https://commons.wikimedia.org/wiki/File:... or direct image URLs
-    - Flickr Creative Commons: https://live.staticflickr.com/... or https://www.flickr.com/photos/...
-  * Include at least 2-3 images: hero image, feature images, section images
-  * NEVER use empty images, broken links, or placeholder.com
-  * Example for coffee shop: https://images.unsplash.com/photo-1509042239860-f550ce710b93 or https://images.pexels.com/photos/2253275/pexels-photo-2253275.jpeg
-  * Example for tech: https://images.unsplash.com/photo-1518770660439-4636190af475 or https://images.pexels.com/photos/1181244/pexels-photo-1181244.jpeg
-- Use Font Awesome icons throughout
-- Create multiple CTA buttons with different styles
-- Add badges, stats cards, or testimonials if relevant
-- Use semantic HTML5 with proper class names (navbar, hero, card, feature-card, container, section, footer, etc.)
-- Make it look like a premium, modern website with professional layout and structure like Bolt.new creates"""
-        
-    elif code_type == "css":
-        system_prompt = """You are an expert web developer. Generate PREMIUM, PROFESSIONAL CSS code like Bolt.new with CARD-BASED LAYOUTS, PERFECT ALIGNMENT, and MODERN DESIGN.
-
-CRITICAL REQUIREMENTS FOR PREMIUM UI (LIKE BOLT.NEW):
-1. CSS must be properly formatted with correct indentation
-2. MUST BE FULLY RESPONSIVE - Mobile-first with media queries:
-   - @media (max-width: 768px) for mobile
-   - @media (max-width: 1024px) for tablet
-   - @media (min-width: 1025px) for desktop
-3. USE CSS VARIABLES: :root {{ --primary-color: #...; --secondary-color: #...; --spacing: 1rem; }}
-4. CARD-BASED DESIGN (CRITICAL):
-   - Style .card, .feature-card, .testimonial-card with:
-     * box-shadow: 0 4px 6px rgba(0,0,0,0.1), 0 2px 4px rgba(0,0,0,0.06);
-     * border-radius: 12px to 16px;
-     * padding: 1.5rem to 2rem;
-     * background: white or subtle gradient;
-     * hover: transform: translateY(-4px); box-shadow: 0 8px 16px rgba(0,0,0,0.15);
-   - Card grids: display: grid; grid-template-columns: repeat(auto-fit, minmax(280px, 1fr)); gap: 2rem;
-5. PERFECT ALIGNMENT AND LAYOUT (CRITICAL - MUST IMPLEMENT ALL):
-   - .container {{ max-width: 1200px; margin: 0 auto; padding: 0 2rem; }}
-   - Two-column hero: display: grid; grid-template-columns: 1fr 1fr; gap: 4rem; align-items: center;
-   - Navigation (CRITICAL - MUST BE RESPONSIVE AND FUNCTIONAL):
-     * .navbar {{ display: flex; justify-content: space-between; align-items: center; width: 100%; padding: 1rem 2rem; position: relative; }}
-     * .nav-menu {{ display: flex; list-style: none; gap: 2rem; margin: 0; padding: 0; }}
-     * Mobile responsive: @media (max-width: 768px) {{
-       .menu-toggle {{ display: block; background: none; border: none; font-size: 1.5rem; cursor: pointer; color: inherit; }}
-       .nav-menu {{ display: none; position: absolute; top: 100%; left: 0; width: 100%; background: white; flex-direction: column; padding: 2rem; box-shadow: 0 4px 6px rgba(0,0,0,0.1); z-index: 1000; }}
-       .nav-menu.active {{ display: flex; }}
-     }}
-     * Desktop: @media (min-width: 769px) {{ .menu-toggle {{ display: none; }} .nav-menu {{ display: flex; }} }}
-     * Smooth transitions: .nav-menu {{ transition: all 0.3s ease; }}
-   - Center headings: text-align: center; for h1, h2, h3 in hero and sections
-   - Left align paragraphs: text-align: left; for body text and descriptions
-   - Justify text: text-align: justify; for longer paragraphs if needed
-   - Button groups: display: flex; gap: 1rem; justify-content: flex-start; or center;
-   - Vertical centering: display: flex; align-items: center; for vertical alignment
-   - Horizontal centering: justify-content: center; for horizontal alignment
-   - Center containers: margin: 0 auto; width: 100%; max-width: 1200px;
-   - Consistent spacing: 1rem, 1.5rem, 2rem, 3rem, 4rem, 6rem
-   - ALWAYS use alignment: justify-content, align-items, text-align, margin: 0 auto;
-6. MODERN COLOR SCHEMES:
-   - Gradients: linear-gradient(135deg, #color1, #color2)
-   - Mixed warm and cool colors
-   - Proper contrast ratios
-   - CSS variables for theming
-7. TYPOGRAPHY:
-   - Fonts: 'Poppins' for body, 'Playfair Display' for headings (if appropriate)
-   - Hero headline: 3.5rem, font-weight: 700-800, line-height: 1.2
-   - Section headings: 2.5rem, font-weight: 600-700
-   - Body: 1.125rem, font-weight: 400, line-height: 1.7
-8. BUTTONS:
-   - Primary: gradient background, border-radius: 10px, padding: 1rem 2rem, hover: scale(1.05)
-   - Secondary: border style, transparent background
-   - Add icons with proper spacing
-9. ANIMATIONS:
-   - @keyframes fadeIn, slideInUp, pulse
-   - Smooth transitions: transition: all 0.3s ease
-   - Hover effects on cards, buttons, links
-10. SPACING:
-    - Section padding: 4rem to 6rem
-    - Card gaps: 2rem in grids
-    - Consistent margins between sections
-11. RESPONSIVE:
-    - Mobile: stack columns, reduce font sizes, adjust padding
-    - Tablet: adjust grid columns, moderate spacing
-    - Desktop: full layout with optimal spacing
-12. MODERN EFFECTS:
-    - Multiple shadow layers: box-shadow with rgba values
-    - Rounded corners: 8px to 16px
-    - Gradient backgrounds for hero sections
-    - Overlay effects for images
-13. IMAGE SIZING (CRITICAL - PREVENT OVERFLOW):
-    - All images MUST have proper sizing to prevent overflow:
-      * img {{ width: 100%; max-width: 100%; height: auto; object-fit: cover; }}
-      * Or use specific dimensions: width: 600px; max-width: 100%; height: auto;
-      * Prevent horizontal scrolling: body {{ max-width: 100vw; overflow-x: hidden; }}
-      * Prevent vertical overflow: Use proper height constraints
-    - Responsive images: Use max-width: 100%; height: auto; for all images
-    - Hero images: Can use height: 500px; or height: 60vh; with object-fit: cover;
-    - Container images: width: 100%; max-width: 100%; height: auto;
-
-Return ONLY the CSS code as a string. Do not include markdown code blocks, backticks, or explanations."""
-        
-        project_type = project_requirements.get("project_type", "webpage")
-        theme = project_requirements.get("theme", "modern")
-        colors = project_requirements.get("colors", [])
-        
-        color_scheme = ""
-        if colors:
-            color_scheme = f"\nUser requested colors: {', '.join(colors)}. Use these colors as the primary palette."
-        elif theme:
-            if theme.lower() == "dark":
-                color_scheme = "\nUse a dark theme with colors like #1a1a1a, #2d2d2d, #ffffff, #4a9eff"
-            elif theme.lower() == "light":
-                color_scheme = "\nUse a light theme with colors like #ffffff, #f5f5f5, #333333, #007bff"
-            elif "coffee" in prompt.lower():
-                color_scheme = "\nUse warm coffee shop colors: #8B4513, #D2691E, #F5F5DC, #FFFFFF, #CD853F"
-        
-        context = f"""Create PREMIUM, PROFESSIONAL CSS for: {prompt} - Design it like Bolt.new with cards, perfect alignment, and modern UI.
+{design_reference_note}""")
+
+_CSS_CONTEXT_TMPL: Final[_Template] = _compile_template(_CSS_CONTEXT_REQUIREMENTS + """
+
+Create PREMIUM, PROFESSIONAL CSS for: {prompt} - Design it like Bolt.new with cards, perfect alignment, and modern UI.
 
 PROJECT TYPE: {project_type}
 THEME: {theme}
 {color_scheme}
 
 HTML Structure (for reference):
-{html_code[:800]}
-
-CRITICAL UI REQUIREMENTS (LIKE BOLT.NEW):
-1. CARD-BASED LAYOUTS:
-   - Style all .card, .feature-card elements with shadows, rounded corners (12px-16px), padding (1.5rem-2rem)
-   - Create card grids: display: grid; grid-template-columns: repeat(auto-fit, minmax(280px, 1fr)); gap: 2rem;
-   - Add hover effects: transform: translateY(-4px); box-shadow: 0 8px 16px rgba(0,0,0,0.15);
-   - Card backgrounds: white or subtle gradients
-2. TWO-COLUMN HERO SECTION:
-   - Left column: text content with proper typography (headline 3.5rem, description, buttons)
-   - Right column: image/graphic with proper sizing
-   - Use grid: display: grid; grid-template-columns: 1fr 1fr; gap: 4rem; align-items: center;
-   - Responsive: stack on mobile with @media query
-3. PERFECT ALIGNMENT (CRITICAL - MUST IMPLEMENT ALL):
-   - .container {{ max-width: 1200px; margin: 0 auto; padding: 0 2rem; }}
-   - Center containers: margin: 0 auto; width: 100%; max-width: 1200px;
-   - Center headings: text-align: center; for h1, h2, h3 in hero and sections
-   - Left align paragraphs: text-align: left; for body text and descriptions
-   - Justify text: text-align: justify; for longer paragraphs
-   - Navigation (CRITICAL - MUST BE RESPONSIVE AND FUNCTIONAL):
-     * .navbar {{ display: flex; justify-content: space-between; align-items: center; width: 100%; padding: 1rem 2rem; position: relative; }}
-     * .nav-menu {{ display: flex; list-style: none; gap: 2rem; margin: 0; padding: 0; }}
-     * Mobile responsive: @media (max-width: 768px) {{
-       .menu-toggle {{ display: block; background: none; border: none; font-size: 1.5rem; cursor: pointer; color: inherit; }}
-       .nav-menu {{ display: none; position: absolute; top: 100%; left: 0; width: 100%; background: white; flex-direction: column; padding: 2rem; box-shadow: 0 4px 6px rgba(0,0,0,0.1); z-index: 1000; }}
-       .nav-menu.active {{ display: flex; }}
-     }}
-     * Desktop: @media (min-width: 769px) {{ .menu-toggle {{ display: none; }} .nav-menu {{ display: flex; }} }}
-     * Smooth transitions: .nav-menu {{ transition: all 0.3s ease; }}
-   - Hero alignment: display: flex; or grid with align-items: center; justify-content: space-between; or center;
-   - Button alignment: display: flex; gap: 1rem; justify-content: flex-start; or center;
-   - Flexbox centering: display: flex; justify-content: center; align-items: center; for perfect centering
-   - Grid alignment: Use place-items: center; or align-items: center; justify-items: center;
-   - Consistent spacing: Use rem units (1rem, 1.5rem, 2rem, 3rem, 4rem, 6rem) for all margins and padding
-   - ALWAYS use alignment properties: justify-content, align-items, text-align, margin: 0 auto;
-4. MODERN COLOR THEMES:
-   - Use gradients: linear-gradient(135deg, #color1, #color2)
-   - Mixed warm and cool colors
-   - CSS variables: :root {{ --primary: #...; --secondary: #...; }}
-   - Proper contrast for readability
-5. TYPOGRAPHY:
-   - Apply fonts: 'Poppins' for body, 'Playfair Display' for headings (if appropriate)
-   - Hero headline: 3.5rem, font-weight: 700-800, line-height: 1.2
-   - Section headings: 2.5rem, font-weight: 600-700
-   - Body: 1.125rem, font-weight: 400, line-height: 1.7
-6. BUTTONS:
-   - Primary: gradient background, border-radius: 10px, padding: 1rem 2rem, hover: transform: scale(1.05)
-   - Secondary: border style, transparent background
-   - Add icons with proper spacing
-7. RESPONSIVE:
-   - Mobile-first approach
-   - Breakpoints: 768px (mobile), 1024px (tablet)
-   - Adjust font sizes, spacing, and layouts for each breakpoint
-8. ANIMATIONS:
-   - @keyframes fadeIn, slideInUp, pulse
-   - Smooth transitions: transition: all 0.3s ease
-   - Hover effects on all interactive elements
-9. MODERN EFFECTS:
-   - Multiple shadow layers for depth: box-shadow with rgba values
-   - Rounded corners: 8px to 16px
-   - Gradient backgrounds
-   - Overlay effects
-
-Make it look like a premium, professional website with card-based layouts, perfect alignment, and modern design like Bolt.new creates."""
-        
-    else:  # js
-        system_prompt = """You are an expert JavaScript developer. Generate clean, modern, production-ready JavaScript code.
-
-CRITICAL REQUIREMENTS:
-1. JavaScript must be properly formatted with correct indentation
-2. Use modern ES6+ syntax (const, let, arrow functions, template literals)
-3. Add proper error handling
-4. Make code modular and well-organized
-5. Include comments for complex logic
-6. Ensure all interactive elements work smoothly
-7. Add smooth animations and transitions using JavaScript
-8. Handle user interactions properly (click, hover, input events)
-9. Use event delegation where appropriate
-10. Make code efficient and performant
-11. NAVBAR FUNCTIONALITY (CRITICAL - MUST IMPLEMENT):
-    - Mobile menu toggle: Add event listener to menu toggle button
-    - Toggle mobile menu: Show/hide navigation menu on mobile devices
-    - Close menu on link click: Close mobile menu when navigation link is clicked
-    - Smooth animations: Add smooth open/close animations for mobile menu
-    - Example: document.querySelector('.menu-toggle').addEventListener('click', () => { nav.classList.toggle('active'); });
-    - Always include navbar functionality even if project doesn't require other JS
-
-Return ONLY the JavaScript code as a string. Do not include markdown code blocks, backticks, or explanations."""
-        
-        js_functions = project_requirements.get("js_functions", [])
-        js_requirements = ""
-        if js_functions:
-            js_requirements = f"\nRequired functions: {', '.join(js_functions)}. Implement these functions."
-        
-        context = f"""Create JavaScript code for: {prompt}
+{html_code}""")
 
-PROJECT TYPE: {project_requirements.get('project_type', 'webpage')}
+_JS_CONTEXT_TMPL: Final[_Template] = _compile_template(_JS_CONTEXT_REQUIREMENTS + """
+
+Create JavaScript code for: {prompt}
+
+PROJECT TYPE: {project_type}
 {js_requirements}
 
 HTML Structure (for reference):
-{html_code[:500]}
-
-CRITICAL REQUIREMENTS:
-- Modern ES6+ syntax
-- Smooth interactions and animations
-- Proper event handling
-- Error handling
-- Well-organized, modular code
-- NAVBAR FUNCTIONALITY (CRITICAL - MUST IMPLEMENT):
-  * Mobile menu toggle: Add click event to .menu-toggle button
-  * Toggle navigation menu: Show/hide .nav-menu on mobile
-  * Close menu on link click: Close mobile menu when nav links are clicked
-  * Smooth animations: Add CSS transitions for menu open/close
-  * Example code:
-    const menuToggle = document.querySelector('.menu-toggle');
-    const navMenu = document.querySelector('.nav-menu');
-    menuToggle.addEventListener('click', () => {{
-      navMenu.classList.toggle('active');
-    }});
-    // Close menu when link is clicked
-    document.querySelectorAll('.nav-menu a').forEach(link => {{
-      link.addEventListener('click', () => {{
-        navMenu.classList.remove('active');
-      }});
-    }});
-- Add interactive features based on the project type"""
+{html_code}""")
+
+
+# Sampling temperature for generated files (lower = more repeatable output)
+AI_CODE_TEMPERATURE = float(os.getenv("AI_CODE_TEMPERATURE", "0.7"))
+
+# Output budget per generated file. Simple project types get tighter caps - decoding
+# stops sooner and the provider reserves less - everything else keeps the full budget.
+_CODE_MAX_TOKENS: Final[int] = 12000
+_MAX_TOKENS_BY_PROJECT: Final[Dict[str, Dict[str, int]]] = {
+    "todo list": {"html": 4000, "css": 5000, "js": 4000},
+    "landing page": {"html": 8000, "css": 10000, "js": 4000},
+    "portfolio": {"html": 8000, "css": 10000, "js": 4000},
+    "coffee shop": {"html": 8000, "css": 10000, "js": 4000}
+}
+
+
+# Once enough files have been generated, the cap also follows the observed output
+# size: 1.3x the 95th percentile of recent files of the same project and file type,
+# never below the floor. Project types without their own budget share one history.
+_OUTPUT_SAMPLES: Final[int] = 100
+_ADAPTIVE_MIN_SAMPLES: Final[int] = 20
+_ADAPTIVE_MAX_TOKENS_FLOOR: Final[int] = 4000
+_output_tokens: Dict[Tuple[str, str], Deque[int]] = {
+    (project_type, code_type): deque(maxlen=_OUTPUT_SAMPLES)
+    for project_type in ("", *_MAX_TOKENS_BY_PROJECT) for code_type in ("html", "css", "js")
+}
+
+# Scripts scale with the functions the analysis asked for
+_JS_BASE_TOKENS: Final[int] = 1500
+_JS_TOKENS_PER_FUNCTION: Final[int] = 800
+
+
+def _budget_type(project_requirements: Dict) -> str:
+    """The project type whose budget and output history apply ("" for everything else)."""
+    project_type = str(project_requirements.get("project_type", "")).lower()
+    return project_type if project_type in _MAX_TOKENS_BY_PROJECT else ""
+
+
+def _max_tokens(code_type: str, project_requirements: Dict) -> int:
+    project_type = _budget_type(project_requirements)
+    cap = _MAX_TOKENS_BY_PROJECT.get(project_type, {}).get(code_type, _CODE_MAX_TOKENS)
+    js_functions = project_requirements.get("js_functions")
+    if code_type == "js" and js_functions:
+        cap = min(cap, max(_ADAPTIVE_MAX_TOKENS_FLOOR, _JS_BASE_TOKENS + _JS_TOKENS_PER_FUNCTION * len(js_functions)))
+    samples = _output_tokens[(project_type, code_type)]
+    if len(samples) >= _ADAPTIVE_MIN_SAMPLES:
+        p95 = sorted(samples)[int(len(samples) * 0.95)]
+        cap = min(cap, max(_ADAPTIVE_MAX_TOKENS_FLOOR, int(p95 * 1.3)))
+    return cap
+
+
+def _record_output(code_type: str, project_requirements: Dict, code: str, max_tokens: int) -> None:
+    """Add a generated file's size to the samples behind the adaptive cap."""
+    tokens = estimate_tokens(code)
+    if tokens >= max_tokens * 0.95:
+        # Truncated files are still recorded, which pushes the cap back up
+        print(f"Warning: {_CODE_LABELS[code_type]} output reached max_tokens ({max_tokens})")
+    _output_tokens[(_budget_type(project_requirements), code_type)].append(tokens)
+
+
+# Lines held back at the start of a response in case a fence follows them
+_PREAMBLE_MAX_LINES: Final[int] = 5
+
+
+async def _code_lines(deltas: AsyncIterator[str]) -> AsyncGenerator[str, None]:
+    """Re-chunk streamed text deltas into complete lines.
     
-    # Generate code
-    try:
-        response = provider.chat_completion(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": context}
-            ],
-            temperature=0.7,
-            max_tokens=12000  # Significantly increased for better UI
-        )
-        
-        code = response["content"].strip()
-        
-        # Remove markdown if present
-        if f"```{code_type}" in code:
-            code = code.split(f"```{code_type}")[1].split("```")[0].strip()
-        elif "```" in code:
-            parts = code.split("```")
-            if len(parts) > 1:
-                code = parts[1].strip()
-                if code.startswith(code_type):
-                    code = code[len(code_type):].strip()
-        
-        # Stream code line by line with typing effect
-        lines = code.split('\n')
-        for line in lines:
-            yield line + '\n'
-            await asyncio.sleep(0.01)  # Small delay for typing effect
-        
-    except Exception as e:
-        raise Exception(f"Error generating {code_type.upper()}: {str(e)}")
+    Matches the output of _strip_code_fence: the first markdown fence opens the
+    code and the next one ends it. Text before the opening fence ("Here is the
+    HTML:") is dropped, so the first few lines are held back until a fence shows
+    up or they turn out to be unfenced code. Leading and trailing blank lines
+    are skipped.
+    """
+    partial: List[str] = []  # pieces of the current unfinished line - joined once it ends
+    held: Optional[List[str]] = []  # lines before any fence; None once the code has started
+    emitted = False
+    blank_lines = 0
+    
+    def code_line(line: str) -> str:
+        nonlocal emitted, blank_lines
+        if not line.strip():
+            blank_lines += emitted
+            return ""
+        text = "\n" * blank_lines + line + "\n"
+        blank_lines = 0
+        emitted = True
+        return text
+    
+    async for delta in deltas:
+        start = 0
+        newline = delta.find("\n")
+        while newline >= 0:
+            partial.append(delta[start:newline])
+            line = "".join(partial)
+            partial.clear()
+            start = newline + 1
+            newline = delta.find("\n", start)
+            if line.lstrip().startswith("```"):
+                if held is None:
+                    return
+                held = None  # opening fence - anything held was a preamble
+                continue
+            if held is not None:
+                if len(held) < _PREAMBLE_MAX_LINES:
+                    held.append(line)
+                    continue
+                text = "".join(code_line(held_line) for held_line in held)
+                held = None
+                if text:
+                    yield text
+            text = code_line(line)
+            if text:
+                yield text
+        if start < len(delta):
+            partial.append(delta[start:])
+    
+    tail = "".join(partial).rstrip()
+    if held is not None:
+        if tail.lstrip().startswith("```"):
+            return  # an opening fence with no code after it
+        text = "".join(code_line(held_line) for held_line in held)
+        if text:
+            yield text
+    if tail.endswith("```"):
+        tail = tail[:-3].rstrip()
+    if tail.strip():
+        yield code_line(tail)
 
 
-def generate_html_code(prompt: str, project_requirements: Dict, provider: AIProvider) -> str:
-    """Generate HTML code - separate token call."""
-    project_type = project_requirements.get("project_type", "webpage")
+_THEME_COLORS: Final[Dict[str, str]] = {
+    "dark": "\nUse a dark theme with colors like #1a1a1a, #2d2d2d, #ffffff, #4a9eff",
+    "light": "\nUse a light theme with colors like #ffffff, #f5f5f5, #333333, #007bff"
+}
+_COFFEE_COLORS: Final[str] = "\nUse warm coffee shop colors: #8B4513, #D2691E, #F5F5DC, #FFFFFF, #CD853F"
+
+
+def _color_scheme(prompt: str, theme: str, colors: List[str], color_instruction: str) -> str:
+    """Color guidance for the context: requested colors first, then a theme/prompt based palette."""
+    colors = tuple(colors)
+    # The prompt is only scanned when neither requested colors nor a known theme decide it
+    has_coffee = not colors and bool(theme) and theme.lower() not in _THEME_COLORS and "coffee" in prompt.lower()
+    return _build_color_scheme(theme, colors, has_coffee, color_instruction)
+
+
+@functools.lru_cache(maxsize=256)
+def _build_color_scheme(theme: str, colors: Tuple[str, ...], has_coffee: bool, color_instruction: str) -> str:
+    # Cached: the HTML, CSS and cache-key paths all ask for the same scheme per request
+    if colors:
+        return f"\nUser requested colors: {', '.join(colors)}. {color_instruction}"
+    if not theme:
+        return ""
+    return _THEME_COLORS.get(theme.lower()) or (_COFFEE_COLORS if has_coffee else "")
+
+
+# How much of the HTML the CSS and JS prompts include for reference
+_CSS_HTML_EXCERPT: Final[int] = 800
+_JS_HTML_EXCERPT: Final[int] = 500
+
+
+def _html_excerpt(html_code: str, max_chars: int) -> str:
+    """The first max_chars of the HTML, cut further to about max_chars / 3 tokens when
+    it tokenizes densely (inline SVG, data URIs), so the excerpt's token cost is bounded."""
+    excerpt = html_code[:max_chars]
+    encoder = _get_encoder(TOKENIZER_MODEL)
+    if encoder is None:
+        return excerpt
+    tokens = encoder.encode_ordinary(excerpt)
+    max_tokens = max_chars // 3
+    return encoder.decode(tokens[:max_tokens]) if len(tokens) > max_tokens else excerpt
+
+
+def _build_html_context(prompt: str, project_requirements: Dict) -> Tuple[str, str]:
+    """Build (system_prompt, user_context) for HTML generation."""
+    prompt_lower = prompt.lower()
     theme = project_requirements.get("theme", "modern")
-    colors = project_requirements.get("colors", [])
     
     # Check if user wants Tailwind CSS
-    use_tailwind = "tailwind" in prompt.lower() or "tailwind css" in prompt.lower()
+    tailwind_note = _TAILWIND_NOTE if "tailwind" in prompt_lower else ""
     
-    color_scheme = ""
-    if colors:
-        color_scheme = f"\nUser requested colors: {', '.join(colors)}. Use these colors."
-    elif theme:
-        if theme.lower() == "dark":
-            color_scheme = "\nUse a dark theme with colors like #1a1a1a, #2d2d2d, #ffffff, #4a9eff"
-        elif theme.lower() == "light":
-            color_scheme = "\nUse a light theme with colors like #ffffff, #f5f5f5, #333333, #007bff"
-        elif "coffee" in prompt.lower():
-            color_scheme = "\nUse warm coffee shop colors: #8B4513, #D2691E, #F5F5DC, #FFFFFF, #CD853F"
-    
-    tailwind_note = ""
-    if use_tailwind:
-        tailwind_note = "\n\nCRITICAL: User requested Tailwind CSS. Include <script src=\"https://cdn.tailwindcss.com\"></script> in <head> and use Tailwind utility classes (flex, grid, p-4, m-2, bg-blue-500, text-white, rounded-lg, etc.) throughout the HTML instead of custom CSS classes."
-    
-    system_prompt = """You are an expert web developer. Generate PREMIUM, PROFESSIONAL HTML code like Bolt.new with CARD-BASED LAYOUTS and MODERN STRUCTURE.
-
-CRITICAL REQUIREMENTS FOR PREMIUM UI (LIKE BOLT.NEW):
-1. HTML must be properly formatted with correct indentation (2 spaces per level)
-2. Use semantic HTML5 elements (header, nav, main, section, footer, article, aside)
-3. Include proper viewport meta tag: <meta name="viewport" content="width=device-width, initial-scale=1.0">
-4. Include Google Fonts: <link href="https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;500;600;700;800&family=Inter:wght@300;400;500;600;700&family=Playfair+Display:wght@400;600;700&display=swap" rel="stylesheet">
-5. Include Font Awesome: <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css">
-6. If user requests Tailwind CSS: Include Tailwind CDN: <script src="https://cdn.tailwindcss.com"></script> in <head> and use Tailwind utility classes throughout HTML
-7. STRUCTURE MUST BE SPLIT INTO CLEAR SECTIONS:
-   - HEADER/NAVBAR (CRITICAL - MUST BE FULLY FUNCTIONAL):
-     * <header><nav class="navbar"> with logo and navigation links</nav></header>
-     * Navigation MUST work on all devices (desktop, tablet, mobile)
-     * Include hamburger menu for mobile: <button class="menu-toggle"><i class="fas fa-bars"></i></button>
-     * Navigation structure: <ul class="nav-menu"><li><a href="#section">Link</a></li></ul>
-     * Include JavaScript for mobile menu toggle functionality
-   - BODY/MAIN CONTENT: <main> with hero section, features, and other content sections</main>
-   - FOOTER: <footer> with links, copyright, and additional information
-   - Each section should be clearly separated and well-structured
-7. MODERN LAYOUT PATTERNS:
-   - HEADER (CRITICAL - MUST BE FUNCTIONAL): <header><nav class="navbar"> with logo, hamburger menu button (.menu-toggle), and navigation links in <ul class="nav-menu"></ul></nav></header>
-   - BODY: <main> with hero section, features section with cards in grid
-   - FOOTER: <footer> with links, social media, copyright
-   - ALWAYS include REAL IMAGES: Use public image URLs from free image services
-   - Image URLs must be RELATED to the content (e.g., coffee images for coffee shop, tech images for tech page)
-   - Use proper image URLs from these free image sources:
-     * Unsplash: https://images.unsplash.com/photo-... or https://unsplash.com/photos/...
-     * Pexels: https://images.pexels.com/photos/... or https://www.pexels.com/photo/...
-     * Pixabay: https://pixabay.com/photos/... or direct image URLs
-     * LibreShot: https://libreshot.com/... or direct image URLs
-     * Wikimedia Commons: https://commons.wikimedia.org/wiki/File:... or direct image URLs
-     * Flickr Creative Commons: https://live.staticflickr.com/... or https://www.flickr.com/photos/...
-   - CRITICAL - IMAGE SIZING: All images MUST have proper sizing attributes to prevent overflow:
-     * Add style="width: 100%; max-width: 100%; height: auto; object-fit: cover;" to all <img> tags
-     * Or use width="100%" and height="auto" attributes
-     * This prevents images from overflowing the page and causing horizontal/vertical scrolling
-   - NEVER use empty images, broken links, or placeholder.com
-   - Include at least 2-3 images: hero image, feature images, or section images
-   - Example URLs: https://images.unsplash.com/photo-1509042239860-f550ce710b93 (coffee), https://images.pexels.com/photos/2253275/pexels-photo-2253275.jpeg (coffee)
-8. DESIGN MUST BE PREMIUM QUALITY:
-   - Include multiple card elements for features, testimonials, products
-   - Use Font Awesome icons: <i class="fas fa-..."></i>
-   - Proper heading hierarchy (h1 for hero, h2 for sections, h3 for cards)
-   - Add badges, buttons with proper classes
-   - Include stats cards or testimonials if relevant
-9. CRITICAL: Do NOT include <link> tags for external CSS files
-10. CRITICAL: Do NOT include <script src=""> tags for external JS files
-11. All CSS and JS will be injected automatically - just provide the HTML structure
-
-Return ONLY the HTML code as a string. Do not include markdown code blocks, backticks, or explanations."""
-
-    context = f"""Create a PREMIUM, PROFESSIONAL HTML structure for: {prompt} - Design it like Bolt.new.
+    # Add design reference if provided
+    design_reference_note = ""
+    design_ref = project_requirements.get("design_reference")
+    if design_ref:
+        design_reference_note = f"\n\nDESIGN REFERENCE: Follow the design style of {design_ref}. Use similar layout patterns, color schemes, and visual elements."
+    
+    examples = project_requirements.get("design_examples")
+    if examples:
+        design_reference_note += "\n\nDESIGN EXAMPLES TO FOLLOW:\n" + "\n".join([f"- {ex}" for ex in examples])
+    
+    context = _fill_template(_HTML_CONTEXT_TMPL, {
+        "prompt": prompt,
+        "project_type": project_requirements.get("project_type", "webpage"),
+        "theme": theme,
+        "color_scheme": _color_scheme(prompt, theme, project_requirements.get("colors", []), "Use these colors."),
+        "tailwind_note": tailwind_note,
+        "design_reference_note": design_reference_note
+    })
+    return _HTML_SYSTEM_PROMPT, context
 
-PROJECT TYPE: {project_type}
-THEME: {theme}
-{color_scheme}
-{tailwind_note}
 
-CRITICAL UI REQUIREMENTS (LIKE BOLT.NEW):
-- SPLIT INTO CLEAR SECTIONS:
-  * HEADER/NAVBAR (CRITICAL - MUST BE FULLY FUNCTIONAL):
-    - <header><nav class="navbar"> with logo and navigation links</nav></header>
-    - Navigation MUST work on all devices (desktop, tablet, mobile)
-    - Include hamburger menu button for mobile: <button class="menu-toggle"><i class="fas fa-bars"></i></button>
-    - Navigation structure: <ul class="nav-menu"><li><a href="#home">Home</a></li><li><a href="#about">About</a></li></ul>
-    - All navigation links must be clickable and functional
-    - Mobile menu must toggle open/close with JavaScript
-  * BODY/MAIN: <main> with hero section, features, content sections</main>
-  * FOOTER: <footer> with links, social media, copyright</footer>
-- CARD-BASED LAYOUTS: Create cards for features, testimonials, products (use .card, .feature-card classes)
-- TWO-COLUMN HERO: Left column for text (headline, description, buttons), right column for REAL IMAGE
-- PROPER ALIGNMENT: Use .container class, flexbox, and grid for perfect alignment
-- ALWAYS INCLUDE REAL IMAGES:
-  * Use public image URLs from free image services (all free for commercial use, no attribution required)
-  * Images must be RELATED to the content (coffee images for coffee shop, tech images for tech page, etc.)
-  * Use URLs from these free image sources:
-    - Unsplash: https://images.unsplash.com/photo-... or https://unsplash.com/photos/...
-    - Pexels: https://images.pexels.com/photos/... or https://www.pexels.com/photo/...
-    - Pixabay: https://pixabay.com/photos/... or direct image URLs
-    - LibreShot: https://libreshot.com/... or direct image URLs
-    - Wikimedia Commons: https://commons.wikimedia.org/wiki/File:... or direct image URLs
-    - Flickr Creative Commons: https://live.staticflickr.com/... or https://www.flickr.com/photos/...
-  * Include at least 2-3 images: hero image, feature images, section images
-  * NEVER use empty images, broken links, or placeholder.com
-  * Example for coffee shop: https://images.unsplash.com/photo-1509042239860-f550ce710b93 or https://images.pexels.com/photos/2253275/pexels-photo-2253275.jpeg
-  * Example for tech: https://images.unsplash.com/photo-1518770660439-4636190af475 or https://images.pexels.com/photos/1181244/pexels-photo-1181244.jpeg
-- Use Font Awesome icons throughout
-- Create multiple CTA buttons with different styles
-- Add badges, stats cards, or testimonials if relevant
-- Use semantic HTML5 with proper class names (navbar, hero, card, feature-card, container, section, footer, etc.)
-- Make it look like a premium, modern website with professional layout and structure like Bolt.new creates"""
+def _build_css_context(prompt: str, project_requirements: Dict, html_code: str) -> Tuple[str, str]:
+    """Build (system_prompt, user_context) for CSS generation."""
+    theme = project_requirements.get("theme", "modern")
+    context = _fill_template(_CSS_CONTEXT_TMPL, {
+        "prompt": prompt,
+        "project_type": project_requirements.get("project_type", "webpage"),
+        "theme": theme,
+        "color_scheme": _color_scheme(prompt, theme, project_requirements.get("colors", []), "Use these colors as the primary palette."),
+        "html_code": _html_excerpt(html_code, _CSS_HTML_EXCERPT)
+    })
+    return _CSS_SYSTEM_PROMPT, context
 
-    try:
-        response = provider.chat_completion(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": context}
-            ],
-            temperature=0.7,
-            max_tokens=12000  # Significantly increased for better UI
-        )
-        
-        html_code = response["content"].strip()
-        
-        # Remove markdown if present
-        if "```html" in html_code:
-            html_code = html_code.split("```html")[1].split("```")[0].strip()
-        elif "```" in html_code:
-            parts = html_code.split("```")
-            if len(parts) > 1:
-                html_code = parts[1].strip()
-                if html_code.startswith("html"):
-                    html_code = html_code[4:].strip()
-        
-        # Ensure viewport meta tag
-        if "viewport" not in html_code.lower() and "<head>" in html_code:
-            html_code = html_code.replace(
-                "<head>",
-                "<head>\n  <meta name=\"viewport\" content=\"width=device-width, initial-scale=1.0\">"
-            )
-        
-        return html_code
+
+# Functions a project type needs when the analysis did not list any
+_JS_REQUIREMENTS_BY_TYPE: Final[Dict[str, str]] = {
+    "todo list": "\nRequired functions: addTask, deleteTask, toggleTask, clearCompleted. Implement these functions with full functionality."
+}
+
+
+def _js_requirements(project_requirements: Dict) -> str:
+    js_functions = project_requirements.get("js_functions", [])
+    if js_functions:
+        return f"\nRequired functions: {', '.join(js_functions)}. Implement these functions with full functionality."
+    return _JS_REQUIREMENTS_BY_TYPE.get(str(project_requirements.get("project_type", "webpage")).lower(), "")
+
+
+def _build_js_context(prompt: str, project_requirements: Dict, html_code: str) -> Tuple[str, str]:
+    """Build (system_prompt, user_context) for JavaScript generation."""
+    context = _fill_template(_JS_CONTEXT_TMPL, {
+        "prompt": prompt,
+        "project_type": project_requirements.get("project_type", "webpage"),
+        "js_requirements": _js_requirements(project_requirements),
+        "html_code": _html_excerpt(html_code, _JS_HTML_EXCERPT)
+    })
+    return _JS_SYSTEM_PROMPT, context
+
+
+def _code_cache_key(code_type: str, prompt: str, project_requirements: Dict, html_code: str, provider: AIProvider) -> str:
+    """Fingerprint the inputs that shape generated code.
     
+    The generation prompts quote the user's prompt verbatim, so it is part of the
+    key (normalized for case and whitespace only). CSS and JS also depend on the
+    HTML excerpt their prompt includes, so a fresh HTML file never picks up stale
+    CSS/JS generated for different markup. The provider and its model are part
+    of the key so switching providers never replays another model's output.
+    """
+    fingerprint = {
+        "code_type": code_type,
+        "prompt": normalize_prompt(prompt),
+        "provider": _provider_key(provider),
+        "requirements": project_requirements,
+        "html": _html_digest(code_type, html_code)
+    }
+    return hashlib.blake2b(json_dumps_sorted(fingerprint), digest_size=16).hexdigest()
+
+
+def _html_digest(code_type: str, html_code: str) -> str:
+    if code_type == "html":
+        return ""
+    excerpt = html_code[:_CSS_HTML_EXCERPT if code_type == "css" else _JS_HTML_EXCERPT]
+    return hashlib.blake2b(excerpt.encode(), digest_size=16).hexdigest()
+
+
+def _code_key(code_type: str, prompt: str, project_requirements: Dict, html_code: str, provider: AIProvider) -> Optional[str]:
+    """The code cache key, or None when the code cache is disabled."""
+    if not AI_CODE_CACHE_ENABLED:
+        return None
+    return _code_cache_key(code_type, prompt, project_requirements, html_code, provider)
+
+
+def _cached_code(code_type: str, prompt: str, project_requirements: Dict, html_code: str, provider: AIProvider) -> Tuple[Optional[str], Optional[str]]:
+    """Return (cache_key, cached code or None); the key is None when the code cache is disabled."""
+    cache_key = _code_key(code_type, prompt, project_requirements, html_code, provider)
+    return cache_key, (_code_cache.get(cache_key) if cache_key is not None else None)
+
+
+async def generate_code_with_streaming(prompt: str, project_requirements: Dict, html_code: str, provider: AIProvider, code_type: str) -> AsyncGenerator[str, None]:
+    """Generate code with streaming - yields line by line so the client can render a typing effect."""
+    cache_key, cached = _precomputed_code(code_type, prompt, project_requirements, html_code, provider)
+    if cached is not None:
+        for line in cached.splitlines(keepends=True):
+            yield line
+        return
+    
+    # Generate code - forward lines as the provider streams tokens instead of
+    # waiting for the whole file. Lines are held back until the output is
+    # recognizably code, so a failed response is replaced rather than shown.
+    request = _code_request(code_type, prompt, project_requirements, html_code)
+    stream = provider.astream_chat_completion(**request)
+    lines = []
+    usable = False
+    try:
+        async for line in _code_lines(stream):
+            lines.append(line)
+            if not usable:
+                if not _usable_code(code_type, "".join(lines)):
+                    continue
+                usable = True
+                line = "".join(lines)
+            yield line
+            # Nothing useful follows the closing tag - stop decoding there
+            if code_type == "html" and "</html>" in line.lower():
+                break
     except Exception as e:
-        raise Exception(f"Error generating HTML: {str(e)}")
+        raise Exception(f"Error generating {code_type.upper()}: {str(e)}")
+    finally:
+        await stream.aclose()
+    
+    if usable:
+        code = "".join(lines)
+        _record_output(code_type, project_requirements, code, request["max_tokens"])
+        _store_code(cache_key, code)
+    else:
+        # Nothing was sent yet - the client (and the saved file) gets only the fallback
+        for line in _fallback_code(code_type).splitlines(keepends=True):
+            yield line
 
 
-def generate_css_code(prompt: str, project_requirements: Dict, html_code: str, provider: AIProvider) -> str:
-    """Generate CSS code - separate token call."""
-    project_type = project_requirements.get("project_type", "webpage")
-    theme = project_requirements.get("theme", "modern")
-    colors = project_requirements.get("colors", [])
+class BufferedStream:
+    """Async iterator over items buffered by a background task (see buffered).
     
-    color_scheme = ""
-    if colors:
-        color_scheme = f"\nUser requested colors: {', '.join(colors)}. Use these colors as the primary palette."
-    elif theme:
-        if theme.lower() == "dark":
-            color_scheme = "\nUse a dark theme with colors like #1a1a1a, #2d2d2d, #ffffff, #4a9eff"
-        elif theme.lower() == "light":
-            color_scheme = "\nUse a light theme with colors like #ffffff, #f5f5f5, #333333, #007bff"
-        elif "coffee" in prompt.lower():
-            color_scheme = "\nUse warm coffee shop colors: #8B4513, #D2691E, #F5F5DC, #FFFFFF, #CD853F"
-    
-    system_prompt = """You are an expert web developer. Generate PREMIUM, PROFESSIONAL CSS code like Bolt.new with CARD-BASED LAYOUTS, PERFECT ALIGNMENT, and MODERN DESIGN.
-
-CRITICAL REQUIREMENTS FOR PREMIUM UI (LIKE BOLT.NEW):
-1. CSS must be properly formatted with correct indentation
-2. MUST BE FULLY RESPONSIVE - Mobile-first with media queries:
-   - @media (max-width: 768px) for mobile
-   - @media (max-width: 1024px) for tablet
-   - @media (min-width: 1025px) for desktop
-3. USE CSS VARIABLES: :root {{ --primary-color: #...; --secondary-color: #...; --spacing: 1rem; }}
-4. CARD-BASED DESIGN (CRITICAL):
-   - Style .card, .feature-card, .testimonial-card with:
-     * box-shadow: 0 4px 6px rgba(0,0,0,0.1), 0 2px 4px rgba(0,0,0,0.06);
-     * border-radius: 12px to 16px;
-     * padding: 1.5rem to 2rem;
-     * background: white or subtle gradient;
-     * hover: transform: translateY(-4px); box-shadow: 0 8px 16px rgba(0,0,0,0.15);
-   - Card grids: display: grid; grid-template-columns: repeat(auto-fit, minmax(280px, 1fr)); gap: 2rem;
-5. PERFECT ALIGNMENT AND LAYOUT (CRITICAL - MUST IMPLEMENT ALL):
-   - .container {{ max-width: 1200px; margin: 0 auto; padding: 0 2rem; }}
-   - Two-column hero: display: grid; grid-template-columns: 1fr 1fr; gap: 4rem; align-items: center;
-   - Navigation (CRITICAL - MUST BE RESPONSIVE AND FUNCTIONAL):
-     * .navbar {{ display: flex; justify-content: space-between; align-items: center; width: 100%; padding: 1rem 2rem; position: relative; }}
-     * .nav-menu {{ display: flex; list-style: none; gap: 2rem; margin: 0; padding: 0; }}
-     * Mobile responsive: @media (max-width: 768px) {{
-       .menu-toggle {{ display: block; background: none; border: none; font-size: 1.5rem; cursor: pointer; color: inherit; }}
-       .nav-menu {{ display: none; position: absolute; top: 100%; left: 0; width: 100%; background: white; flex-direction: column; padding: 2rem; box-shadow: 0 4px 6px rgba(0,0,0,0.1); z-index: 1000; }}
-       .nav-menu.active {{ display: flex; }}
-     }}
-     * Desktop: @media (min-width: 769px) {{ .menu-toggle {{ display: none; }} .nav-menu {{ display: flex; }} }}
-     * Smooth transitions: .nav-menu {{ transition: all 0.3s ease; }}
-   - Center headings: text-align: center; for h1, h2, h3 in hero and sections
-   - Left align paragraphs: text-align: left; for body text and descriptions
-   - Justify text: text-align: justify; for longer paragraphs if needed
-   - Button groups: display: flex; gap: 1rem; justify-content: flex-start; or center;
-   - Vertical centering: display: flex; align-items: center; for vertical alignment
-   - Horizontal centering: justify-content: center; for horizontal alignment
-   - Center containers: margin: 0 auto; width: 100%; max-width: 1200px;
-   - Consistent spacing: 1rem, 1.5rem, 2rem, 3rem, 4rem, 6rem
-   - ALWAYS use alignment: justify-content, align-items, text-align, margin: 0 auto;
-6. MODERN COLOR SCHEMES:
-   - Gradients: linear-gradient(135deg, #color1, #color2)
-   - Mixed warm and cool colors
-   - Proper contrast ratios
-   - CSS variables for theming
-7. TYPOGRAPHY:
-   - Fonts: 'Poppins' for body, 'Playfair Display' for headings (if appropriate)
-   - Hero headline: 3.5rem, font-weight: 700-800, line-height: 1.2
-   - Section headings: 2.5rem, font-weight: 600-700
-   - Body: 1.125rem, font-weight: 400, line-height: 1.7
-8. BUTTONS:
-   - Primary: gradient background, border-radius: 10px, padding: 1rem 2rem, hover: scale(1.05)
-   - Secondary: border style, transparent background
-   - Add icons with proper spacing
-9. ANIMATIONS:
-   - @keyframes fadeIn, slideInUp, pulse
-   - Smooth transitions: transition: all 0.3s ease
-   - Hover effects on cards, buttons, links
-10. SPACING:
-    - Section padding: 4rem to 6rem
-    - Card gaps: 2rem in grids
-    - Consistent margins between sections
-11. RESPONSIVE:
-    - Mobile: stack columns, reduce font sizes, adjust padding
-    - Tablet: adjust grid columns, moderate spacing
-    - Desktop: full layout with optimal spacing
-12. MODERN EFFECTS:
-    - Multiple shadow layers: box-shadow with rgba values
-    - Rounded corners: 8px to 16px
-    - Gradient backgrounds for hero sections
-    - Overlay effects for images
-13. IMAGE SIZING (CRITICAL - PREVENT OVERFLOW):
-    - All images MUST have proper sizing to prevent overflow:
-      * img {{ width: 100%; max-width: 100%; height: auto; object-fit: cover; }}
-      * Or use specific dimensions: width: 600px; max-width: 100%; height: auto;
-      * Prevent horizontal scrolling: body {{ max-width: 100vw; overflow-x: hidden; }}
-      * Prevent vertical overflow: Use proper height constraints
-    - Responsive images: Use max-width: 100%; height: auto; for all images
-    - Hero images: Can use height: 500px; or height: 60vh; with object-fit: cover;
-    - Container images: width: 100%; max-width: 100%; height: auto;
-
-Return ONLY the CSS code as a string. Do not include markdown code blocks, backticks, or explanations."""
-
-    context = f"""Create PREMIUM, PROFESSIONAL CSS for: {prompt} - Design it like Bolt.new with cards, perfect alignment, and modern UI.
+    aclose() cancels the producer and waits for it to stop, even when iteration
+    never started - closing an unstarted async generator would not run its cleanup.
+    """
+    
+    def __init__(self, task: asyncio.Future, items: AsyncGenerator[Any, None]):
+        self._task = task
+        self._items = items
+    
+    def __aiter__(self) -> "BufferedStream":
+        return self
+    
+    async def __anext__(self) -> Any:
+        return await self._items.__anext__()
+    
+    async def aclose(self) -> None:
+        await self._items.aclose()
+        if not self._task.done():
+            self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
 
-PROJECT TYPE: {project_type}
-THEME: {theme}
-{color_scheme}
 
-HTML Structure (for reference):
-{html_code[:800]}
-
-CRITICAL UI REQUIREMENTS (LIKE BOLT.NEW):
-1. CARD-BASED LAYOUTS:
-   - Style all .card, .feature-card elements with shadows, rounded corners (12px-16px), padding (1.5rem-2rem)
-   - Create card grids: display: grid; grid-template-columns: repeat(auto-fit, minmax(280px, 1fr)); gap: 2rem;
-   - Add hover effects: transform: translateY(-4px); box-shadow: 0 8px 16px rgba(0,0,0,0.15);
-   - Card backgrounds: white or subtle gradients
-2. TWO-COLUMN HERO SECTION:
-   - Left column: text content with proper typography (headline 3.5rem, description, buttons)
-   - Right column: image/graphic with proper sizing
-   - Use grid: display: grid; grid-template-columns: 1fr 1fr; gap: 4rem; align-items: center;
-   - Responsive: stack on mobile with @media query
-3. PERFECT ALIGNMENT (CRITICAL - MUST IMPLEMENT ALL):
-   - .container {{ max-width: 1200px; margin: 0 auto; padding: 0 2rem; }}
-   - Center containers: margin: 0 auto; width: 100%; max-width: 1200px;
-   - Center headings: text-align: center; for h1, h2, h3 in hero and sections
-   - Left align paragraphs: text-align: left; for body text and descriptions
-   - Justify text: text-align: justify; for longer paragraphs
-   - Navigation (CRITICAL - MUST BE RESPONSIVE AND FUNCTIONAL):
-     * .navbar {{ display: flex; justify-content: space-between; align-items: center; width: 100%; padding: 1rem 2rem; position: relative; }}
-     * .nav-menu {{ display: flex; list-style: none; gap: 2rem; margin: 0; padding: 0; }}
-     * Mobile responsive: @media (max-width: 768px) {{
-       .menu-toggle {{ display: block; background: none; border: none; font-size: 1.5rem; cursor: pointer; color: inherit; }}
-       .nav-menu {{ display: none; position: absolute; top: 100%; left: 0; width: 100%; background: white; flex-direction: column; padding: 2rem; box-shadow: 0 4px 6px rgba(0,0,0,0.1); z-index: 1000; }}
-       .nav-menu.active {{ display: flex; }}
-     }}
-     * Desktop: @media (min-width: 769px) {{ .menu-toggle {{ display: none; }} .nav-menu {{ display: flex; }} }}
-     * Smooth transitions: .nav-menu {{ transition: all 0.3s ease; }}
-   - Hero alignment: display: flex; or grid with align-items: center; justify-content: space-between; or center;
-   - Button alignment: display: flex; gap: 1rem; justify-content: flex-start; or center;
-   - Flexbox centering: display: flex; justify-content: center; align-items: center; for perfect centering
-   - Grid alignment: Use place-items: center; or align-items: center; justify-items: center;
-   - Consistent spacing: Use rem units (1rem, 1.5rem, 2rem, 3rem, 4rem, 6rem) for all margins and padding
-   - ALWAYS use alignment properties: justify-content, align-items, text-align, margin: 0 auto;
-4. MODERN COLOR THEMES:
-   - Use gradients: linear-gradient(135deg, #color1, #color2)
-   - Mixed warm and cool colors
-   - CSS variables: :root {{ --primary: #...; --secondary: #...; }}
-   - Proper contrast for readability
-5. TYPOGRAPHY:
-   - Apply fonts: 'Poppins' for body, 'Playfair Display' for headings (if appropriate)
-   - Hero headline: 3.5rem, font-weight: 700-800, line-height: 1.2
-   - Section headings: 2.5rem, font-weight: 600-700
-   - Body: 1.125rem, font-weight: 400, line-height: 1.7
-6. BUTTONS:
-   - Primary: gradient background, border-radius: 10px, padding: 1rem 2rem, hover: transform: scale(1.05)
-   - Secondary: border style, transparent background
-   - Add icons with proper spacing
-7. RESPONSIVE:
-   - Mobile-first approach
-   - Breakpoints: 768px (mobile), 1024px (tablet)
-   - Adjust font sizes, spacing, and layouts for each breakpoint
-8. ANIMATIONS:
-   - @keyframes fadeIn, slideInUp, pulse
-   - Smooth transitions: transition: all 0.3s ease
-   - Hover effects on all interactive elements
-9. MODERN EFFECTS:
-   - Multiple shadow layers for depth: box-shadow with rgba values
-   - Rounded corners: 8px to 16px
-   - Gradient backgrounds
-   - Overlay effects
-
-Make it look like a premium, professional website with card-based layouts, perfect alignment, and modern design like Bolt.new creates."""
+def buffered(source: AsyncIterator[Any], maxsize: int = 0, batch_chars: int = 0) -> BufferedStream:
+    """Start consuming source in a background task right away and return an async
+    iterator over the buffered items.
+    
+    Lets a code stream run ahead while the caller is still sending earlier steps
+    to the client. The buffer is unbounded by default so the producer never stalls
+    behind a slow consumer; errors from source are re-raised to the consumer.
+    With batch_chars, string items that are already waiting are joined into
+    chunks of up to about that size, so a backlog goes out as a few messages
+    instead of one per line - nothing is held back to fill a batch.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize)
+    done = object()
+    
+    async def pump():
+        try:
+            async for item in source:
+                await queue.put(item)
+        except Exception as e:
+            await queue.put(e)
+        finally:
+            await queue.put(done)
+    
+    task = asyncio.ensure_future(pump())
+    
+    async def drain():
+        pending = None
+        try:
+            while True:
+                item = await queue.get() if pending is None else pending
+                pending = None
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                if batch_chars:
+                    parts = [item]
+                    size = len(item)
+                    while size < batch_chars and not queue.empty():
+                        pending = queue.get_nowait()
+                        if pending is done or isinstance(pending, Exception):
+                            break
+                        parts.append(pending)
+                        size += len(pending)
+                        pending = None
+                    item = "".join(parts)
+                yield item
+        finally:
+            if not task.done():
+                task.cancel()
+    
+    return BufferedStream(task, drain())
 
-    try:
-        response = provider.chat_completion(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": context}
-            ],
-            temperature=0.7,
-            max_tokens=12000  # Significantly increased for better UI
-        )
-        
-        css_code = response["content"].strip()
-        
-        # Remove markdown if present
-        if "```css" in css_code:
-            css_code = css_code.split("```css")[1].split("```")[0].strip()
-        elif "```" in css_code:
-            parts = css_code.split("```")
-            if len(parts) > 1:
-                css_code = parts[1].strip()
-                if css_code.startswith("css"):
-                    css_code = css_code[3:].strip()
-        
-        return css_code
+
+# Largest code chunk forwarded to the client in one message
+_CODE_CHUNK_CHARS: Final[int] = 1024
+
+_CODE_LABELS: Final[Dict[str, str]] = {"html": "HTML", "css": "CSS", "js": "JavaScript"}
+
+
+def stream_page_files(prompt: str, project_requirements: Dict, provider: AIProvider) -> Dict[str, BufferedStream]:
+    """Start generating the page and return buffered code streams for "html", "css" and "js".
+    
+    The CSS and JS prompts only include the start of the HTML, so both begin as
+    soon as the HTML stream has produced that much instead of after the whole file.
+    All three run in the background until consumed or closed with close_page_streams.
+    """
+    loop = asyncio.get_running_loop()
+    excerpt: asyncio.Future = loop.create_future()
+    full_html: asyncio.Future = loop.create_future()
+    # Only static pages wait for the full HTML - mark an HTML error as seen for the rest
+    full_html.add_done_callback(lambda future: future.cancelled() or future.exception())
+    
+    async def html_source():
+        html_parts: List[str] = []
+        size = 0
+        try:
+            async for line in generate_code_with_streaming(prompt, project_requirements, "", provider, "html"):
+                yield line
+                html_parts.append(line)
+                if not excerpt.done():
+                    size += len(line)
+                    if size >= _CSS_HTML_EXCERPT:
+                        excerpt.set_result("".join(html_parts))
+        except BaseException as e:
+            for html_future in (excerpt, full_html):
+                if not html_future.done():
+                    if isinstance(e, Exception):
+                        html_future.set_exception(e)
+                    else:
+                        html_future.cancel()
+            raise
+        html_code = "".join(html_parts)
+        if not excerpt.done():
+            excerpt.set_result(html_code)
+        full_html.set_result(html_code)
+    
+    async def after_html(code_type: str):
+        # Whether a static page can skip the JS call depends on all of its markup
+        if code_type == "js" and _static_page_type(project_requirements):
+            html_code = await full_html
+        else:
+            html_code = await excerpt
+        async for line in generate_code_with_streaming(prompt, project_requirements, html_code, provider, code_type):
+            yield line
     
+    return {
+        "html": buffered(html_source(), batch_chars=_CODE_CHUNK_CHARS),
+        "css": buffered(after_html("css"), batch_chars=_CODE_CHUNK_CHARS),
+        "js": buffered(after_html("js"), batch_chars=_CODE_CHUNK_CHARS)
+    }
+
+
+async def close_page_streams(page_streams: Dict[str, BufferedStream]) -> None:
+    """Stop any page generation still running, e.g. after an error or a client disconnect."""
+    for stream in page_streams.values():
+        await stream.aclose()
+
+
+def _code_request(code_type: str, prompt: str, project_requirements: Dict, html_code: str) -> Dict[str, Any]:
+    """Build chat_completion arguments for generating one file."""
+    if code_type == "html":
+        _, context = _build_html_context(prompt, project_requirements)
+    elif code_type == "css":
+        _, context = _build_css_context(prompt, project_requirements, html_code)
+    else:  # js
+        _, context = _build_js_context(prompt, project_requirements, html_code)
+    return {
+        "messages": _msgs(_CODE_SYSTEM_MESSAGES[code_type], context),
+        "temperature": AI_CODE_TEMPERATURE,
+        "max_tokens": _max_tokens(code_type, project_requirements)
+    }
+
+
+def _precomputed_code(code_type: str, prompt: str, project_requirements: Dict, html_code: str, provider: AIProvider) -> Tuple[Optional[str], Optional[str]]:
+    """Return (cache_key, code) where code is the static-page script or a cached file, else None."""
+    if code_type == "js":
+        static_js = _static_page_js(project_requirements, html_code)
+        if static_js is not None:
+            return None, static_js
+    return _cached_code(code_type, prompt, project_requirements, html_code, provider)
+
+
+def _store_code(cache_key: Optional[str], code: str) -> None:
+    if cache_key is not None and code:
+        _code_cache.set(cache_key, code)
+
+
+def _finish_code(code_type: str, project_requirements: Dict, cache_key: Optional[str], code: str, max_tokens: int) -> str:
+    """Record and cache a generated file; unusable output is replaced by the fallback and not cached."""
+    if not _usable_code(code_type, code):
+        return _fallback_code(code_type)
+    _record_output(code_type, project_requirements, code, max_tokens)
+    _store_code(cache_key, code)
+    return code
+
+
+def _generate_code(code_type: str, prompt: str, project_requirements: Dict, html_code: str, provider: AIProvider) -> str:
+    cache_key, code = _precomputed_code(code_type, prompt, project_requirements, html_code, provider)
+    if code is not None:
+        return code
+    request = _code_request(code_type, prompt, project_requirements, html_code)
+    try:
+        response = provider.chat_completion_with_retry(**request)
+        code = _strip_code_fence(response["content"])
     except Exception as e:
-        raise Exception(f"Error generating CSS: {str(e)}")
+        raise Exception(f"Error generating {_CODE_LABELS[code_type]}: {str(e)}")
+    return _finish_code(code_type, project_requirements, cache_key, code, request["max_tokens"])
+
+
+async def _agenerate_code(code_type: str, prompt: str, project_requirements: Dict, html_code: str, provider: AIProvider) -> str:
+    # The provider call runs in a worker thread, leaving the event loop free for other requests
+    cache_key, code = _precomputed_code(code_type, prompt, project_requirements, html_code, provider)
+    if code is not None:
+        return code
+    request = _code_request(code_type, prompt, project_requirements, html_code)
+    try:
+        response = await provider.achat_completion(**request)
+        code = _strip_code_fence(response["content"])
+    except Exception as e:
+        raise Exception(f"Error generating {_CODE_LABELS[code_type]}: {str(e)}")
+    return _finish_code(code_type, project_requirements, cache_key, code, request["max_tokens"])
+
+
+def generate_html_code(prompt: str, project_requirements: Dict, provider: AIProvider) -> str:
+    """Generate HTML code - separate token call."""
+    return _ensure_viewport(_generate_code("html", prompt, project_requirements, "", provider))
+
+
+async def generate_html_code_async(prompt: str, project_requirements: Dict, provider: AIProvider) -> str:
+    """Async variant of generate_html_code."""
+    return _ensure_viewport(await _agenerate_code("html", prompt, project_requirements, "", provider))
+
+
+_VIEWPORT_META: Final[str] = "\n  <meta name=\"viewport\" content=\"width=device-width, initial-scale=1.0\">"
+# How far past <head> to look for an existing tag when the head is never closed
+_HEAD_SCAN_CHARS: Final[int] = 2048
+
+
+def _ensure_viewport(html_code: str) -> str:
+    """Insert a viewport meta tag after <head> unless the head already has one."""
+    head = html_code.find("<head>")
+    if head < 0:
+        return html_code
+    insert_at = head + len("<head>")
+    head_end = html_code.find("</head>", insert_at)
+    if head_end < 0:
+        head_end = insert_at + _HEAD_SCAN_CHARS
+    # Only the head can hold the tag, so lowercase just that slice rather than the whole page
+    if "viewport" in html_code[insert_at:head_end].lower():
+        return html_code
+    return html_code[:insert_at] + _VIEWPORT_META + html_code[insert_at:]
+
+
+def generate_css_code(prompt: str, project_requirements: Dict, html_code: str, provider: AIProvider) -> str:
+    """Generate CSS code - separate token call."""
+    return _generate_code("css", prompt, project_requirements, html_code, provider)
+
+
+async def generate_css_code_async(prompt: str, project_requirements: Dict, html_code: str, provider: AIProvider) -> str:
+    """Async variant of generate_css_code."""
+    return await _agenerate_code("css", prompt, project_requirements, html_code, provider)
 
 
 def generate_js_code(prompt: str, project_requirements: Dict, html_code: str, provider: AIProvider) -> str:
     """Generate JavaScript code - separate token call."""
-    js_functions = project_requirements.get("js_functions", [])
-    project_type = project_requirements.get("project_type", "webpage")
-    
-    js_requirements = ""
-    if js_functions:
-        js_requirements = f"\nRequired functions: {', '.join(js_functions)}. Implement these functions with full functionality."
-    elif project_type.lower() == "todo list":
-        js_requirements = "\nRequired functions: addTask, deleteTask, toggleTask, clearCompleted. Implement these functions with full functionality."
-    
-    system_prompt = """You are an expert JavaScript developer. Generate clean, modern, production-ready JavaScript code.
-
-CRITICAL REQUIREMENTS:
-1. JavaScript must be properly formatted with correct indentation
-2. Use modern ES6+ syntax (const, let, arrow functions, template literals)
-3. Add proper error handling
-4. Make code modular and well-organized
-5. Include comments for complex logic
-6. Ensure all interactive elements work smoothly
-7. Add smooth animations and transitions using JavaScript
-8. Handle user interactions properly (click, hover, input events)
-9. Use event delegation where appropriate
-10. Make code efficient and performant
+    return _generate_code("js", prompt, project_requirements, html_code, provider)
 
-Return ONLY the JavaScript code as a string. Do not include markdown code blocks, backticks, or explanations."""
 
-    context = f"""Create JavaScript code for: {prompt}
+async def generate_js_code_async(prompt: str, project_requirements: Dict, html_code: str, provider: AIProvider) -> str:
+    """Async variant of generate_js_code."""
+    return await _agenerate_code("js", prompt, project_requirements, html_code, provider)
 
-PROJECT TYPE: {project_type}
-{js_requirements}
 
-HTML Structure (for reference):
-{html_code[:500]}
+async def generate_webpage_files_async(prompt: str, project_requirements: Dict, provider: AIProvider) -> Dict[str, str]:
+    """Generate the three files with one call each; CSS and JS only need the HTML, so they run concurrently."""
+    html_code = await generate_html_code_async(prompt, project_requirements, provider)
+    css_code, js_code = await asyncio.gather(
+        generate_css_code_async(prompt, project_requirements, html_code, provider),
+        generate_js_code_async(prompt, project_requirements, html_code, provider)
+    )
+    return {"html": html_code, "css": css_code, "js": js_code}
 
-CRITICAL REQUIREMENTS:
-- Modern ES6+ syntax
-- Smooth interactions and animations
-- Proper event handling
-- Error handling
-- Well-organized, modular code
-- Add interactive features based on the project type"""
 
+def generate_webpage_bundle(prompt: str, project_requirements: Dict, provider: AIProvider) -> Dict[str, str]:
+    """Generate index.html, style.css and script.js in a single JSON-mode call.
+    
+    One round trip instead of three, and the model writes the CSS and JS with the
+    whole HTML in context. Returns {"html", "css", "js"}; the files are also stored
+    in the code cache, so per-file generation for the same request reuses them.
+    """
+    _, context = _build_html_context(prompt, project_requirements)
+    
     try:
-        response = provider.chat_completion(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": context}
-            ],
-            temperature=0.7,
-            max_tokens=12000  # Significantly increased for better UI
+        response = provider.chat_completion_with_retry(
+            messages=_msgs(_BUNDLE_SYSTEM_PROMPT, context + _js_requirements(project_requirements)),
+            temperature=AI_CODE_TEMPERATURE,
+            max_tokens=_BUNDLE_MAX_TOKENS,
+            response_format=_JSON_RESPONSE_FORMAT
         )
-        
-        js_code = response["content"].strip()
-        
-        # Remove markdown if present
-        if "```javascript" in js_code:
-            js_code = js_code.split("```javascript")[1].split("```")[0].strip()
-        elif "```js" in js_code:
-            js_code = js_code.split("```js")[1].split("```")[0].strip()
-        elif "```" in js_code:
-            parts = js_code.split("```")
-            if len(parts) > 1:
-                js_code = parts[1].strip()
-                if js_code.startswith("javascript") or js_code.startswith("js"):
-                    js_code = js_code[10:].strip() if js_code.startswith("javascript") else js_code[2:].strip()
-        
-        return js_code
-    
+        data = _response_json(response)
     except Exception as e:
-        raise Exception(f"Error generating JavaScript: {str(e)}")
+        raise Exception(f"Error generating webpage: {str(e)}")
+    
+    if not isinstance(data, dict) or not data.get("html"):
+        raise Exception("Error generating webpage: response has no HTML")
+    # Each file is validated, recorded and cached like a per-file result, under the
+    # same keys, so the per-file generators reuse them for this prompt only
+    raw_html = _finish_code(
+        "html", project_requirements, _code_key("html", prompt, project_requirements, "", provider),
+        _strip_code_fence(str(data["html"])), _max_tokens("html", project_requirements)
+    )
+    files = {"html": _ensure_viewport(raw_html)}
+    for code_type in ("css", "js"):
+        files[code_type] = _finish_code(
+            code_type, project_requirements, _code_key(code_type, prompt, project_requirements, files["html"], provider),
+            _strip_code_fence(str(data.get(code_type) or "")), _max_tokens(code_type, project_requirements)
+        )
+    return files
@@ -3,7 +3,6 @@ Design Reference System - Allows feeding design examples to improve AI generatio
 """
 
 from typing import Dict, List, Optional
-import json
 import os
 
 # Design pattern library - stores design examples
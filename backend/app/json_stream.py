@@ -0,0 +1,369 @@
+"""
+Incremental JSON parsing for streamed LLM output
+"""
+
+import json
+import re
+from typing import Any, List, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_loads(data: Any) -> Any:
+    """Parse JSON from str or bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(obj: Any) -> bytes:
+    """Serialize obj to UTF-8 JSON bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode()
+
+
+def json_dumps_text(obj: Any) -> str:
+    """json_dumps as str, e.g. for server-sent event payloads."""
+    return json_dumps(obj).decode()
+
+
+def json_dumps_sorted(obj: Any) -> bytes:
+    """Serialize obj with sorted keys (for stable cache keys); unknown types use str()."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS, default=str)
+    return json.dumps(obj, sort_keys=True, default=str).encode()
+
+# Run of plain string characters (no quote, no backslash)
+_STRING_RUN_RE = re.compile(r'[^"\\]*')
+_NUMBER_CHARS = frozenset("0123456789+-.eE")
+_LITERAL_CHARS = frozenset("truefalsn")
+_LITERALS = {"true": True, "false": False, "null": None}
+
+_VALUE, _STRING, _NUMBER, _LITERAL = range(4)
+
+
+class IncrementalJsonParser:
+    """Single-pass streaming JSON parser.
+
+    feed() consumes chunks of text as they arrive and returns (path, value)
+    events for every value completed so far, e.g. (["todos", 0], {...}) the
+    moment the first todo object closes. Each character is looked at once, so
+    parsing a streamed response is O(n) rather than re-parsing the accumulated
+    text on every chunk. Text before the first '{' or '[' (such as a markdown
+    fence) and anything after the root value is ignored.
+    """
+
+    def __init__(self):
+        self._stack: List[Any] = []       # open containers
+        self._path: List[Any] = []        # key/index of each open container in its parent
+        self._keys: List[Any] = []        # pending dict key per open container
+        self._state = _VALUE
+        self._token: List[str] = []
+        self._escape = False
+        self._started = False
+        self.done = False
+        self.result: Any = None
+
+    def feed(self, chunk: str) -> List[Tuple[List[Any], Any]]:
+        """Consume a chunk of text and return the values it completed."""
+        events: List[Tuple[List[Any], Any]] = []
+        pos, end = 0, len(chunk)
+        while pos < end and not self.done:
+            if not self._started:
+                brace = _first_of(chunk, pos, "{[")
+                if brace < 0:
+                    return events
+                pos = brace
+                self._started = True
+
+            if self._state == _STRING:
+                pos = self._consume_string(chunk, pos, events)
+                continue
+
+            char = chunk[pos]
+            if self._state == _NUMBER:
+                if char in _NUMBER_CHARS:
+                    self._token.append(char)
+                    pos += 1
+                    continue
+                self._finish_token(events)
+            elif self._state == _LITERAL:
+                if char in _LITERAL_CHARS:
+                    self._token.append(char)
+                    pos += 1
+                    continue
+                self._finish_token(events)
+
+            pos += 1
+            if char in " \t\r\n,:":
+                continue
+            if char == "{" or char == "[":
+                self._path.append(self._next_key())
+                self._stack.append({} if char == "{" else [])
+                self._keys.append(None)
+            elif char == "}" or char == "]":
+                if not self._stack:
+                    continue
+                value = self._stack.pop()
+                self._keys.pop()
+                self._path.pop()
+                self._complete(value, events)
+            elif char == '"':
+                self._state = _STRING
+                self._token = []
+            elif char in _NUMBER_CHARS:
+                self._state = _NUMBER
+                self._token = [char]
+            elif char in _LITERAL_CHARS:
+                self._state = _LITERAL
+                self._token = [char]
+        return events
+
+    def _consume_string(self, chunk: str, pos: int, events: List[Tuple[List[Any], Any]]) -> int:
+        end = len(chunk)
+        while pos < end:
+            if self._escape:
+                self._token.append(chunk[pos])
+                self._escape = False
+                pos += 1
+                continue
+            run_end = _STRING_RUN_RE.match(chunk, pos).end()
+            if run_end > pos:
+                self._token.append(chunk[pos:run_end])
+                pos = run_end
+                continue
+            char = chunk[pos]
+            pos += 1
+            if char == "\\":
+                self._token.append(char)
+                self._escape = True
+            else:  # closing quote
+                self._state = _VALUE
+                text = json_loads('"' + "".join(self._token) + '"')
+                self._token = []
+                if self._stack and isinstance(self._stack[-1], dict) and self._keys[-1] is None:
+                    self._keys[-1] = text
+                else:
+                    self._complete(text, events)
+                return pos
+        return pos
+
+    def _finish_token(self, events: List[Tuple[List[Any], Any]]) -> None:
+        token = "".join(self._token)
+        self._token = []
+        state, self._state = self._state, _VALUE
+        if state == _LITERAL:
+            if token not in _LITERALS:
+                raise ValueError(f"Invalid JSON literal: {token}")
+            self._complete(_LITERALS[token], events)
+        else:
+            self._complete(json_loads(token), events)
+
+    def _next_key(self) -> Any:
+        if not self._stack:
+            return None
+        parent = self._stack[-1]
+        return len(parent) if isinstance(parent, list) else self._keys[-1]
+
+    def _complete(self, value: Any, events: List[Tuple[List[Any], Any]]) -> None:
+        if not self._stack:
+            self.result = value
+            self.done = True
+            events.append(([], value))
+            return
+        parent = self._stack[-1]
+        if isinstance(parent, list):
+            key = len(parent)
+            parent.append(value)
+        else:
+            key = self._keys[-1]
+            parent[key] = value
+            self._keys[-1] = None
+        events.append((self._path[1:] + [key], value))
+
+    def close(self) -> List[Tuple[List[Any], Any]]:
+        """Flush a trailing bare number or literal at end of input."""
+        events: List[Tuple[List[Any], Any]] = []
+        if self._state in (_NUMBER, _LITERAL) and not self.done:
+            self._finish_token(events)
+        return events
+
+
+def _first_of(text: str, start: int, chars: str) -> int:
+    positions = [i for i in (text.find(c, start) for c in chars) if i >= 0]
+    return min(positions) if positions else -1
+
+
+_NUMBER_START = frozenset("0123456789+-.")
+_WORD_START = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_$")
+_WORD_CHARS = _WORD_START | frozenset("0123456789-")
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null", "true": "true", "false": "false", "null": "null"}
+# A bare number, literal or string at the start of text with no object or array
+_SCALAR_RE = re.compile(r'\s*(-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null|"(?:[^"\\]|\\.)*")')
+
+
+def parse_partial_json(text: str) -> Any:
+    """Parse JSON from an LLM, tolerating common defects instead of failing.
+    
+    Valid JSON takes the fast path. Otherwise the text is repaired in one pass:
+    trailing commas are dropped and missing ones between values inserted, unquoted
+    keys and single-quoted strings are quoted, Python True/False/None become JSON
+    literals, numbers like .5 or 5. are completed, raw newlines in strings are
+    escaped and a truncated tail (open string, dangling key, unclosed brackets) is
+    closed. Text before the first bracket and after the root value is ignored;
+    without any bracket, a leading number, literal or string is returned ("12abc"
+    gives 12).
+    
+    Not repaired: missing colons, unbalanced quotes inside strings and comments.
+    Raises json.JSONDecodeError (a ValueError) if nothing parseable is found.
+    """
+    try:
+        return json_loads(text)
+    except ValueError:
+        pass
+    return json_loads(_repair_json(text))
+
+
+def _repair_json(text: str) -> str:
+    start = _first_of(text, 0, "{[")
+    if start < 0:
+        scalar = _SCALAR_RE.match(text)
+        if scalar is None:
+            raise json.JSONDecodeError("No JSON object or array found", text, 0)
+        return scalar.group(1)
+    
+    out: List[str] = []
+    stack: List[str] = []          # open '{' / '['
+    key_start: List[int] = []      # per open object: index in out of a key awaiting ':', or -1
+    expect_key = False
+    after_value = False            # a value just ended - another one needs a comma first
+    quote = ""                     # open string's quote char, "" outside strings
+    i, n = start, len(text)
+    
+    while i < n:
+        char = text[i]
+        if quote:
+            if char == "\\" and i + 1 < n:
+                # \' is only valid inside single-quoted strings
+                out.append("'" if text[i + 1] == "'" else text[i:i + 2])
+                i += 2
+                continue
+            if char == quote:
+                out.append('"')
+                quote = ""
+                after_value = True
+            elif char == '"':
+                out.append('\\"')
+            elif char == "\n":
+                out.append("\\n")
+            elif char == "\r":
+                out.append("\\r")
+            elif char == "\t":
+                out.append("\\t")
+            else:
+                out.append(char)
+            i += 1
+            continue
+        
+        if char in " \t\r\n":
+            out.append(char)
+            i += 1
+            continue
+        if after_value and stack and (char in "\"'{[" or char in _NUMBER_START or char in _WORD_START):
+            out.append(",")
+            expect_key = stack[-1] == "{"
+        after_value = False
+        
+        if char == '"' or char == "'":
+            if expect_key and stack and stack[-1] == "{":
+                key_start[-1] = len(out)
+                expect_key = False
+            quote = char
+            out.append('"')
+        elif char == "{" or char == "[":
+            stack.append(char)
+            key_start.append(-1)
+            expect_key = char == "{"
+            out.append(char)
+        elif char == "}" or char == "]":
+            if stack:
+                _drop_trailing_comma(out)
+                out.append("}" if stack.pop() == "{" else "]")
+                key_start.pop()
+                if not stack:
+                    break
+                after_value = True
+            expect_key = False
+        elif char == ",":
+            out.append(char)
+            expect_key = bool(stack) and stack[-1] == "{"
+        elif char == ":":
+            out.append(char)
+            expect_key = False
+            if key_start:
+                key_start[-1] = -1
+        elif char in _NUMBER_START:
+            # Copy numbers whole so an exponent ("1e5") is not read as a bare word
+            j = i + 1
+            while j < n and text[j] in _NUMBER_CHARS:
+                j += 1
+            out.append(_complete_number(text[i:j]))
+            after_value = True
+            i = j
+            continue
+        elif char in _WORD_START:
+            j = i + 1
+            while j < n and text[j] in _WORD_CHARS:
+                j += 1
+            word = text[i:j]
+            if expect_key and stack and stack[-1] == "{":
+                key_start[-1] = len(out)
+                expect_key = False
+                out.append('"' + word + '"')
+            else:
+                out.append(_PY_LITERALS.get(word, '"' + word + '"'))
+            after_value = True
+            i = j
+            continue
+        else:
+            out.append(char)
+        i += 1
+    
+    # Close a truncated tail
+    if quote:
+        if out and out[-1] == "\\":
+            out.pop()
+        out.append('"')
+    if stack:
+        if stack[-1] == "{" and key_start[-1] >= 0:
+            del out[key_start[-1]:]  # key with no value
+        _drop_trailing_comma(out)
+        tail = "".join(out).rstrip()
+        if tail.endswith(":"):
+            out = [tail, "null"]
+        while stack:
+            out.append("}" if stack.pop() == "{" else "]")
+    return "".join(out)
+
+
+def _complete_number(number: str) -> str:
+    """Make JSON of number forms JSON lacks: +1, .5, -.5 and 5."""
+    sign = "-" if number.startswith("-") else ""
+    digits = number.lstrip("+-")
+    if digits.startswith("."):
+        digits = "0" + digits
+    if digits.endswith("."):
+        digits += "0"
+    return sign + digits
+
+
+def _drop_trailing_comma(out: List[str]) -> None:
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ",":
+        out.pop()
+
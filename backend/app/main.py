@@ -1,8 +1,11 @@
+import asyncio
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.database import engine, Base
 from app.routers import auth, projects, ai
+from app.ai_providers import close_providers, warm_providers
 
 # Create database tables
 # Drop and recreate to handle schema changes
@@ -33,6 +36,17 @@ app.include_router(projects.router)
 app.include_router(ai.router)
 
 
+@app.on_event("startup")
+async def warm_ai_providers():
+    # In the background - startup does not wait on provider round trips
+    asyncio.get_running_loop().run_in_executor(None, warm_providers)
+
+
+@app.on_event("shutdown")
+def shutdown_ai_providers():
+    close_providers()
+
+
 @app.get("/")
 async def root():
     return {
@@ -3,7 +3,6 @@ from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List
 import uuid
-import json
 import asyncio
 
 from app.database import get_db
@@ -17,6 +16,8 @@ from app.schemas import (
     ProjectResponse
 )
 from app.ai_service_v2 import (
+    analyze_prompt_stream,
+    unpack_analysis,
     detect_user_intent,
     generate_todo_list,
     generate_project_description,
@@ -24,7 +25,11 @@ from app.ai_service_v2 import (
     generate_html_code,
     generate_css_code,
     generate_js_code,
-    generate_code_with_streaming,
+    generate_webpage_bundle,
+    generate_webpage_files_async,
+    prepare_project,
+    stream_page_files,
+    close_page_streams,
     estimate_tokens
 )
 from app.design_references import (
@@ -33,6 +38,7 @@ from app.design_references import (
     create_design_context
 )
 from app.ai_providers import get_provider
+from app.json_stream import json_dumps_text
 from app.file_handler import (
     create_project_directory,
     save_file,
@@ -46,65 +52,78 @@ async def stream_project_creation(prompt: str, project_name: str, provider_name:
     """Stream project creation with step-by-step updates - each task uses separate tokens."""
     project_id = None
     total_tokens_used = 0
+    page_streams = None
     
     try:
         # Get AI provider
         try:
             provider = get_provider(provider_name)
         except Exception as provider_error:
-            yield f"data: {json.dumps({'type': 'error', 'message': f'Failed to initialize {provider_name} provider: {str(provider_error)}'})}\n\n"
+            yield f"data: {json_dumps_text({'type': 'error', 'message': f'Failed to initialize {provider_name} provider: {str(provider_error)}'})}\n\n"
             return
         
-        # Step 0: Detect user intent - separate token call
-        yield f"data: {json.dumps({'type': 'thinking', 'message': 'Understanding your request...'})}\n\n"
+        # Steps 0-2: Detect intent and plan the project in one streamed token call -
+        # the description and each todo item are sent as soon as they are parsed
+        yield f"data: {json_dumps_text({'type': 'thinking', 'message': 'Understanding your request...'})}\n\n"
         
-        intent_result = detect_user_intent(prompt, provider)
+        analysis = None
+        todo_list = []
+        async for event, value in analyze_prompt_stream(prompt, provider):
+            if event == "description":
+                # Step 1: Project description
+                yield f"data: {json_dumps_text({'type': 'thinking', 'message': 'Generating project description...'})}\n\n"
+                yield f"data: {json_dumps_text({'type': 'description', 'description': value})}\n\n"
+                
+                # Step 2: Todo list
+                yield f"data: {json_dumps_text({'type': 'thinking', 'message': 'Creating detailed plan...'})}\n\n"
+            elif event == "todo":
+                todo_item = {
+                    "id": value.get("id", len(todo_list) + 1),
+                    "task": value.get("task", ""),
+                    "completed": False
+                }
+                todo_list.append(todo_item)
+                
+                # Stream each todo item with typing animation
+                task_text = todo_item["task"]
+                for i in range(len(task_text) + 1):
+                    partial_task = task_text[:i]
+                    yield f"data: {json_dumps_text({'type': 'todo_typing', 'todo_id': todo_item['id'], 'partial_task': partial_task})}\n\n"
+                    await asyncio.sleep(0.03)  # Natural typing speed
+                
+                # Send complete todo item
+                yield f"data: {json_dumps_text({'type': 'todo_item', 'todo': todo_item})}\n\n"
+            else:
+                analysis = value
+        
+        intent_result, description, _, project_requirements = unpack_analysis(analysis)
         usage = intent_result.get("usage", {})
         total_tokens_used += usage.get("total_tokens", estimate_tokens(prompt))
         
         # If user doesn't want to create a webpage, return conversation/ideas response
         if intent_result.get("intent") != "create_webpage":
-            yield f"data: {json.dumps({'type': 'conversation', 'message': intent_result.get('response', 'How can I help you?'), 'intent': intent_result.get('intent')})}\n\n"
+            yield f"data: {json_dumps_text({'type': 'conversation', 'message': intent_result.get('response', 'How can I help you?'), 'intent': intent_result.get('intent')})}\n\n"
             return
         
-        # Step 1: Generate project description - separate token call
-        yield f"data: {json.dumps({'type': 'thinking', 'message': 'Generating project description...'})}\n\n"
-        
-        description = generate_project_description(prompt, provider)
-        total_tokens_used += estimate_tokens(prompt + description)
-        
-        yield f"data: {json.dumps({'type': 'description', 'description': description})}\n\n"
-        
-        # Step 2: Generate todo list - separate token call
-        yield f"data: {json.dumps({'type': 'thinking', 'message': 'Creating detailed plan...'})}\n\n"
+        # Add design reference if detected
+        design_type = detect_design_type_from_prompt(prompt)
+        if design_type:
+            design_ref = get_design_reference(design_type)
+            if design_ref:
+                project_requirements["design_reference"] = design_type
+                project_requirements["design_description"] = design_ref.get("description", "")
+                project_requirements["design_colors"] = design_ref.get("color_scheme", [])
         
-        todo_list_data = generate_todo_list(prompt, provider)
-        total_tokens_used += estimate_tokens(prompt + str(todo_list_data))
+        # Start generating HTML now - it streams into a buffer while the plan is
+        # finished and the project is set up below
+        # (CSS and JS follow on their own once the start of the HTML exists)
+        page_streams = stream_page_files(prompt, project_requirements, provider)
+        html_lines = page_streams["html"]
         
-        # Stream todo list items one by one with typing effect
-        todo_list = []
-        for idx, item in enumerate(todo_list_data, 1):
-            todo_item = {
-                "id": item.get("id", idx),
-                "task": item.get("task", ""),
-                "completed": False
-            }
-            todo_list.append(todo_item)
-            
-            # Stream each todo item with typing animation
-            task_text = todo_item["task"]
-            for i in range(len(task_text) + 1):
-                partial_task = task_text[:i]
-                yield f"data: {json.dumps({'type': 'todo_typing', 'todo_id': todo_item['id'], 'partial_task': partial_task})}\n\n"
-                await asyncio.sleep(0.03)  # Natural typing speed
-            
-            # Send complete todo item
-            yield f"data: {json.dumps({'type': 'todo_item', 'todo': todo_item})}\n\n"
-        
-        yield f"data: {json.dumps({'type': 'todo_complete'})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'todo_complete'})}\n\n"
         
         # Step 3: Create project in database
-        yield f"data: {json.dumps({'type': 'thinking', 'message': 'Setting up project structure...'})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'thinking', 'message': 'Setting up project structure...'})}\n\n"
         
         project = Project(
             user_id=None,
@@ -119,7 +138,7 @@ async def stream_project_creation(prompt: str, project_name: str, provider_name:
         # Ensure project is fully committed before proceeding
         await asyncio.sleep(0.3)
         
-        yield f"data: {json.dumps({'type': 'project_created', 'project_id': project_id})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'project_created', 'project_id': project_id})}\n\n"
         
         # Create project directory
         create_project_directory(project_id)
@@ -130,36 +149,25 @@ async def stream_project_creation(prompt: str, project_name: str, provider_name:
         # Mark "Project structure setup" task as complete
         if todo_list:
             todo_list[0]["completed"] = True
-            yield f"data: {json.dumps({'type': 'task_complete', 'task_id': todo_list[0]['id'], 'completed_count': 1, 'total_tasks': len(todo_list)})}\n\n"
+            yield f"data: {json_dumps_text({'type': 'task_complete', 'task_id': todo_list[0]['id'], 'completed_count': 1, 'total_tasks': len(todo_list)})}\n\n"
         
-        # Step 4: Extract project requirements - separate token call
-        yield f"data: {json.dumps({'type': 'thinking', 'message': 'Analyzing design requirements deeply...'})}\n\n"
+        # Step 4: Project requirements
+        yield f"data: {json_dumps_text({'type': 'thinking', 'message': 'Analyzing design requirements deeply...'})}\n\n"
         await asyncio.sleep(5)  # Deep analysis time
         
-        project_requirements = extract_project_requirements(prompt, provider)
-        total_tokens_used += estimate_tokens(prompt)
-        
-        # Add design reference if detected
-        design_type = detect_design_type_from_prompt(prompt)
-        if design_type:
-            design_ref = get_design_reference(design_type)
-            if design_ref:
-                project_requirements["design_reference"] = design_type
-                project_requirements["design_description"] = design_ref.get("description", "")
-                project_requirements["design_colors"] = design_ref.get("color_scheme", [])
-        
         # Step 5: Generate HTML code - separate token call with streaming
-        yield f"data: {json.dumps({'type': 'task_start', 'task_id': 2, 'task': 'Creating HTML structure'})}\n\n"
-        yield f"data: {json.dumps({'type': 'thinking', 'message': 'Deeply analyzing requirements and generating beautiful HTML structure...'})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'task_start', 'task_id': 2, 'task': 'Creating HTML structure'})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'thinking', 'message': 'Deeply analyzing requirements and generating beautiful HTML structure...'})}\n\n"
         await asyncio.sleep(8)  # Deep analysis time for better UI
         
         # Send code_start BEFORE starting generation so CodeView is ready
-        yield f"data: {json.dumps({'type': 'code_start', 'file': 'index.html'})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'code_start', 'file': 'index.html'})}\n\n"
         await asyncio.sleep(0.3)  # Small delay to ensure frontend is ready
-        html_code = ""
-        async for line in generate_code_with_streaming(prompt, project_requirements, "", provider, "html"):
-            html_code += line
-            yield f"data: {json.dumps({'type': 'code_line', 'file': 'index.html', 'line': line})}\n\n"
+        html_parts = []
+        async for chunk in html_lines:
+            html_parts.append(chunk)
+            yield f"data: {json_dumps_text({'type': 'code_line', 'file': 'index.html', 'line': chunk})}\n\n"
+        html_code = "".join(html_parts)
         
         # Calculate tokens and update
         html_tokens = estimate_tokens(prompt + html_code)
@@ -169,14 +177,17 @@ async def stream_project_creation(prompt: str, project_name: str, provider_name:
             token_info = get_remaining_tokens()
             token_limit = token_info.get("limit", 30000)
             remaining_tokens = token_limit - total_tokens_used if token_limit else None
-            yield f"data: {json.dumps({'type': 'tokens_update', 'remaining_tokens': remaining_tokens, 'token_limit': token_limit})}\n\n"
+            yield f"data: {json_dumps_text({'type': 'tokens_update', 'remaining_tokens': remaining_tokens, 'token_limit': token_limit})}\n\n"
         except:
             pass
         
         save_file(project_id, "index.html", html_code)
         
         # Send code_complete with full content to ensure frontend has it
-        yield f"data: {json.dumps({'type': 'code_complete', 'file': 'index.html', 'content': html_code, 'file_size': len(html_code)})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'code_complete', 'file': 'index.html', 'content': html_code, 'file_size': len(html_code)})}\n\n"
+        
+        css_lines = page_streams["css"]
+        js_lines = page_streams["js"]
         
         # Wait longer to ensure frontend has processed all code lines and displayed them
         # Calculate wait time based on code size (more code = more time to render)
@@ -186,21 +197,22 @@ async def stream_project_creation(prompt: str, project_name: str, provider_name:
         # Only mark task complete after code is fully generated, sent, and rendered
         if len(todo_list) > 1:
             todo_list[1]["completed"] = True
-            yield f"data: {json.dumps({'type': 'task_complete', 'task_id': todo_list[1]['id'], 'completed_count': 2, 'total_tasks': len(todo_list)})}\n\n"
+            yield f"data: {json_dumps_text({'type': 'task_complete', 'task_id': todo_list[1]['id'], 'completed_count': 2, 'total_tasks': len(todo_list)})}\n\n"
         await asyncio.sleep(2)  # Delay before next task
         
         # Step 6: Generate CSS code - separate token call with streaming
-        yield f"data: {json.dumps({'type': 'task_start', 'task_id': 3, 'task': 'Designing CSS styling'})}\n\n"
-        yield f"data: {json.dumps({'type': 'thinking', 'message': 'Creating beautiful, responsive CSS with animations and modern design...'})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'task_start', 'task_id': 3, 'task': 'Designing CSS styling'})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'thinking', 'message': 'Creating beautiful, responsive CSS with animations and modern design...'})}\n\n"
         await asyncio.sleep(8)  # Deep analysis time for better UI
         
         # Send code_start BEFORE starting generation so CodeView is ready
-        yield f"data: {json.dumps({'type': 'code_start', 'file': 'style.css'})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'code_start', 'file': 'style.css'})}\n\n"
         await asyncio.sleep(0.3)  # Small delay to ensure frontend is ready
-        css_code = ""
-        async for line in generate_code_with_streaming(prompt, project_requirements, html_code, provider, "css"):
-            css_code += line
-            yield f"data: {json.dumps({'type': 'code_line', 'file': 'style.css', 'line': line})}\n\n"
+        css_parts = []
+        async for chunk in css_lines:
+            css_parts.append(chunk)
+            yield f"data: {json_dumps_text({'type': 'code_line', 'file': 'style.css', 'line': chunk})}\n\n"
+        css_code = "".join(css_parts)
         
         # Calculate tokens and update
         css_tokens = estimate_tokens(prompt + css_code)
@@ -210,14 +222,14 @@ async def stream_project_creation(prompt: str, project_name: str, provider_name:
             token_info = get_remaining_tokens()
             token_limit = token_info.get("limit", 30000)
             remaining_tokens = token_limit - total_tokens_used if token_limit else None
-            yield f"data: {json.dumps({'type': 'tokens_update', 'remaining_tokens': remaining_tokens, 'token_limit': token_limit})}\n\n"
+            yield f"data: {json_dumps_text({'type': 'tokens_update', 'remaining_tokens': remaining_tokens, 'token_limit': token_limit})}\n\n"
         except:
             pass
         
         save_file(project_id, "style.css", css_code)
         
         # Send code_complete with full content to ensure frontend has it
-        yield f"data: {json.dumps({'type': 'code_complete', 'file': 'style.css', 'content': css_code, 'file_size': len(css_code)})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'code_complete', 'file': 'style.css', 'content': css_code, 'file_size': len(css_code)})}\n\n"
         
         # Wait longer to ensure frontend has processed all code lines and displayed them
         wait_time = min(2 + (len(css_code) / 1000), 5)  # 2-5 seconds based on code size
@@ -226,21 +238,22 @@ async def stream_project_creation(prompt: str, project_name: str, provider_name:
         # Only mark task complete after code is fully generated, sent, and rendered
         if len(todo_list) > 2:
             todo_list[2]["completed"] = True
-            yield f"data: {json.dumps({'type': 'task_complete', 'task_id': todo_list[2]['id'], 'completed_count': 3, 'total_tasks': len(todo_list)})}\n\n"
+            yield f"data: {json_dumps_text({'type': 'task_complete', 'task_id': todo_list[2]['id'], 'completed_count': 3, 'total_tasks': len(todo_list)})}\n\n"
         await asyncio.sleep(2)  # Delay before next task
         
         # Step 7: Generate JavaScript code - separate token call with streaming
-        yield f"data: {json.dumps({'type': 'task_start', 'task_id': 4, 'task': 'Adding JavaScript functionality'})}\n\n"
-        yield f"data: {json.dumps({'type': 'thinking', 'message': 'Implementing interactive JavaScript features...'})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'task_start', 'task_id': 4, 'task': 'Adding JavaScript functionality'})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'thinking', 'message': 'Implementing interactive JavaScript features...'})}\n\n"
         await asyncio.sleep(8)  # Deep analysis time for better UI
         
         # Send code_start BEFORE starting generation so CodeView is ready
-        yield f"data: {json.dumps({'type': 'code_start', 'file': 'script.js'})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'code_start', 'file': 'script.js'})}\n\n"
         await asyncio.sleep(0.3)  # Small delay to ensure frontend is ready
-        js_code = ""
-        async for line in generate_code_with_streaming(prompt, project_requirements, html_code, provider, "js"):
-            js_code += line
-            yield f"data: {json.dumps({'type': 'code_line', 'file': 'script.js', 'line': line})}\n\n"
+        js_parts = []
+        async for chunk in js_lines:
+            js_parts.append(chunk)
+            yield f"data: {json_dumps_text({'type': 'code_line', 'file': 'script.js', 'line': chunk})}\n\n"
+        js_code = "".join(js_parts)
         
         # Calculate tokens and update
         js_tokens = estimate_tokens(prompt + js_code)
@@ -250,14 +263,14 @@ async def stream_project_creation(prompt: str, project_name: str, provider_name:
             token_info = get_remaining_tokens()
             token_limit = token_info.get("limit", 30000)
             remaining_tokens = token_limit - total_tokens_used if token_limit else None
-            yield f"data: {json.dumps({'type': 'tokens_update', 'remaining_tokens': remaining_tokens, 'token_limit': token_limit})}\n\n"
+            yield f"data: {json_dumps_text({'type': 'tokens_update', 'remaining_tokens': remaining_tokens, 'token_limit': token_limit})}\n\n"
         except:
             pass
         
         save_file(project_id, "script.js", js_code)
         
         # Send code_complete with full content to ensure frontend has it
-        yield f"data: {json.dumps({'type': 'code_complete', 'file': 'script.js', 'content': js_code, 'file_size': len(js_code)})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'code_complete', 'file': 'script.js', 'content': js_code, 'file_size': len(js_code)})}\n\n"
         
         # Wait longer to ensure frontend has processed all code lines and displayed them
         wait_time = min(2 + (len(js_code) / 1000), 5)  # 2-5 seconds based on code size
@@ -266,14 +279,14 @@ async def stream_project_creation(prompt: str, project_name: str, provider_name:
         # Only mark task complete after code is fully generated, sent, and rendered
         if len(todo_list) > 3:
             todo_list[3]["completed"] = True
-            yield f"data: {json.dumps({'type': 'task_complete', 'task_id': todo_list[3]['id'], 'completed_count': 4, 'total_tasks': len(todo_list)})}\n\n"
+            yield f"data: {json_dumps_text({'type': 'task_complete', 'task_id': todo_list[3]['id'], 'completed_count': 4, 'total_tasks': len(todo_list)})}\n\n"
         
         # Mark remaining tasks as complete
         for idx in range(4, len(todo_list)):
             todo_list[idx]["completed"] = True
-            yield f"data: {json.dumps({'type': 'task_complete', 'task_id': todo_list[idx]['id'], 'completed_count': idx + 1, 'total_tasks': len(todo_list)})}\n\n"
+            yield f"data: {json_dumps_text({'type': 'task_complete', 'task_id': todo_list[idx]['id'], 'completed_count': idx + 1, 'total_tasks': len(todo_list)})}\n\n"
         
-        yield f"data: {json.dumps({'type': 'code_generated', 'message': 'All code files generated and saved successfully'})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'code_generated', 'message': 'All code files generated and saved successfully'})}\n\n"
         
         # Step 8: Calculate token info
         try:
@@ -286,15 +299,19 @@ async def stream_project_creation(prompt: str, project_name: str, provider_name:
             remaining_tokens = token_limit - total_tokens_used
         
         # Final response
-        yield f"data: {json.dumps({'type': 'complete', 'project_id': project_id, 'todo_list': todo_list, 'description': description, 'tokens_used': total_tokens_used, 'token_limit': token_limit, 'remaining_tokens': remaining_tokens})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'complete', 'project_id': project_id, 'todo_list': todo_list, 'description': description, 'tokens_used': total_tokens_used, 'token_limit': token_limit, 'remaining_tokens': remaining_tokens})}\n\n"
         
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
         print(f"Error in stream: {error_details}")
-        yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+        yield f"data: {json_dumps_text({'type': 'error', 'message': str(e)})}\n\n"
         if project_id:
             db.rollback()
+    finally:
+        # Stop background code generation left running by an error or a client disconnect
+        if page_streams is not None:
+            await close_page_streams(page_streams)
 
 
 @router.post("/create-project-stream")
@@ -339,15 +356,18 @@ async def create_project_with_ai(
     No authentication required.
     """
     try:
-        # Generate todo list first
-        todo_list_data = generate_todo_list(project_data.prompt)
+        provider = get_provider(project_data.provider or "ollama")
+        
+        # Description, todo list and requirements come from one combined token call
+        _, description, todo_list_data, project_requirements = await prepare_project(project_data.prompt, provider)
         todo_list = [
             TodoItem(id=item.get("id", idx), task=item.get("task", ""), completed=False)
             for idx, item in enumerate(todo_list_data, 1)
         ]
-        
-        # Generate project description
-        description = generate_project_description(project_data.prompt)
+        if project_data.design_reference:
+            project_requirements["design_reference"] = project_data.design_reference
+        if project_data.design_examples:
+            project_requirements["design_examples"] = project_data.design_examples
         
         # Create project in database (no user required)
         project_name = project_data.name or project_data.prompt[:50]
@@ -363,8 +383,12 @@ async def create_project_with_ai(
         # Create project directory
         create_project_directory(project.id)
         
-        # Generate all code files
-        code_files = generate_code_from_prompt(project_data.prompt, todo_list_data)
+        # Generate all code files in one token call, falling back to per-file calls
+        try:
+            code_files = await asyncio.to_thread(generate_webpage_bundle, project_data.prompt, project_requirements, provider)
+        except Exception as e:
+            print(f"Warning: bundle generation failed, generating files separately: {e}")
+            code_files = await generate_webpage_files_async(project_data.prompt, project_requirements, provider)
         
         # Save files
         save_file(project.id, "index.html", code_files["html"])
@@ -380,6 +404,7 @@ async def create_project_with_ai(
         # Estimate token usage
         total_text = project_data.prompt + description + code_files["html"] + code_files["css"] + code_files["js"]
         estimated_tokens = estimate_tokens(total_text)
+        from app.ai_service import get_remaining_tokens
         token_info = get_remaining_tokens()
         remaining = token_info["limit"] - estimated_tokens if token_info["limit"] else None
         
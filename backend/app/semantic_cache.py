@@ -0,0 +1,107 @@
+"""
+Semantic Cache - reuses LLM results for identical or near-duplicate prompts
+"""
+
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+_WORD_RE = re.compile(r"[a-z0-9#]+")
+
+# Words that carry no meaning for "what page does the user want"
+STOP_WORDS = frozenset({
+    "a", "an", "the", "me", "my", "i", "we", "us", "you", "please", "can", "could",
+    "would", "will", "to", "for", "of", "and", "with", "that", "this", "it", "is",
+    "some", "just", "want", "need", "like", "make", "build", "create", "generate",
+    "design", "give", "let", "lets", "new", "simple"
+})
+
+
+def normalize_prompt(text: str) -> str:
+    """Lowercase and collapse whitespace so trivially different prompts share a key."""
+    return " ".join(text.lower().split())
+
+
+def term_vector(text: str) -> Dict[str, float]:
+    """Build an L2-normalized bag-of-words vector for cosine similarity."""
+    words = [w for w in _WORD_RE.findall(text.lower()) if w not in STOP_WORDS]
+    counts = Counter(words)
+    norm = math.sqrt(sum(c * c for c in counts.values()))
+    if not norm:
+        return {}
+    return {w: c / norm for w, c in counts.items()}
+
+
+def cosine_similarity(a: Dict[str, float], b: Dict[str, float]) -> float:
+    """Cosine similarity of two normalized sparse vectors."""
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+
+class SemanticCache:
+    """Two-tier in-memory cache: exact match on the normalized prompt, then the
+    most similar stored prompt if its cosine similarity is above the threshold.
+    A threshold of 1.0 makes it a plain exact-match LRU cache. Entries in different
+    namespaces (e.g. one per provider and model) never match each other.
+    """
+
+    def __init__(self, threshold: float = 0.9, max_entries: int = 512, ttl: Optional[float] = 3600,
+                 embed: Callable[[str], Dict[str, float]] = term_vector):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.embed = embed
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[Dict[str, float], Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl is not None and time.monotonic() - created_at > self.ttl
+
+    def get(self, text: str, namespace: str = "") -> Optional[Any]:
+        """Return the cached value for text or a near-duplicate of it, else None."""
+        key = (namespace, normalize_prompt(text))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[2]):
+                    self._entries.move_to_end(key)
+                    return entry[1]
+                del self._entries[key]
+
+        if self.threshold >= 1.0:
+            return None
+
+        vector = self.embed(text)
+        if not vector:
+            return None
+
+        best_key, best_score = None, self.threshold
+        with self._lock:
+            for other_key, (other_vector, _, created_at) in self._entries.items():
+                if other_key[0] != namespace or self._expired(created_at):
+                    continue
+                score = cosine_similarity(vector, other_vector)
+                if score >= best_score:
+                    best_key, best_score = other_key, score
+            if best_key is None:
+                return None
+            self._entries.move_to_end(best_key)
+            return self._entries[best_key][1]
+
+    def set(self, text: str, value: Any, namespace: str = "") -> None:
+        """Store value for text, evicting the least recently used entry when full."""
+        key = (namespace, normalize_prompt(text))
+        vector = self.embed(text) if self.threshold < 1.0 else {}
+        with self._lock:
+            self._entries[key] = (vector, value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,40 @@
+"""
+Scripted AI provider for tests - no network access
+"""
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.ai_providers import AIProvider
+
+
+class FakeProvider(AIProvider):
+    """Answers each call with the next scripted reply.
+    
+    A reply is a str (the whole completion, streamed as one delta per line), a
+    list of deltas, or an exception to raise. An exception inside a list is
+    raised after the deltas before it have been streamed.
+    """
+    
+    def __init__(self, *replies: Any):
+        self.replies = list(replies)
+        self.calls: List[Dict[str, Any]] = []
+        self.default_model = "fake-model"
+    
+    def _next(self, kwargs: Dict[str, Any]) -> Any:
+        self.calls.append(kwargs)
+        reply = self.replies.pop(0) if len(self.replies) > 1 else self.replies[0]
+        if isinstance(reply, BaseException):
+            raise reply
+        return reply
+    
+    def chat_completion(self, messages: List[Dict], model: str = None, temperature: float = 0.7, max_tokens: int = 4000, response_format: Optional[Dict] = None) -> Dict[str, Any]:
+        reply = self._next({"messages": messages, "max_tokens": max_tokens, "response_format": response_format, "stream": False})
+        content = "".join(reply) if isinstance(reply, list) else reply
+        return {"content": content, "usage": {"total_tokens": 10}}
+    
+    def stream_chat_completion(self, messages: List[Dict], model: str = None, temperature: float = 0.7, max_tokens: int = 4000, response_format: Optional[Dict] = None) -> Iterator[str]:
+        reply = self._next({"messages": messages, "max_tokens": max_tokens, "response_format": response_format, "stream": True})
+        deltas = reply if isinstance(reply, list) else reply.splitlines(keepends=True)
+        for delta in deltas:
+            if isinstance(delta, BaseException):
+                raise delta
+            yield delta
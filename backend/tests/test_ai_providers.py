@@ -0,0 +1,110 @@
+"""
+Tests for provider rate limiting and retries
+"""
+import asyncio
+
+import pytest
+
+from app import ai_providers
+from app.ai_providers import RateLimiter, TransientProviderError
+from tests.fakes import FakeProvider
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ai_providers.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(ai_providers, "retry_delay", lambda attempt: 0)
+
+
+def test_request_bucket_waits_once_empty_and_refills(clock):
+    limiter = RateLimiter(requests_per_minute=60)
+    assert [limiter.reserve(0) for _ in range(60)] == [0.0] * 60
+    assert limiter.reserve(0) == pytest.approx(1.0)
+    assert limiter.reserve(0) == pytest.approx(2.0)
+
+    clock[0] += 3
+    assert limiter.reserve(0) == 0.0
+
+
+def test_token_bucket_waits_for_tokens_and_caps_large_requests(clock):
+    limiter = RateLimiter(tokens_per_minute=600)
+    assert limiter.reserve(600) == 0.0
+    assert limiter.reserve(300) == pytest.approx(30.0)
+
+    clock[0] += 90
+    # Larger than the whole bucket: waits for a full bucket, not forever
+    assert limiter.reserve(10_000) == pytest.approx(0.0)
+    assert limiter.reserve(10_000) == pytest.approx(60.0)
+
+
+def test_settle_returns_unused_tokens(clock):
+    limiter = RateLimiter(tokens_per_minute=600)
+    limiter.reserve(600)
+    limiter.settle(600, 300)
+    assert limiter.reserve(300) == 0.0
+    assert limiter.reserve(60) == pytest.approx(6.0)
+
+
+def test_block_holds_every_request(clock):
+    limiter = RateLimiter()
+    assert limiter.reserve(100) == 0.0
+    limiter.block(5)
+    assert limiter.reserve(100) == pytest.approx(5.0)
+    clock[0] += 2
+    assert limiter.reserve(100) == pytest.approx(3.0)
+    clock[0] += 3
+    assert limiter.reserve(100) == 0.0
+
+
+def _stream(provider, received):
+    async def collect():
+        async for delta in provider.astream_chat_completion(MESSAGES, max_tokens=100):
+            received.append(delta)
+
+    asyncio.run(collect())
+
+
+def test_stream_retries_transient_errors_before_first_delta():
+    provider = FakeProvider(TransientProviderError("busy"), TransientProviderError("busy"), "hello\nworld\n")
+    received = []
+    _stream(provider, received)
+    assert "".join(received) == "hello\nworld\n"
+    assert len(provider.calls) == 3
+
+
+def test_stream_does_not_retry_after_a_delta():
+    provider = FakeProvider(["partial", TransientProviderError("dropped")], "full answer")
+    received = []
+    with pytest.raises(TransientProviderError):
+        _stream(provider, received)
+    assert received == ["partial"]
+    assert len(provider.calls) == 1
+
+
+def test_stream_does_not_retry_other_errors():
+    provider = FakeProvider(ValueError("bad request"), "never sent")
+    with pytest.raises(ValueError):
+        _stream(provider, [])
+    assert len(provider.calls) == 1
+
+
+def test_stream_gives_up_after_max_retries(monkeypatch):
+    monkeypatch.setattr(ai_providers, "AI_MAX_RETRIES", 2)
+    provider = FakeProvider(TransientProviderError("busy"))
+    with pytest.raises(TransientProviderError):
+        _stream(provider, [])
+    assert len(provider.calls) == 3
+
+
+def test_chat_completion_with_retry_retries_transient_errors():
+    provider = FakeProvider(TransientProviderError("busy"), "done")
+    assert provider.chat_completion_with_retry(MESSAGES)["content"] == "done"
+    assert len(provider.calls) == 2
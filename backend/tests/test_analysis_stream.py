@@ -0,0 +1,66 @@
+"""
+Tests for the streamed prompt analysis
+"""
+import asyncio
+
+import pytest
+
+from app import ai_service_v2
+from app.ai_service_v2 import analyze_prompt_stream
+from tests.fakes import FakeProvider
+
+ANALYSIS = """```json
+{"intent": "create_webpage", "confidence": 0.9, "response": "", "description": "A todo app.",
+ "todos": [{"id": 1, "task": "Set up project structure"}, {"id": 2, "task": "Create HTML structure"}],
+ "project_type": "todo list", "theme": "dark", "colors": [], "js_functions": ["addTask"]}
+```"""
+
+
+@pytest.fixture(autouse=True)
+def empty_analysis_cache():
+    ai_service_v2._analysis_cache.clear()
+    yield
+    ai_service_v2._analysis_cache.clear()
+
+
+def _events(provider: FakeProvider, prompt: str = "todo app, dark theme"):
+    async def collect():
+        return [event async for event in analyze_prompt_stream(prompt, provider)]
+    return asyncio.run(collect())
+
+
+def test_streamed_analysis_omits_json_mode_when_unsupported():
+    provider = FakeProvider([ANALYSIS[i:i + 16] for i in range(0, len(ANALYSIS), 16)])
+    provider.supports_json_streaming = False
+    events = _events(provider)
+    
+    assert provider.calls[0]["stream"] is True
+    assert provider.calls[0]["response_format"] is None
+    assert [name for name, _ in events] == ["description", "todo", "todo", "analysis"]
+    analysis = events[-1][1]
+    assert analysis["project_type"] == "todo list"
+    assert analysis["js_functions"] == ["addTask"]
+
+
+def test_streamed_analysis_keeps_json_mode_when_supported():
+    provider = FakeProvider(ANALYSIS)
+    _events(provider)
+    assert provider.calls[0]["response_format"] is not None
+
+
+def test_conversation_sends_no_page_events():
+    provider = FakeProvider('{"intent": "conversation", "confidence": 0.9, "response": "Hi there!", "description": "", "todos": []}')
+    events = _events(provider, prompt="hello")
+    assert [name for name, _ in events] == ["analysis"]
+    assert events[0][1]["intent"] == "conversation"
+
+
+def test_cached_analysis_is_not_shared_between_models():
+    first = FakeProvider(ANALYSIS)
+    second = FakeProvider(ANALYSIS.replace("todo list", "portfolio"))
+    second.default_model = "other-model"
+    
+    assert _events(first)[-1][1]["project_type"] == "todo list"
+    assert _events(second)[-1][1]["project_type"] == "portfolio"
+    assert _events(first)[-1][1]["project_type"] == "todo list"
+    assert len(first.calls) == 1 and len(second.calls) == 1
@@ -0,0 +1,150 @@
+"""
+Tests for generated file validation and fallbacks
+"""
+import asyncio
+import json
+
+import pytest
+
+from app import ai_service_v2
+from app.ai_service_v2 import (
+    _FALLBACK_CSS, _STATIC_PAGE_JS, _static_page_js, _usable_code, generate_code_with_streaming,
+    generate_css_code, generate_webpage_bundle
+)
+from tests.fakes import FakeProvider
+
+REQUIREMENTS = {"project_type": "shop", "theme": "modern", "colors": [], "js_functions": ["addToCart"]}
+HTML = "<!DOCTYPE html>\n<html><head></head><body><form id=\"cart\"></form></body></html>\n"
+
+
+@pytest.fixture(autouse=True)
+def empty_code_cache():
+    ai_service_v2._code_cache.clear()
+    yield
+    ai_service_v2._code_cache.clear()
+
+
+def _stream(code_type: str, provider: FakeProvider, html_code: str = HTML, requirements: dict = REQUIREMENTS) -> str:
+    async def collect():
+        return "".join([line async for line in generate_code_with_streaming("shop page", requirements, html_code, provider, code_type)])
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize("code_type, code, usable", [
+    ("js", "Sorry (I cannot help with that request, really.)", False),
+    ("js", "const cart = [];\nfunction addToCart(item) { cart.push(item); }", True),
+    ("js", _STATIC_PAGE_JS, True),
+    ("css", "I can't {do} that, sorry about it, my friend!", False),
+    ("css", "body {\n  color: #333;\n  margin: 0;\n}", True),
+    ("css", _FALLBACK_CSS, True),
+    ("html", "Sorry, I can't < do that for you right now.", False),
+    ("html", HTML, True),
+    ("html", "<p>", False),
+])
+def test_usable_code(code_type, code, usable):
+    assert _usable_code(code_type, code) is usable
+
+
+def test_streamed_junk_is_replaced_by_the_fallback_only():
+    provider = FakeProvider("Sorry (I cannot write that script.)\nMaybe try again later.\n")
+    assert _stream("js", provider) == _STATIC_PAGE_JS
+
+
+def test_streamed_empty_css_is_replaced_and_not_cached():
+    provider = FakeProvider("```css\n```")
+    assert _stream("css", provider) == _FALLBACK_CSS
+    assert _stream("css", provider) == _FALLBACK_CSS
+    assert len(provider.calls) == 2
+
+
+def test_streamed_code_is_sent_whole_and_cached():
+    css = "body {\n  color: #333;\n}\n.cart {\n  display: grid;\n}\n"
+    provider = FakeProvider("```css\n" + css + "```\n")
+    assert _stream("css", provider) == css
+    assert _stream("css", provider) == css
+    assert len(provider.calls) == 1
+
+
+def test_unusable_streamed_html_raises():
+    with pytest.raises(Exception, match="no usable code"):
+        _stream("html", FakeProvider("I'm sorry, I can't help with that."), html_code="")
+
+
+LANDING = {"project_type": "Landing Page", "theme": "modern", "colors": [], "js_functions": []}
+NAV_PAGE = """<!DOCTYPE html>
+<html><head></head><body>
+<nav><button class="menu-toggle" aria-label="Menu"></button><ul class="nav-menu"></ul></nav>
+<section id="about"><a href="#contact">Contact</a></section>
+</body></html>
+"""
+
+
+@pytest.mark.parametrize("markup", [
+    '<form action="/subscribe"></form>',
+    '<input type="email">',
+    '<SELECT name="plan"></SELECT>',
+    "<textarea></textarea>",
+    "<dialog open></dialog>",
+    '<div data-tab="pricing"></div>',
+    '<a href="#" onclick="buy()">Buy</a>',
+    '<button class="cta">Sign up</button>',
+])
+def test_interactive_markup_needs_generated_js(markup):
+    assert _static_page_js(LANDING, NAV_PAGE) == _STATIC_PAGE_JS
+    assert _static_page_js(LANDING, NAV_PAGE.replace("</section>", markup + "</section>")) is None
+
+
+@pytest.mark.parametrize("requirements", [
+    REQUIREMENTS,
+    {**LANDING, "js_functions": ["toggleTheme"]},
+    {**LANDING, "project_type": "dashboard"},
+])
+def test_only_static_page_types_without_functions_use_the_canned_script(requirements):
+    assert _static_page_js(requirements, NAV_PAGE) is None
+
+
+def test_static_page_js_skips_the_model():
+    provider = FakeProvider("never sent")
+    assert _stream("js", provider, html_code=NAV_PAGE, requirements=LANDING) == _STATIC_PAGE_JS
+    assert provider.calls == []
+
+
+def _bundle(**files) -> FakeProvider:
+    return FakeProvider(json.dumps(files))
+
+
+def test_bundle_files_are_validated_and_cached_for_the_same_prompt():
+    css = "body {\n  color: #333;\n}\n.cart {\n  display: grid;\n}"
+    js = "const cart = [];\nfunction addToCart(item) { cart.push(item); }"
+    provider = _bundle(html=HTML, css="```css\n" + css + "\n```", js=js)
+    files = generate_webpage_bundle("shop page", REQUIREMENTS, provider)
+
+    assert 'name="viewport"' in files["html"]
+    assert files["css"] == css
+    assert files["js"] == js
+    assert len(provider.calls) == 1
+    assert provider.calls[0]["response_format"] == {"type": "json_object"}
+
+    assert generate_css_code("shop page", REQUIREMENTS, files["html"], provider) == css
+    assert len(provider.calls) == 1
+
+
+def test_bundle_replaces_unusable_css_and_js_without_caching_them():
+    provider = _bundle(html=HTML, css="Sorry, no styles.", js="")
+    files = generate_webpage_bundle("shop page", REQUIREMENTS, provider)
+    assert files["css"] == _FALLBACK_CSS
+    assert files["js"] == _STATIC_PAGE_JS
+
+    css = "body {\n  color: #333;\n  margin: 0;\n}"
+    retry = FakeProvider(css)
+    assert generate_css_code("shop page", REQUIREMENTS, files["html"], retry) == css
+    assert len(retry.calls) == 1
+
+
+@pytest.mark.parametrize("files, error", [
+    ({"css": "body {}"}, "response has no HTML"),
+    ({"html": "I'm sorry, I can't help with that.", "css": "", "js": ""}, "no usable code"),
+])
+def test_bundle_without_usable_html_raises(files, error):
+    with pytest.raises(Exception, match=error):
+        generate_webpage_bundle("shop page", REQUIREMENTS, _bundle(**files))
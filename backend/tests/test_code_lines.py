@@ -0,0 +1,37 @@
+"""
+Tests for streamed code fence handling
+"""
+import asyncio
+
+import pytest
+
+from app.ai_service_v2 import _code_lines, _strip_code_fence
+
+
+def _stream(text: str, size: int) -> str:
+    async def deltas():
+        for i in range(0, len(text), size):
+            yield text[i:i + size]
+
+    async def collect():
+        return "".join([line async for line in _code_lines(deltas())])
+
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 1000])
+@pytest.mark.parametrize("text", [
+    "Here is the HTML:\n```html\n<html>\n\n<body></body>\n</html>\n```\nEnjoy!",
+    "Sure!\n\nBelow is the code.\n```\nbody { color: red; }\n```",
+    "```css\nbody { color: red; }\n```",
+    "\n\n```js\nconsole.log(1);\n\n\nfoo();\n```\n",
+    "<html>\n<body>\n</body>\n</html>",
+    "a\nb\nc\nd\ne\nf\ng\n",
+])
+def test_code_lines_match_strip_code_fence(text, size):
+    assert _stream(text, size) == _strip_code_fence(text) + "\n"
+
+
+def test_preamble_before_opening_fence_is_dropped():
+    text = "Here is the HTML:\n```html\n<html>\n</html>\n```"
+    assert _stream(text, 4) == "<html>\n</html>\n"
@@ -0,0 +1,80 @@
+"""
+Tests for partial JSON repair and the incremental parser
+"""
+import json
+
+import pytest
+
+from app.json_stream import IncrementalJsonParser, parse_partial_json
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"a": 1}', {"a": 1}),
+    ('```json\n{"a": 1}\n```', {"a": 1}),
+    ('{"a": 1}abc', {"a": 1}),
+    ("[1,2,]", [1, 2]),
+    ('{"a": [1, 2,],}', {"a": [1, 2]}),
+    ('{"a": "b" "c": 1}', {"a": "b", "c": 1}),
+    ('{"a": {"x": 1} "b": 2}', {"a": {"x": 1}, "b": 2}),
+    ('{"a": true "b": null}', {"a": True, "b": None}),
+    ("[1 2 3]", [1, 2, 3]),
+    ('{"a": .5}', {"a": 0.5}),
+    ('{"a": -.5, "b": 5., "c": +1}', {"a": -0.5, "b": 5.0, "c": 1}),
+    ('{"a": 1e5}', {"a": 100000.0}),
+    ("12abc", 12),
+    ("{enabled: True, 'name': 'it\\'s', other: None}", {"enabled": True, "name": "it's", "other": None}),
+    ('{"a": "line\nbreak"}', {"a": "line\nbreak"}),
+    ('{"todos": [{"id": 1}, {"id": 2, "task": "b', {"todos": [{"id": 1}, {"id": 2, "task": "b"}]}),
+    ('{"a": "x", "b":', {"a": "x", "b": None}),
+    ('{"a": "x", "b', {"a": "x"}),
+])
+def test_parse_partial_json_repairs(text, expected):
+    assert parse_partial_json(text) == expected
+
+
+@pytest.mark.parametrize("text", ["", "Sorry, I can't help with that."])
+def test_parse_partial_json_without_json_raises(text):
+    with pytest.raises(json.JSONDecodeError):
+        parse_partial_json(text)
+
+
+def _feed(chunks):
+    parser = IncrementalJsonParser()
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    events.extend(parser.close())
+    return parser, events
+
+
+@pytest.mark.parametrize("size", [1, 4, 1000])
+def test_incremental_parser_events_across_chunks(size):
+    text = 'Here:\n```json\n{"todos": [{"id": 1, "done": false}, {"id": 2, "task": "a \\"b\\""}], "n": -1.5e2}\n```'
+    parser, events = _feed([text[i:i + size] for i in range(0, len(text), size)])
+
+    assert events == [
+        (["todos", 0, "id"], 1),
+        (["todos", 0, "done"], False),
+        (["todos", 0], {"id": 1, "done": False}),
+        (["todos", 1, "id"], 2),
+        (["todos", 1, "task"], 'a "b"'),
+        (["todos", 1], {"id": 2, "task": 'a "b"'}),
+        (["todos"], [{"id": 1, "done": False}, {"id": 2, "task": 'a "b"'}]),
+        (["n"], -150.0),
+        ([], parser.result),
+    ]
+    assert parser.done
+    assert parser.result == json.loads(text[text.index("{"):text.rindex("}") + 1])
+
+
+def test_incremental_parser_close_flushes_trailing_number():
+    parser = IncrementalJsonParser()
+    assert parser.feed("[1, 2") == [([0], 1)]
+    assert parser.close() == [([1], 2)]
+    assert not parser.done
+
+
+def test_incremental_parser_ignores_text_after_root():
+    parser, events = _feed(['{"a": 1}', ' {"b": 2}'])
+    assert parser.result == {"a": 1}
+    assert events[-1] == ([], {"a": 1})
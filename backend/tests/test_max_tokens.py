@@ -0,0 +1,80 @@
+"""
+Tests for per-file output budgets
+"""
+import pytest
+
+from app import ai_service_v2
+from app.ai_service_v2 import (
+    _ADAPTIVE_MAX_TOKENS_FLOOR, _ADAPTIVE_MIN_SAMPLES, _CODE_MAX_TOKENS, _output_tokens,
+    _max_tokens, _record_output
+)
+
+OTHER = {"project_type": "dashboard"}
+
+
+@pytest.fixture(autouse=True)
+def empty_history():
+    for samples in _output_tokens.values():
+        samples.clear()
+    yield
+    for samples in _output_tokens.values():
+        samples.clear()
+
+
+@pytest.mark.parametrize("code_type, requirements, expected", [
+    ("html", {"project_type": "todo list"}, 4000),
+    ("css", {"project_type": "Landing Page"}, 10000),
+    ("js", {"project_type": "coffee shop"}, 4000),
+    ("html", OTHER, _CODE_MAX_TOKENS),
+    ("css", {}, _CODE_MAX_TOKENS),
+])
+def test_cold_start_uses_the_project_budget(code_type, requirements, expected):
+    assert _max_tokens(code_type, requirements) == expected
+
+
+@pytest.mark.parametrize("functions, expected", [
+    (0, _CODE_MAX_TOKENS),
+    (1, _ADAPTIVE_MAX_TOKENS_FLOOR),
+    (10, 1500 + 10 * 800),
+    (50, _CODE_MAX_TOKENS),
+])
+def test_js_budget_scales_with_functions(functions, expected):
+    requirements = {**OTHER, "js_functions": [f"fn{i}" for i in range(functions)]}
+    assert _max_tokens("js", requirements) == expected
+
+
+def test_budget_adapts_once_enough_samples_are_recorded():
+    samples = _output_tokens[("", "css")]
+    samples.extend([5000] * (_ADAPTIVE_MIN_SAMPLES - 1))
+    assert _max_tokens("css", OTHER) == _CODE_MAX_TOKENS
+
+    samples.append(5000)
+    assert _max_tokens("css", OTHER) == 6500
+    # Only the project type's own history counts
+    assert _max_tokens("css", {"project_type": "landing page"}) == 10000
+
+
+@pytest.mark.parametrize("size, expected", [
+    (100, _ADAPTIVE_MAX_TOKENS_FLOOR),
+    (50000, _CODE_MAX_TOKENS),
+])
+def test_adapted_budget_is_clamped(size, expected):
+    _output_tokens[("", "html")].extend([size] * _ADAPTIVE_MIN_SAMPLES)
+    assert _max_tokens("html", OTHER) == expected
+
+
+def test_adapted_budget_follows_recent_95th_percentile():
+    samples = _output_tokens[("", "html")]
+    samples.extend([9000] * 5 + [2000] * 95)
+    assert _max_tokens("html", OTHER) == 11700
+    # The oldest samples age out
+    samples.extend([2000] * 5)
+    assert _max_tokens("html", OTHER) == _ADAPTIVE_MAX_TOKENS_FLOOR
+
+
+def test_record_output_uses_the_budget_type(monkeypatch):
+    monkeypatch.setattr(ai_service_v2, "estimate_tokens", len)
+    _record_output("css", {"project_type": "Todo List"}, "x" * 300, 5000)
+    _record_output("css", {"project_type": "blog"}, "x" * 200, 12000)
+    assert list(_output_tokens[("todo list", "css")]) == [300]
+    assert list(_output_tokens[("", "css")]) == [200]